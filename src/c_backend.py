@@ -0,0 +1,360 @@
+import logging
+import datetime
+import threading
+import t_laads
+import t_requests
+import t_earthdata
+import c_retry
+from os import replace
+from os.path import getsize
+from pathlib import Path
+from time import time, sleep
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Class for getting granules from the LAADS HTTPS archive (redirects are followed)
+class HTTPSBackend:
+
+    def __init__(self):
+
+        self.name = 'https'
+
+    # Download a granule (a URL, or a tuple of URL and hash) to a directory, returning (URL, write path or None)
+    def download(self, work, download_dir, status_hook=None):
+
+        return t_laads.get_laads_file(work, download_dir, status_hook=status_hook)
+
+
+# Class for getting granules from the LAADS Earthdata Cloud S3 bucket (or an S3 stand-in such as MinIO or moto)
+class S3Backend:
+
+    def __init__(self,
+                 bucket='prod-lads',
+                 key_format='{product}/{filename}',
+                 endpoint_url=None,
+                 region_name='us-west-2',
+                 credentials_url='https://data.laadsdaac.earthdatacloud.nasa.gov/s3credentials',
+                 session_func=t_earthdata.get_earthdata_session,
+                 part_size=8388608,
+                 max_part_workers=4,
+                 refresh_margin=300,
+                 max_attempts=3,
+                 retry_policy=None):
+
+        self.name = 's3'
+        self.bucket = bucket
+        # Format of object keys (from the product and filename)
+        self.key_format = key_format
+        # Endpoint URL (None for AWS; set for a local stand-in)
+        self.endpoint_url = endpoint_url
+        self.region_name = region_name
+        # URL handing out temporary credentials (None to use boto3's own credential chain, e.g. for a stand-in)
+        self.credentials_url = credentials_url
+        # Function returning an authorized requests session for the credentials URL
+        self.session_func = session_func
+        # Size of each range request, and how many run at once for one granule
+        self.part_size = part_size
+        self.max_part_workers = max_part_workers
+        # Seconds before credentials expire that they are refreshed
+        self.refresh_margin = refresh_margin
+        self.max_attempts = max_attempts
+        # Retry policy (back-off and the shared circuit breaker)
+        self.retry_policy = retry_policy
+        if self.retry_policy is None:
+            self.retry_policy = c_retry.get_retry_policy()
+        # Host name for the circuit breaker
+        self.host = f'{self.bucket}.s3'
+        if self.endpoint_url:
+            self.host = urlsplit(self.endpoint_url).netloc
+
+        # Cached credentials and their expiration time
+        self.credentials = None
+        self.expiration = None
+        # Client (boto3 clients are thread safe) and the credentials it was made with
+        self.client = None
+        self.client_credentials = None
+        self.lock = threading.Lock()
+
+    # Get temporary credentials (cached, and refreshed when close to expiring)
+    # Returns a dictionary of boto3 client arguments, an empty dictionary to use boto3's own chain, or None if failed
+    def get_credentials(self):
+        with self.lock:
+            # If boto3 finds its own credentials (kept as one empty dictionary, so the client is reused)
+            if not self.credentials_url:
+                if self.credentials is None:
+                    self.credentials = {}
+                return self.credentials
+            # If the cached credentials are good for a while yet
+            if self.credentials and datetime.datetime.now(datetime.timezone.utc) < self.expiration:
+                return self.credentials
+        # Ask for new credentials (outside the lock, so other threads are not held up while it is retried)
+        try:
+            r = t_requests.ask_nicely(self.session_func(),
+                                      self.credentials_url,
+                                      session_func=self.session_func,
+                                      validation_func=t_requests.validate_request_json,
+                                      allow_redirects=True)
+        # If a session could not be made (e.g. there is no Earthdata token)
+        except Exception as e:
+            # Log the error
+            logging.error(f'Could not make a session for S3 credentials from {self.credentials_url}: {e!r}')
+            # Return None
+            return None
+        # If unsuccessful
+        if not r:
+            # Log the error
+            logging.error(f'Could not get S3 credentials from {self.credentials_url}.')
+            # Return None
+            return None
+        # Refresh ahead of the expiration (assume an hour if it was not given)
+        expiration = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=1)
+        if r.get('expiration'):
+            expiration = datetime.datetime.fromisoformat(r['expiration'])
+            # Times without a zone are UTC
+            if expiration.tzinfo is None:
+                expiration = expiration.replace(tzinfo=datetime.timezone.utc)
+        with self.lock:
+            # Keep the credentials
+            self.credentials = {'aws_access_key_id': r['accessKeyId'],
+                                'aws_secret_access_key': r['secretAccessKey'],
+                                'aws_session_token': r['sessionToken']}
+            self.expiration = expiration - datetime.timedelta(seconds=self.refresh_margin)
+            # Log the info
+            logging.info(f'Got S3 credentials from {self.credentials_url}, refreshing at {self.expiration}.')
+            # Return the credentials
+            return self.credentials
+
+    # Drop the cached credentials (so the next request gets new ones)
+    def refresh_credentials(self):
+        with self.lock:
+            self.credentials = None
+
+    # Get an S3 client made with the current credentials (None if there are no credentials)
+    def get_client(self):
+        # Get the credentials
+        credentials = self.get_credentials()
+        # If there are none
+        if credentials is None:
+            return None
+        with self.lock:
+            # If there is no client yet, or the credentials have changed
+            if self.client is None or self.client_credentials is not credentials:
+                # Import boto3 here (it is only needed for this backend)
+                import boto3
+                # Make a client
+                self.client = boto3.client('s3',
+                                           endpoint_url=self.endpoint_url,
+                                           region_name=self.region_name,
+                                           **credentials)
+                self.client_credentials = credentials
+            # Return the client
+            return self.client
+
+    # Get the object key for a filename
+    def get_key(self, filename):
+
+        return self.key_format.format(product=filename.split('.')[0], filename=filename)
+
+    # Download a granule (a URL, or a tuple of URL and hash) to a directory, returning (URL, write path or None)
+    def download(self, work, download_dir, status_hook=None):
+        # Break up the work
+        hash_to_check = None
+        if isinstance(work, tuple):
+            url = work[0]
+            hash_to_check = work[1]
+        else:
+            url = work
+        # Try to import the botocore exceptions here (boto3 is only needed for this backend)
+        try:
+            from botocore.exceptions import ClientError, BotoCoreError
+        # If boto3 is not installed
+        except ImportError:
+            # Log an error
+            logging.error('The S3 backend needs boto3, which is not installed.')
+            # Return the URL and None
+            return (url, None)
+        # Get the filename and object key
+        filename = url.split('/')[-1]
+        key = self.get_key(filename)
+        # Write path, and the temporary path written to first
+        write_path = Path(download_dir, filename)
+        part_path = write_path.with_name(write_path.name + '.s3.part')
+        # For each attempt
+        for attempt in range(1, self.max_attempts + 1):
+            # If this is not the first attempt
+            if attempt > 1:
+                # Wait quietly and politely
+                sleep(self.retry_policy.get_delay(attempt - 1))
+            # If the circuit for the bucket is open
+            if not self.retry_policy.allow_request(self.host):
+                # Log an error
+                logging.error(f'Circuit for {self.host} is open, not downloading {key}.')
+                # Break the loop
+                break
+            # Get a client
+            client = self.get_client()
+            if client is None:
+                break
+            # Try to get the object
+            try:
+                self.get_object(client, key, part_path)
+            # If S3 refused
+            except ClientError as e:
+                # Get the status and error codes
+                status_code = e.response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+                error_code = e.response.get('Error', {}).get('Code')
+                # Log the info
+                logging.info(f'Getting s3://{self.bucket}/{key}, attempt {attempt} returned {status_code} ({error_code}).')
+                # Report the status code
+                if status_hook and status_code:
+                    status_hook(status_code)
+                self.retry_policy.record_status(self.host, status_code)
+                # If the credentials have expired or been refused
+                if error_code in ('ExpiredToken', 'InvalidToken', 'InvalidAccessKeyId') or status_code == 403:
+                    # Get new credentials for the next attempt
+                    self.refresh_credentials()
+                # Otherwise, if asking again will not help (e.g. no such key)
+                elif self.retry_policy.get_action(status_code) == 'fail':
+                    break
+                # Move to next attempt
+                continue
+            # If the connection failed or the file could not be written
+            except (BotoCoreError, OSError) as e:
+                # Log the info
+                logging.info(f'Getting s3://{self.bucket}/{key}, attempt {attempt} failed: {e}')
+                # Report the failure
+                self.retry_policy.record_status(self.host, None)
+                # Move to next attempt
+                continue
+            # Report the success
+            if status_hook:
+                status_hook(200)
+            self.retry_policy.record_status(self.host, 200)
+            # If a hash was provided to check against, and it does not match
+            if hash_to_check and t_requests.get_file_md5(part_path) != hash_to_check:
+                # Log a hash match failure
+                logging.info(f'Download of s3://{self.bucket}/{key} did not match hash.')
+                # Remove the partial download
+                t_requests.remove_quietly(part_path)
+                # Move to next attempt
+                continue
+            # Move the finished file into place
+            replace(part_path, write_path)
+            # Log the info
+            logging.info(f'Successfully downloaded s3://{self.bucket}/{key} to {write_path}.')
+            # Return the URL and write path
+            return (url, write_path)
+        # Remove any partial download (parts are not resumed)
+        t_requests.remove_quietly(part_path)
+        # Log the error
+        logging.error(f'Download of s3://{self.bucket}/{key} failed completely.')
+        # Return the URL and None
+        return (url, None)
+
+    # Get an object into a file with parallel range requests
+    def get_object(self, client, key, file_path):
+        # Get the object size
+        size = client.head_object(Bucket=self.bucket, Key=key)['ContentLength']
+        # Make the file at full size, so the parts can be written in place
+        with open(file_path, 'wb') as f:
+            f.truncate(size)
+        # Byte ranges of the parts
+        ranges = [(start, min(start + self.part_size, size) - 1) for start in range(0, size, self.part_size)]
+        # Get the parts in parallel (any exception is raised here)
+        with ThreadPoolExecutor(max_workers=self.max_part_workers) as executor:
+            list(executor.map(lambda part: self.get_range(client, key, file_path, part[0], part[1]), ranges))
+
+    # Get a byte range of an object into the same place in a file
+    def get_range(self, client, key, file_path, start, end):
+        # Get the range
+        body = client.get_object(Bucket=self.bucket, Key=key, Range=f'bytes={start}-{end}')['Body']
+        # Open the file without truncating it
+        with open(file_path, 'r+b') as f:
+            # Move to the start of the range
+            f.seek(start)
+            # Write each chunk
+            for chunk in body.iter_chunks(chunk_size=1048576):
+                f.write(chunk)
+
+
+# Class choosing the fastest of several backends for each granule (by observed throughput, falling back on failure)
+class FastestBackend:
+
+    def __init__(self, backends, smoothing=0.3):
+
+        self.name = 'fastest'
+        self.backends = backends
+        # Weight of the newest throughput observation in the running average
+        self.smoothing = smoothing
+        # Running average throughput (bytes per second) by backend name (None until tried)
+        self.throughput = {backend.name: None for backend in self.backends}
+        self.lock = threading.Lock()
+
+    # Get the backends, fastest first (untried backends first, so each gets measured)
+    def get_ranked_backends(self):
+        with self.lock:
+            return sorted(self.backends,
+                          key=lambda backend: float('inf') if self.throughput[backend.name] is None
+                          else self.throughput[backend.name],
+                          reverse=True)
+
+    # Record a throughput observation for a backend (0 for a failure)
+    def observe(self, backend, throughput):
+        with self.lock:
+            # If this is the first observation
+            if self.throughput[backend.name] is None:
+                self.throughput[backend.name] = throughput
+            # Otherwise, update the running average
+            else:
+                self.throughput[backend.name] = (self.smoothing * throughput
+                                                 + (1 - self.smoothing) * self.throughput[backend.name])
+
+    # Download a granule from the fastest backend that succeeds, returning (URL, write path or None)
+    def download(self, work, download_dir, status_hook=None):
+        # URL of the granule
+        url = work
+        if isinstance(work, tuple):
+            url = work[0]
+        # For each backend, fastest first
+        for backend in self.get_ranked_backends():
+            # Start time
+            stime = time()
+            # Try the backend
+            try:
+                url, write_path = backend.download(work, download_dir, status_hook=status_hook)
+            # If it raised (e.g. boto3 is not installed), treat it as a failure
+            except Exception as e:
+                # Log the error
+                logging.error(f'Backend {backend.name} raised for {url}: {e!r}')
+                write_path = None
+            # If it succeeded
+            if write_path:
+                # Record the throughput
+                self.observe(backend, getsize(write_path) / max(time() - stime, 1e-6))
+                # Return the URL and write path
+                return (url, write_path)
+            # Record the failure
+            self.observe(backend, 0)
+            # Log the info
+            logging.info(f'Backend {backend.name} failed for {url}, trying the next.')
+        # Return the URL and None
+        return (url, None)
+
+
+# Get a granule backend by name ('https', 's3' or 'fastest'), passing backend objects straight through
+def get_backend(backend='https'):
+    # If it is already a backend
+    if not isinstance(backend, str):
+        return backend
+    # Backends by name
+    if backend == 'https':
+        return HTTPSBackend()
+    if backend == 's3':
+        return S3Backend()
+    if backend == 'fastest':
+        return FastestBackend([S3Backend(), HTTPSBackend()])
+    # Log an error
+    logging.error(f'Unknown granule backend {backend}. Use https, s3 or fastest.')
+    # Return None
+    return None
@@ -0,0 +1,208 @@
+import asyncio
+import logging
+import datetime
+import t_misc
+import t_laads
+from time import time, monotonic
+from urllib.parse import urlsplit
+from numpy import around
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Class for crawling a LAADS product directory (product -> years -> DOYs -> files) as a single work queue
+class LAADSCrawler:
+
+    def __init__(self,
+                 product_url,
+                 start_date=None,
+                 end_date=None,
+                 include=None,
+                 exclude=None,
+                 max_concurrency=10,
+                 rate_limit=None,
+                 json_func=t_laads.get_laads_json):
+
+        # URL of the product directory (e.g. {laads_alldata_url}5000/VNP46A2)
+        self.product_url = product_url
+        self.start_date = start_date
+        self.end_date = end_date
+        # Portions of file names to include or exclude
+        self.include = t_misc.listify(include)
+        self.exclude = t_misc.listify(exclude)
+        # Maximum number of directory listings in flight at once
+        self.max_concurrency = max_concurrency
+        # Maximum requests per second to any one host (None for no limit)
+        self.rate_limit = rate_limit
+        # Function that takes a directory URL and returns its json listing (or None)
+        self.json_func = json_func
+
+        # Dictionary of file records (LAADS json entries) by file name
+        self.files = {}
+        # List of directory URLs that could not be listed
+        self.failed_urls = []
+        # Counts of directory listings completed at each level
+        self.listing_counts = {'product': 0, 'year': 0, 'doy': 0}
+
+        # Per-host rate limiting state (created inside the event loop)
+        self.host_locks = {}
+        self.host_next_times = {}
+
+    # Crawl the product and return the dictionary of file records
+    def crawl(self):
+        # Start time
+        stime = time()
+        # Run the crawl in a fresh event loop
+        asyncio.run(self.crawl_async())
+        # Log information
+        logging.info(f"Crawled {self.listing_counts['year']} years and {self.listing_counts['doy']} days"
+                     f" ({len(self.files)} files) from {self.product_url}"
+                     f" in {around(time() - stime, decimals=2)} seconds.")
+        # If any listings failed
+        if self.failed_urls:
+            # Log a warning
+            logging.warning(f"{len(self.failed_urls)} directory listings failed for {self.product_url}.")
+        # Return the file records
+        return self.files
+
+    # Crawl the product within a running event loop
+    async def crawl_async(self):
+        # Single work queue for all levels of the crawl
+        queue = asyncio.Queue()
+        # Seed the queue with the product directory
+        queue.put_nowait(('product', self.product_url, None))
+        # Thread pool sized to the concurrency cap (blocking requests run here)
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            # Start the workers
+            workers = [asyncio.create_task(self.worker(queue, executor)) for _ in range(self.max_concurrency)]
+            # Wait for the queue to be exhausted
+            await queue.join()
+            # Stop the workers
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    # Worker pulling listings from the queue until cancelled
+    async def worker(self, queue, executor):
+        # Reference the running loop
+        loop = asyncio.get_running_loop()
+        # While there is work
+        while True:
+            # Get the next piece of work
+            level, url, year = await queue.get()
+            # Try to process it
+            try:
+                # Respect the per-host rate limit
+                await self.wait_for_host(url)
+                # Get the listing in the thread pool
+                listing = await loop.run_in_executor(executor, self.json_func, url)
+                # If we did not get a listing
+                if not listing:
+                    # Record the failure
+                    self.failed_urls.append(url)
+                # Otherwise
+                else:
+                    # Count the listing
+                    self.listing_counts[level] += 1
+                    # Handle the listing according to its level
+                    self.handle_listing(level, listing, year, queue)
+            # If something unexpected happened
+            except Exception as e:
+                # Log the error
+                logging.error(f"Crawling {url} failed: {e}")
+                # Record the failure
+                self.failed_urls.append(url)
+            # Mark the work as done
+            finally:
+                queue.task_done()
+
+    # Queue children (years or DOYs) or record files from a listing
+    def handle_listing(self, level, listing, year, queue):
+        # For each entry in the listing
+        for entry in listing['content']:
+            # If this is the product listing, entries are years
+            if level == 'product':
+                # If the year passes the date filters
+                if self.check_year(entry['name']):
+                    # Queue the year
+                    queue.put_nowait(('year', t_laads.convert_link_to_url(entry['downloadsLink']), entry['name']))
+            # If this is a year listing, entries are DOYs
+            elif level == 'year':
+                # If the DOY passes the date filters
+                if self.check_doy(year, entry['name']):
+                    # Queue the DOY
+                    queue.put_nowait(('doy', t_laads.convert_link_to_url(entry['downloadsLink']), year))
+            # Otherwise, entries are files
+            elif self.check_filename(entry['name']):
+                # Record the file
+                self.files[entry['name']] = entry
+
+    # Check a year name against the date range
+    def check_year(self, year_name):
+        # Check it is a valid year
+        try:
+            year = int(year_name)
+            datetime.date(year=year, month=1, day=1)
+        except ValueError:
+            logging.warning(f'Year {year_name} in {self.product_url} is not a valid year.')
+            return False
+        # If the year is before the start date year
+        if self.start_date and year < self.start_date.year:
+            return False
+        # If the year is after the end date year
+        if self.end_date and year > self.end_date.year:
+            return False
+        # Return True (passed)
+        return True
+
+    # Check a DOY name against the date range
+    def check_doy(self, year, doy_name):
+        # Get the date of the DOY
+        try:
+            doy_date = t_misc.get_dateobj_from_yeardoy(int(year), int(doy_name))
+        except ValueError:
+            logging.warning(f'DOY {doy_name} of year {year} in {self.product_url} is not a valid DOY.')
+            return False
+        # If the DOY is before the start date
+        if self.start_date and doy_date < self.start_date:
+            return False
+        # If the DOY is after the end date
+        if self.end_date and doy_date > self.end_date:
+            return False
+        # Return True (passed)
+        return True
+
+    # Check a file name against the inclusions and exclusions
+    def check_filename(self, filename):
+        # If any inclusion is not in the file name
+        for include in self.include:
+            if include not in filename:
+                return False
+        # If any exclusion is in the file name
+        for exclude in self.exclude:
+            if exclude in filename:
+                return False
+        # Return True (passed)
+        return True
+
+    # Wait until a request to the URL's host is allowed by the rate limit
+    async def wait_for_host(self, url):
+        # If there is no rate limit
+        if not self.rate_limit:
+            return
+        # Get the host
+        host = urlsplit(url).netloc
+        # Get (or make) the lock for the host
+        if host not in self.host_locks:
+            self.host_locks[host] = asyncio.Lock()
+        # Only one worker reserves a slot for a host at a time
+        async with self.host_locks[host]:
+            # Current time
+            now = monotonic()
+            # Next time a request is allowed
+            next_time = self.host_next_times.get(host, now)
+            # If we need to wait
+            if next_time > now:
+                # Wait for the slot
+                await asyncio.sleep(next_time - now)
+            # Reserve the following slot
+            self.host_next_times[host] = max(now, next_time) + 1 / self.rate_limit
@@ -0,0 +1,257 @@
+import math
+import logging
+import zarr
+import h5py
+import numpy as np
+import t_zarr
+import t_zarr_layout
+import c_roi
+from pathlib import Path
+from time import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+
+# Class for ingesting VNP46A granules into a Zarr store in parallel, with each worker owning whole chunks
+# (arrays are created once up front, and work is split along the chunk grid, so no two workers write one chunk;
+# bands are split along column chunks too when there would otherwise be fewer pieces of work than workers)
+class ZarrIngest:
+
+    def __init__(self,
+                 store_path,
+                 granules,
+                 roi=None,
+                 profile='timeseries',
+                 mask_var='DNB_BRDF-Corrected_NTL',
+                 band_chunks=1,
+                 max_workers=4):
+
+        self.store_path = Path(store_path)
+        # Granules to ingest, as dictionaries with a 'Name', 'Date', 'Tile' and 'Variables'
+        # (variable names to (file path, dataset path) tuples)
+        self.granules = granules
+        # Region of interest (pixel windows and masks of each tile; Puerto Rico if not given)
+        self.roi = roi
+        if self.roi is None:
+            self.roi = c_roi.get_puerto_rico_roi()
+        # Chunk profile of the arrays (see t_zarr_layout)
+        self.profile = profile
+        # Variable whose fills mark pixels that are not written (for every variable)
+        self.mask_var = mask_var
+        # Chunk rows in each piece of work
+        self.band_chunks = band_chunks
+        self.max_workers = max_workers
+
+        # Root group
+        self.root = None
+        # Time axis (start date, step, length)
+        self.time_axis = None
+        # Error by granule name for granules that failed
+        self.failures = {}
+
+        # Spin up the object
+        self.spinup()
+
+    # Set up the store: the time axis (if the store does not have one) and every array, once
+    def spinup(self):
+        # Reference the root group
+        self.root = zarr.group(store=zarr.DirectoryStore(str(self.store_path)), overwrite=False)
+        # If there are no granules, and the store has no time axis
+        if not self.granules and 'Time' not in self.root and 'Date' not in self.root:
+            # Log a warning
+            logging.warning(f'No granules to ingest into {self.store_path}.')
+            # Return (there is nothing to size the store by)
+            return
+        # If the store has no time axis
+        if 'Time' not in self.root and 'Date' not in self.root:
+            # Dates of the granules
+            dates = [granule['Date'] for granule in self.granules]
+            # Write an axis covering them
+            t_zarr.write_time_axis(self.root, min(dates), (max(dates) - min(dates)).days + 1)
+        # Get the time axis
+        self.time_axis = t_zarr.get_time_axis(self.root)
+        # Keep the ROI with the store
+        self.root.attrs['ROI'] = self.roi.get_attrs()
+        # For each tile
+        for tilename in self.get_tilenames():
+            # Shape of each array
+            shape = (self.time_axis[2],) + self.roi.get_window_shape(tilename)
+            # Create a group for the tile (if it does not exist)
+            tile_group = self.root.require_group(tilename, overwrite=False)
+            tile_group.attrs['Min Row'] = self.roi.get_window(tilename)[0]
+            tile_group.attrs['Min Col'] = self.roi.get_window(tilename)[2]
+            # Variables of the tile's granules
+            var_names = set(var_name for granule in self.granules if granule['Tile'] == tilename
+                            for var_name in granule['Variables'].keys())
+            # Create each array (if it does not exist)
+            for var_name in sorted(var_names):
+                t_zarr_layout.require_tile_array(tile_group, var_name, shape, profile=self.profile)
+
+    # Get the names of the tiles of the granules that are in the ROI
+    def get_tilenames(self):
+
+        return sorted(set(granule['Tile'] for granule in self.granules) & set(self.roi.get_tilenames()))
+
+    # Split the granules into pieces of work that each own whole chunks
+    # (a block of time chunks by a band of row chunks by a band of column chunks, of one tile)
+    def get_work(self):
+        # List of work
+        list_of_work = []
+        # If the store could not be set up
+        if self.time_axis is None:
+            return list_of_work
+        # Time index of each granule
+        indexes = {}
+        # For each granule
+        for granule in self.granules:
+            # Get the time index
+            index = t_zarr.get_date_index(self.time_axis, granule['Date'])
+            # If the tile is not in the ROI
+            if granule['Tile'] not in self.roi.get_tilenames():
+                # Record the failure
+                self.failures[granule['Name']] = f"Tile {granule['Tile']} is not in ROI {self.roi.name}."
+            # If the date is not on the axis
+            elif index is None:
+                # Record the failure
+                self.failures[granule['Name']] = f"Date {granule['Date']} is not in the store."
+            # Otherwise
+            else:
+                indexes[granule['Name']] = index
+        # For each tile
+        for tilename in self.get_tilenames():
+            # Window and mask of the tile
+            window = self.roi.get_window(tilename)
+            mask = self.roi.get_mask(tilename)
+            # Get the chunk shape (every variable of a tile has the same)
+            tile_group = self.root[tilename]
+            time_chunk, row_chunk, col_chunk = tile_group[next(iter(tile_group.array_keys()))].chunks
+            # Shape of the window
+            rows, cols = self.roi.get_window_shape(tilename)
+            # Granules of the tile on the axis, as (name, time index, variables)
+            tile_granules = [(granule['Name'], indexes[granule['Name']], granule['Variables'])
+                             for granule in self.granules
+                             if granule['Tile'] == tilename and granule['Name'] in indexes]
+            # Blocks of time with granules, as ((start, end), granules in the block)
+            time_blocks = []
+            for time_start in range(0, self.time_axis[2], time_chunk):
+                time_end = min(time_start + time_chunk, self.time_axis[2])
+                block_granules = [tile_granule for tile_granule in tile_granules
+                                  if time_start <= tile_granule[1] < time_end]
+                if block_granules:
+                    time_blocks.append(((time_start, time_end), block_granules))
+            # Bands of rows
+            band_rows = row_chunk * self.band_chunks
+            row_bands = [(row_start, min(row_start + band_rows, rows)) for row_start in range(0, rows, band_rows)]
+            # Bands of columns (all columns, unless more are needed to give every worker work)
+            col_bands_needed = math.ceil(self.max_workers / max(len(time_blocks) * len(row_bands), 1))
+            band_cols = col_chunk * math.ceil(math.ceil(cols / col_chunk) / col_bands_needed)
+            col_bands = [(col_start, min(col_start + band_cols, cols)) for col_start in range(0, cols, band_cols)]
+            # For each block of time, band of rows and band of columns
+            for time_block, block_granules in time_blocks:
+                for row_band in row_bands:
+                    for col_band in col_bands:
+                        # Add the work
+                        list_of_work.append({'Store': str(self.store_path),
+                                             'Tile': tilename,
+                                             'Time': time_block,
+                                             'Rows': row_band,
+                                             'Cols': col_band,
+                                             'Window': window,
+                                             'ROI Mask': mask[row_band[0]:row_band[1], col_band[0]:col_band[1]],
+                                             'Mask': self.mask_var,
+                                             'Granules': block_granules})
+        # Return the list of work
+        return list_of_work
+
+    # Ingest the granules, returning a dictionary of error by granule name for any that failed
+    def ingest(self):
+        # Start the clock
+        stime = time()
+        # Get the work
+        list_of_work = self.get_work()
+        # Names of the granules with work
+        names = set(tile_granule[0] for work in list_of_work for tile_granule in work['Granules'])
+        # Start a process executor
+        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            # Submit the work
+            futures = {executor.submit(ingest_work, work): work for work in list_of_work}
+            # As each piece of work completes
+            for future in as_completed(futures):
+                # Reference the work
+                work = futures[future]
+                # Try to get the failures
+                try:
+                    work_failures = future.result()
+                # If the piece of work failed as a whole
+                except Exception as e:
+                    # Every granule of the work failed
+                    work_failures = [(tile_granule[0], f'{type(e).__name__}: {e}')
+                                     for tile_granule in work['Granules']]
+                # Record the failures (a granule fails if any of its bands failed)
+                for name, error in work_failures:
+                    self.failures.setdefault(name, error)
+        # Log each failure
+        for name in sorted(self.failures.keys()):
+            logging.error(f'Ingest of {name} failed: {self.failures[name]}')
+        # Log the info
+        logging.info(f'Ingested {len(names - set(self.failures.keys()))} of {len(self.granules)} granules '
+                     f'in {len(list_of_work)} pieces of work, in {np.around(time() - stime, decimals=2)} seconds.')
+        # Return the failures
+        return self.failures
+
+
+# Read a band of a granule's window (variable names to arrays), opening each file once
+def read_granule_band(variables, rows, cols, window):
+    # Arrays by variable
+    arrays = {}
+    # Variables by file
+    files = {}
+    for var_name in variables.keys():
+        files.setdefault(variables[var_name][0], []).append(var_name)
+    # For each file
+    for file_path in files.keys():
+        # Open it
+        with h5py.File(file_path, 'r') as h5file:
+            # Read the band of each variable
+            for var_name in files[file_path]:
+                arrays[var_name] = h5file[variables[var_name][1]][window[0] + rows[0]:window[0] + rows[1],
+                                                                  window[2] + cols[0]:window[2] + cols[1]]
+    # Return the arrays
+    return arrays
+
+
+# Ingest a piece of work from ZarrIngest.get_work (in a worker process), returning (granule name, error) failures
+def ingest_work(work):
+    # Reference the tile group (no synchronizer is needed, as this work owns its chunks)
+    tile_group = zarr.open_group(store=zarr.DirectoryStore(work['Store']), mode='r+')[work['Tile']]
+    # Break up the work
+    time_start, time_end = work['Time']
+    row_start, row_end = work['Rows']
+    col_start, col_end = work['Cols']
+    # Buffers of the block by variable, starting from what is stored (fills where nothing is)
+    buffers = {var_name: tile_group[var_name][time_start:time_end, row_start:row_end, col_start:col_end]
+               for var_name in tile_group.array_keys()}
+    # Fill value of the mask variable
+    mask_fill = t_zarr_layout.get_fill_values()[work['Mask']][1]
+    # List of failures
+    failures = []
+    # For each granule
+    for name, index, variables in work['Granules']:
+        # Try to read the band
+        try:
+            arrays = read_granule_band(variables, work['Rows'], work['Cols'], work['Window'])
+            # Mask of pixels in the ROI with values
+            valid = (arrays[work['Mask']] != mask_fill) & work['ROI Mask']
+        # If it could not be read
+        except (OSError, KeyError) as e:
+            # Record the failure
+            failures.append((name, f'{type(e).__name__}: {e}'))
+            # Move to the next granule
+            continue
+        # Put the valid values of each variable in its buffer
+        for var_name in arrays.keys():
+            buffers[var_name][index - time_start][valid] = arrays[var_name][valid]
+    # Write each buffer (whole chunks, in one write)
+    for var_name in buffers.keys():
+        tile_group[var_name][time_start:time_end, row_start:row_end, col_start:col_end] = buffers[var_name]
+    # Return the failures
+    return failures
@@ -5,14 +5,23 @@ import t_spinup
 import t_misc
 import t_laads
 import t_requests
-from os import environ, walk, mkdir
-from os.path import exists
+import t_catalog
+import t_vnp46a
+import t_validation
+import numpy as np
+import c_crawler
+import c_scheduler
+import c_ledger
+import c_backend
+from os import environ, walk, mkdir, scandir
+from os.path import exists, getsize, getmtime
 from pathlib import Path
 from time import time
 from dotenv import load_dotenv
 from numpy import around
 from shutil import rmtree
-from concurrent.futures import as_completed
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 
 
 # Class LAADS data set (to load when you need it)
@@ -25,7 +34,10 @@ class LAADSDataSet:
                  start_date=None,
                  end_date=None,
                  include=None,
-                 exclude=None):
+                 exclude=None,
+                 refresh=False,
+                 lookback_days=14,
+                 validation=None):
 
         self.name = name
         self.archive_set = archive_set
@@ -35,11 +47,27 @@ class LAADSDataSet:
         # Portions of file names to include or exclude
         self.include = t_misc.listify(include)
         self.exclude = t_misc.listify(exclude)
+        # Refresh the latest catalog on spinup, re-crawling the last lookback_days days
+        self.refresh = refresh
+        self.lookback_days = lookback_days
+        # Validation level for downloaded files (see t_validation.get_validation_levels, stored in the spec)
+        self.validation = validation
 
-        # Dictionaries for indexing the files
-        self.by_date = {}
-        self.by_filename = {}
-        self.by_year_doy = {}
+        # Columnar catalog array (one row per file)
+        self.catalog = None
+        # Download ledger (opened on first use, see get_ledger)
+        self._ledger = None
+
+        # Dictionaries for indexing the files (built on first use, see build_indexes)
+        self._by_date = None
+        self._by_filename = None
+        self._by_year_doy = None
+        self._by_tile = None
+        # Cached ordered lists of tiles and dates
+        self._tile_list = None
+        self._ordered_dates = None
+        # Cached integer tile codes for queries
+        self._tile_codes = None
 
         # Spin up the object
         self.spinup()
@@ -71,6 +99,9 @@ class LAADSDataSet:
                 start_date = self.start_date.strftime('%m/%d/%Y')
             if self.end_date:
                 end_date = self.end_date.strftime('%m/%d/%Y')
+            # Default the validation level (size and superblock checks)
+            if not self.validation:
+                self.validation = 'size'
             # Form output dictionary
             output_dict = {'Name': self.name,
                            'Archive Set': self.archive_set,
@@ -78,7 +109,8 @@ class LAADSDataSet:
                            'Start Date': start_date,
                            'End Date': end_date,
                            'Include': self.include,
-                           'Exclude': self.exclude}
+                           'Exclude': self.exclude,
+                           'Validation': self.validation}
             # Save the specification
             with open(Path(environ["support_dir"], f"{self.name}_dataset_spec.json"), mode='w') as of:
                 json.dump(output_dict, of, indent=4)
@@ -92,6 +124,18 @@ class LAADSDataSet:
             self.get_catalog()
             # Get the date of the latest catalog (or None if there is none)
             catalog_date = self.find_catalog_file()
+            # If no catalog could be made
+            if not catalog_date:
+                # Log an error
+                logging.error(f"No catalog could be made for LAADSDataSet {self.name}.")
+                # Return
+                return
+        # Otherwise, if refreshing the catalog
+        elif self.refresh:
+            # Update the catalog with new or changed days (ingests the result)
+            self.refresh_catalog(lookback_days=self.lookback_days)
+            # Return
+            return
         # Ingest catalog file
         self.ingest_catalog_file(catalog_date)
 
@@ -129,6 +173,9 @@ class LAADSDataSet:
                         self.end_date = datetime.datetime.strptime(dataset_dict['End Date'], '%m/%d/%Y').date()
                     self.include = dataset_dict['Include']
                     self.exclude = dataset_dict['Exclude']
+                    # If no validation level was provided, use the spec's (older specs have none)
+                    if not self.validation:
+                        self.validation = dataset_dict.get('Validation', 'size')
                     # Return True
                     return True
         # Return False (didn't find a file)
@@ -164,47 +211,143 @@ class LAADSDataSet:
     def find_catalog_file(self):
         return self.get_latest_support_file_date(f"{self.name}_catalog_")
 
-    # Ingest a catalog file
-    def ingest_catalog_file(self, catalog_datetime):
+    # Load a catalog file as a columnar catalog array (memory-mapped)
+    def load_catalog_file(self, catalog_datetime):
         # If the date provided is a datetime.date object
         if isinstance(catalog_datetime, datetime.datetime):
             # Convert to string
             catalog_datetime = catalog_datetime.strftime('%m%d%Y_%H%M%S')
         # Assemble path
-        catalog_path = Path(environ['support_dir'], f'{self.name}_catalog_{catalog_datetime}.json')
-        # Open the file
-        with open(catalog_path, mode='r') as f:
-            # Convert to json
-            incoming_catalog = json.load(f)
-        # For each key (File name) in the dictionary
-        for filename in incoming_catalog.keys():
-            # Instantiate an object
-            file_obj = LAADSFile(filename,
-                                 t_laads.get_date_from_filename(filename),
-                                 incoming_catalog[filename])
-            # Store under the default indexing dictionaries
-            self.by_filename[filename] = file_obj
-            # Add sublist for date object key
-            if file_obj.date not in self.by_date.keys():
-                self.by_date[file_obj.date] = []
-            self.by_date[file_obj.date].append(file_obj)
-            # Get year and doy keys
-            year_key = str(file_obj.date.year)
-            doy_key = t_misc.get_doy_from_date(file_obj.date,
-                                               zero_pad_digits=3)
-            # Store by year and doy
-            if year_key not in self.by_year_doy.keys():
-                self.by_year_doy[year_key] = {}
-            if doy_key not in self.by_year_doy[year_key].keys():
-                self.by_year_doy[year_key][doy_key] = []
-            self.by_year_doy[year_key][doy_key].append(file_obj)
+        catalog_path = Path(environ['support_dir'], f'{self.name}_catalog_{catalog_datetime}.npy')
+        # If there is only a (legacy) JSON catalog
+        if not exists(catalog_path):
+            # Convert it to a catalog array
+            catalog_path = t_catalog.convert_json_catalog(catalog_path.with_suffix('.json'))
+        # Load and return the catalog array
+        return t_catalog.load_catalog_array(catalog_path)
+
+    # Save a dictionary of file names and LAADS file records (or hashes) as a new catalog file
+    def save_catalog(self, file_dict):
+        # End datetime string
+        end = datetime.datetime.now().strftime("%m%d%Y_%H%M%S")
+        # Assemble the path to the catalog file
+        output_path = Path(
+            environ["support_dir"], f"{self.name}_catalog_" + end + ".npy")
+        # Save the catalog as a columnar array
+        t_catalog.save_catalog_array(t_catalog.make_catalog_array(file_dict), output_path)
+        # Log information
+        logging.info(f"Output saved to {output_path}.")
+        # Return the output path
+        return output_path
+
+    # Ingest a catalog file
+    def ingest_catalog_file(self, catalog_datetime):
+        # Load the catalog
+        self.catalog = self.load_catalog_file(catalog_datetime)
+        # Reset the indexes (rebuilt from the new catalog on first use)
+        self.reset_indexes()
+
+    # Reset the indexing dictionaries and cached lists
+    def reset_indexes(self):
+        self._by_date = None
+        self._by_filename = None
+        self._by_year_doy = None
+        self._by_tile = None
+        self._tile_list = None
+        self._ordered_dates = None
+        self._tile_codes = None
+
+    # Build all the indexing dictionaries in a single pass over the catalog columns
+    def build_indexes(self):
+        # Start time
+        stime = time()
+        # New indexing dictionaries
+        by_date = {}
+        by_filename = {}
+        by_year_doy = {}
+        by_tile = {}
+        # If there is a catalog
+        if self.catalog is not None:
+            # Dates by days since the catalog epoch (each date object is made once)
+            dates = {}
+            # For each row of the catalog columns
+            for filename, days, md5 in zip(t_catalog.get_filenames(self.catalog),
+                                           self.catalog['date'].tolist(),
+                                           t_catalog.get_hashes(self.catalog)):
+                # If the date has not been seen yet
+                if days not in dates:
+                    # Make the date object
+                    dates[days] = t_catalog.get_date_from_days(days)
+                    # Add sublists for the date, year and doy keys
+                    by_date[dates[days]] = []
+                    year_key = str(dates[days].year)
+                    doy_key = t_misc.get_doy_from_date(dates[days], zero_pad_digits=3)
+                    if year_key not in by_year_doy.keys():
+                        by_year_doy[year_key] = {}
+                    by_year_doy[year_key][doy_key] = by_date[dates[days]]
+                # Instantiate an object
+                file_obj = LAADSFile(filename, dates[days], md5)
+                # Store by filename
+                by_filename[filename] = file_obj
+                # Store by date (shared with the year and doy sublist)
+                by_date[file_obj.date].append(file_obj)
+                # Get the tile name
+                tilename = t_laads.get_tilename_from_filename(filename)
+                # Store by tile
+                if tilename not in by_tile.keys():
+                    by_tile[tilename] = []
+                by_tile[tilename].append(file_obj)
+        # Set the indexes
+        self._by_date = by_date
+        self._by_filename = by_filename
+        self._by_year_doy = by_year_doy
+        self._by_tile = by_tile
+        # Log information
+        logging.info(f"Indexes for LAADSDataSet {self.name} built in {around(time() - stime, decimals=2)} seconds.")
+
+    # Files by filename
+    @property
+    def by_filename(self):
+        # If the indexes have not been built
+        if self._by_filename is None:
+            # Build them
+            self.build_indexes()
+        return self._by_filename
+
+    # Lists of files by date
+    @property
+    def by_date(self):
+        # If the indexes have not been built
+        if self._by_date is None:
+            # Build them
+            self.build_indexes()
+        return self._by_date
+
+    # Lists of files by year, then doy
+    @property
+    def by_year_doy(self):
+        # If the indexes have not been built
+        if self._by_year_doy is None:
+            # Build them
+            self.build_indexes()
+        return self._by_year_doy
+
+    # Lists of files by tile name
+    @property
+    def by_tile(self):
+        # If the indexes have not been built
+        if self._by_tile is None:
+            # Build them
+            self.build_indexes()
+        return self._by_tile
 
     # Find the latest download file
     def find_download_file(self):
         return self.get_latest_support_file_date(f"{self.name}_download_")
 
-    # Get a brand new catalog based on a LAADSDataSet object
-    def get_catalog(self):
+    # Get a brand new catalog based on a LAADSDataSet object, returning the URLs of any listings that failed
+    # (a catalog missing failed listings is only saved if allow_partial, with a record of the failed URLs)
+    def get_catalog(self, max_concurrency=10, rate_limit=None, allow_partial=False):
 
         # Start time
         stime = time()
@@ -213,132 +356,168 @@ class LAADSDataSet:
         logging.info(f"Starting retrieval of catalog for {self.product}"
                      f" from archive set {self.archive_set}.")
 
-        # URL for the archive set + product
-        product_url = environ['laads_alldata_url'] + f'{self.archive_set}/{self.product}'
+        # Crawl years, DOYs and files through a single bounded work queue
+        crawler = self.get_crawler(max_concurrency=max_concurrency, rate_limit=rate_limit)
+        file_records = crawler.crawl()
 
-        # Get a json of the years
-        years_json = t_laads.get_laads_json(product_url)
+        # Close the crawl threads' LAADS sessions
+        t_laads.get_session_provider().close()
 
-        # If we did not get a years json
-        if not years_json:
+        # If we could not even list the product
+        if crawler.listing_counts['product'] == 0:
             # Stop here
-            return
+            return crawler.failed_urls
 
-        # List for the years urls
-        years_urls = []
-        # For each year in the json
-        for year in years_json['content']:
-            # Reference year name
-            year_name = year['name']
-            # Check it is a valid year
-            try:
-                curr_date = datetime.date(year=(int(year_name)),
-                                          day=1,
-                                          month=1)
-            except:
-                logging.warning(f'Year {year_name} in product {self.product}'
-                                f' in Archive Set {self.archive_set} is not a valid year.')
-                # Skip the year
-                continue
-            # If the year is before the start date year
-            if self.start_date:
-                if int(year['name']) < self.start_date.year:
-                    # Skip it
-                    continue
-            # If the year is after the end date year
-            if self.end_date:
-                if int(year['name']) > self.end_date.year:
-                    # Skip it
-                    continue
-            # Get the URL and append to list
-            years_urls.append(t_laads.convert_link_to_url(year['downloadsLink']))
-        # List for the doys urls
-        doys_urls = []
-
-        # Multithread crawl through the years
-        futures = t_misc.multithread(t_laads.get_laads_json, years_urls, as_completed_yield=True)
-
-        # For each future
-        for future in futures:
-            # For each doy in the result
-            for doy in future.result()['content']:
-                # Get the URL
-                doy_url = t_laads.convert_link_to_url(doy['downloadsLink'])
-                # Get the year
-                year = doy_url.split('/')[-2]
-                # If the dataset has a specified start date
-                if self.start_date:
-                    # If the doy is before the start date
-                    if t_misc.get_dateobj_from_yeardoy(int(year), int(doy['name'])) < self.start_date:
-                        # Skip the DOY
-                        continue
-                # If the dataset has a specified end date
-                if self.end_date:
-                    # If the doy is after the end date
-                    if t_misc.get_dateobj_from_yeardoy(int(year), int(doy['name'])) > self.end_date:
-                        # Skip the DOY
-                        continue
-                # Add the URL to the list
-                doys_urls.append(doy_url)
-        # Log information
-        logging.info(f"Total of {len(doys_urls)} days entering multithreaded crawling.")
-
-        # Multithread crawl through the days
-        futures = t_misc.multithread(t_laads.get_laads_json, doys_urls, as_completed_yield=True)
-
-        # Dictionary for files
-        file_dict = {}
-
-        # For each future
-        for future in futures:
-            # For each file in the result
-            for file in future.result()['content']:
-                # If there are inclusions
-                if self.include:
-                    # Pass inclusions switch
-                    pass_includes = True
-                    # For each inclusion
-                    for include in self.include:
-                        # If the inclusion is not in the file name
-                        if include not in file['name']:
-                            # Flip the switch
-                            pass_includes = False
-                    # If failed any includes
-                    if not pass_includes:
-                        # Skip the file
-                        continue
-                # If there are exclusions
-                if self.exclude:
-                    # Pass exclusions switch
-                    pass_excludes = True
-                    # For each exclusion
-                    for exclude in self.exclude:
-                        # If the exclusion is in the file name
-                        if exclude in file['name']:
-                            # Flip the switch
-                            pass_excludes = False
-                    # If failed any excludes
-                    if not pass_excludes:
-                        # Skip the file
-                        continue
-                # Add to file dictionary
-                file_dict[file['name']] = file['md5sum']
+        # If some listings failed, and a partial catalog is not wanted
+        if crawler.failed_urls and not allow_partial:
+            # Log an error
+            logging.error(f"{len(crawler.failed_urls)} listings failed for {self.product} in Archive Set"
+                          f" {self.archive_set}. Not saving a partial catalog.")
+            # Return the failed URLs
+            return crawler.failed_urls
 
         logging.info(f"File catalog for {self.product} in Archive Set {self.archive_set}"
                      f" retrieved in {around(time() - stime, decimals=2)} seconds. Writing output...")
 
-        # End datetime string
-        end = datetime.datetime.now().strftime("%m%d%Y_%H%M%S")
+        # Save the catalog
+        output_path = self.save_catalog(file_records)
 
-        # Assemble the path to the catalog file
-        output_path = Path(
-            environ["support_dir"], f"{self.name}_catalog_" + end + ".json")
+        # If some listings failed
+        if crawler.failed_urls:
+            # Mark the catalog as partial, with the failed URLs alongside it
+            with open(output_path.with_name(output_path.name.replace('_catalog_', '_partial_')).with_suffix('.json'),
+                      'w') as of:
+                json.dump({'Failed URLs': crawler.failed_urls}, of, indent=4)
+            # Log a warning
+            logging.warning(f"Saved a partial catalog for LAADSDataSet {self.name}"
+                            f" ({len(crawler.failed_urls)} listings failed).")
 
-        # When we're finished, save the dictionary
-        with open(output_path, 'w') as of:
-            json.dump(file_dict, of, indent=4)
+        # Return the failed URLs (empty if the catalog is complete)
+        return crawler.failed_urls
 
-        logging.info(f"Output saved to {output_path}.")
+    # Get a crawler for the dataset's product (optionally over a narrower date range)
+    def get_crawler(self, start_date=None, end_date=None, max_concurrency=10, rate_limit=None):
+        # URL for the archive set + product
+        product_url = environ['laads_alldata_url'] + f'{self.archive_set}/{self.product}'
+        # Default to the dataset's date range
+        if not start_date:
+            start_date = self.start_date
+        if not end_date:
+            end_date = self.end_date
+        # Return the crawler
+        return c_crawler.LAADSCrawler(product_url,
+                                      start_date=start_date,
+                                      end_date=end_date,
+                                      include=self.include,
+                                      exclude=self.exclude,
+                                      max_concurrency=max_concurrency,
+                                      rate_limit=rate_limit)
+
+    # Update the latest catalog by re-crawling only days after its last date (plus a look-back window)
+    def refresh_catalog(self, lookback_days=14, max_concurrency=10, rate_limit=None):
+        # Get the date of the latest catalog (or None if there is none)
+        catalog_date = self.find_catalog_file()
+        # If there is no catalog to refresh
+        if not catalog_date:
+            # Log information
+            logging.info(f"No catalog found to refresh for LAADSDataSet {self.name}. Getting a new catalog.")
+            # Make a new catalog and ingest it (if one could be made)
+            self.get_catalog(max_concurrency=max_concurrency, rate_limit=rate_limit)
+            if self.find_catalog_file():
+                self.ingest_catalog_file(self.find_catalog_file())
+            # Return None (no change record)
+            return None
+        # Start time
+        stime = time()
+        # Load the old catalog
+        old_array = self.load_catalog_file(catalog_date)
+        # Get the old catalog's file records
+        old_catalog = t_catalog.get_catalog_records(old_array)
+        # Get the date of each file in the old catalog (days since the catalog epoch)
+        old_dates = dict(zip(old_catalog.keys(), old_array['date'].tolist()))
+        # Start of the re-crawl window (the whole dataset if the catalog is empty)
+        window_start = self.start_date
+        # If there were files in the old catalog
+        if old_dates:
+            # Start the window lookback_days before the last date
+            window_start = t_catalog.get_date_from_days(old_array['date'].max()) - \
+                           datetime.timedelta(days=lookback_days)
+            # Do not go before the dataset's start date
+            if self.start_date and window_start < self.start_date:
+                window_start = self.start_date
+        # Log information
+        logging.info(f"Refreshing catalog for LAADSDataSet {self.name} from {window_start}.")
+        # Crawl the window
+        crawler = self.get_crawler(start_date=window_start, max_concurrency=max_concurrency, rate_limit=rate_limit)
+        file_records = crawler.crawl()
+        # Close the crawl threads' LAADS sessions
+        t_laads.get_session_provider().close()
+        # If we could not even list the product
+        if crawler.listing_counts['product'] == 0:
+            # Log an error
+            logging.error(f"Could not refresh catalog for LAADSDataSet {self.name}. Keeping the old catalog.")
+            # Ingest the old catalog
+            self.ingest_catalog_file(catalog_date)
+            # Return None (no change record)
+            return None
+        # Change record
+        changes = {'Window Start': None,
+                   'Added': [],
+                   'Changed': [],
+                   'Removed': []}
+        # If there was a window start
+        if window_start:
+            # Record it
+            changes['Window Start'] = window_start.strftime('%m/%d/%Y')
+        # Merged catalog
+        new_catalog = {}
+        # For each file in the old catalog
+        for filename in old_catalog.keys():
+            # If the file is before the window
+            if window_start and old_dates[filename] < t_catalog.get_days_from_date(window_start):
+                # Keep it
+                new_catalog[filename] = old_catalog[filename]
+            # Otherwise, if it was not found in the window
+            elif filename not in file_records.keys():
+                # If some listings failed, absence does not mean removal
+                if crawler.failed_urls:
+                    # Keep it
+                    new_catalog[filename] = old_catalog[filename]
+                # Otherwise
+                else:
+                    # Record the removal
+                    changes['Removed'].append(filename)
+        # For each file crawled in the window
+        for filename in file_records.keys():
+            # Add to the merged catalog
+            new_catalog[filename] = file_records[filename]
+            # If it is new
+            if filename not in old_catalog.keys():
+                # Record the addition
+                changes['Added'].append(filename)
+            # Otherwise, if the hash changed
+            elif old_catalog[filename]['md5sum'] != new_catalog[filename]['md5sum']:
+                # Record the change
+                changes['Changed'].append(filename)
+        # Save the merged catalog
+        output_path = self.save_catalog(new_catalog)
+        # Save the change record alongside it
+        with open(output_path.with_name(output_path.name.replace('_catalog_', '_changes_')).with_suffix('.json'),
+                  'w') as of:
+            json.dump(changes, of, indent=4)
+        # Log information
+        logging.info(f"Catalog for LAADSDataSet {self.name} refreshed in {around(time() - stime, decimals=2)}"
+                     f" seconds: {len(changes['Added'])} added, {len(changes['Changed'])} changed,"
+                     f" {len(changes['Removed'])} removed.")
+        # If some listings failed
+        if crawler.failed_urls:
+            # Log a warning
+            logging.warning(f"{len(crawler.failed_urls)} listings failed while refreshing {self.name}."
+                            f" Removals in the window were not recorded.")
+        # Ingest the merged catalog
+        self.ingest_catalog_file(self.find_catalog_file())
+        # Return the change record
+        return changes
 
     # Get a URL from a filename
     def get_url_from_filename(self, filename):
@@ -352,8 +531,127 @@ class LAADSDataSet:
                f'/{doy}' + \
                f'/{filename}'
 
-    # Download the whole catalog
-    def download_catalog(self, from_scratch=False, chunk_size=20):
+    # Select files from the catalog (all criteria must match; returns the matching catalog rows)
+    def query(self,
+              tiles=None,
+              bbox=None,
+              start_date=None,
+              end_date=None,
+              weekdays=None,
+              doys=None,
+              doy_stride=None,
+              collections=None):
+        # Start time
+        stime = time()
+        # Start with every file selected
+        mask = np.ones(self.catalog.shape[0], dtype=bool)
+        # If there are tiles (names like 'h11v07' or (h, v) tuples)
+        if tiles:
+            # Code the tiles as integers (h * 100 + v)
+            tile_codes = [t_vnp46a.get_tile_code(tile) for tile in t_misc.listify(tiles)]
+            # Select the tiles
+            mask &= np.isin(self.get_tile_codes(), tile_codes)
+        # If there is a bounding box (min lon, min lat, max lon, max lat)
+        if bbox:
+            # Select the tiles that intersect the box
+            mask &= np.isin(self.get_tile_codes(), t_vnp46a.get_tile_codes_from_bbox(*bbox))
+        # If there is a start date
+        if start_date:
+            mask &= self.catalog['date'] >= t_catalog.get_days_from_date(start_date)
+        # If there is an end date
+        if end_date:
+            mask &= self.catalog['date'] <= t_catalog.get_days_from_date(end_date)
+        # If there are days of the week (Monday is 0, as in datetime.date.weekday())
+        if weekdays is not None:
+            # The catalog epoch (01/01/1970) was a Thursday (3)
+            mask &= np.isin((self.catalog['date'] + 3) % 7, t_misc.listify(weekdays))
+        # If there are DOYs
+        if doys:
+            mask &= np.isin(self.catalog['doy'], [int(doy) for doy in t_misc.listify(doys)])
+        # If there is a DOY stride (every nth DOY from DOY 1)
+        if doy_stride:
+            mask &= (self.catalog['doy'] - 1) % doy_stride == 0
+        # If there are collections
+        if collections:
+            mask &= np.isin(self.catalog['collection'], [int(collection) for collection in
+                                                         t_misc.listify(collections)])
+        # Get the selection
+        selection = self.catalog[mask]
+        # Log information
+        logging.info(f"Query selected {selection.shape[0]} of {self.catalog.shape[0]} files in LAADSDataSet"
+                     f" {self.name} in {around(time() - stime, decimals=4)} seconds.")
+        # Return the selection
+        return selection
+
+    # Get the integer tile code (h * 100 + v) of every file in the catalog (-101 if not tiled)
+    def get_tile_codes(self):
+        # If the codes have not been computed yet
+        if self._tile_codes is None:
+            # Compute them from the tile columns
+            self._tile_codes = self.catalog['tile_h'].astype('i2') * 100 + self.catalog['tile_v']
+        # Return the codes
+        return self._tile_codes
+
+    # Read a window of datasets from a file in the catalog without downloading it (dictionary of arrays by name)
+    # rows and cols are (min, max) tuples (None for all), or come from the window of the file's tile in a c_roi.ROI
+    # dataset_names default to the product's expected datasets
+    def read_subset(self, filename, dataset_names=None, rows=None, cols=None, roi=None):
+        # If no datasets were named
+        if dataset_names is None:
+            dataset_names = t_vnp46a.get_expected_datasets(self.product)
+        # If there is a region of interest
+        if roi is not None:
+            # Get the window of the file's tile
+            window = roi.get_window(t_vnp46a.get_components_from_filename(filename, tilename=True))
+            # If the tile is not in the ROI
+            if window is None:
+                # Log an error
+                logging.error(f'{filename} is not in ROI {roi.name}.')
+                # Return None
+                return None
+            # Read the window
+            rows = window[:2]
+            cols = window[2:]
+        # Read the subset
+        file_url, subset = t_laads.get_laads_subset(self.get_url_from_filename(filename),
+                                                    dataset_names,
+                                                    t_vnp46a.get_data_fields_path(),
+                                                    rows=rows,
+                                                    cols=cols)
+        # Return the arrays (None if unsuccessful)
+        return subset
+
+    # Read a window of datasets from each file of a selection (or the whole catalog) without downloading them
+    # Yields (filename, dictionary of arrays by name, or None if unsuccessful) as each file is read
+    def read_subsets(self, selection=None, dataset_names=None, rows=None, cols=None, max_workers=5, roi=None):
+        # If there is no selection
+        if selection is None:
+            selection = self.catalog
+        # Filenames to read
+        filenames = t_catalog.get_filenames(selection)
+        # If there is a region of interest
+        if roi is not None:
+            # Only read the files of its tiles
+            filenames = [filename for filename in filenames
+                         if t_vnp46a.get_components_from_filename(filename, tilename=True) in roi.get_tilenames()]
+        # Read each file's subset in a thread
+        mt_func = partial(self.read_subset, dataset_names=dataset_names, rows=rows, cols=cols, roi=roi)
+        # Submit the work
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(mt_func, filename): filename for filename in filenames}
+            # For each completed read
+            for future in as_completed(futures):
+                # Yield the filename and arrays
+                yield futures[future], future.result()
+
+    # Download the whole catalog (or a selection of it from query)
+    # (verify checks the files already on disk against the catalog first, see verify_local)
+    # (backend is 'https', 's3', 'fastest' or a backend object, see c_backend)
+    def download_catalog(self, from_scratch=False, selection=None, max_workers=5, per_host_limit=None, verify=False,
+                         validation_workers=2, backend='https'):
+        # If there is nothing to download from
+        if selection is None and not self.has_catalog():
+            return
         # Directory to download to
         download_dir = Path(environ['inputs_dir'], self.name)
         # If there is a directory to store the files
@@ -368,99 +666,268 @@ class LAADSDataSet:
         else:
             # Make the directory
             mkdir(download_dir)
+        # If verifying the files on disk, or starting from scratch (the removed files are marked missing)
+        if verify or from_scratch:
+            # Reconcile the ledger with the files on disk
+            self.verify_local()
         # Get the download record to date
         download_dict = self.get_download_record()
-        # List of work for multithreading
+        # List of work for the download scheduler
         list_of_work = []
-        # Empty list for chunk of work
-        chunk = []
-        # File count
-        file_count = 0
-        # For each filename
-        for filename in self.by_filename.keys():
-            # If the file is already in the download dictionary
-            if filename in download_dict.keys():
-                # If the status is anything other than True
-                if not download_dict[filename]:
-                    # Add tuple of URL and hash to the chunk
-                    chunk.append((self.get_url_from_filename(filename), self.by_filename[filename].hash))
-            # Otherwise (not in download dictionary)
-            else:
-                # Add tuple of URL and hash to the chunk
-                chunk.append((self.get_url_from_filename(filename), self.by_filename[filename].hash))
-            # If the chunk has reach the max size
-            if len(chunk) == chunk_size:
-                # Add to file count
-                file_count += chunk_size
-                # Append chunk to the list of work
-                list_of_work.append(chunk)
-                # Reinitialize the chunk
-                chunk = []
-        # If there are any files in the final chunk
-        if len(chunk) > 0:
-            # Add to file count
-            file_count += len(chunk)
-            # Append chunk to the list of work
-            list_of_work.append(chunk)
+        # If there is no selection
+        if selection is None:
+            # Download the whole catalog
+            selection = self.catalog
+        # For each filename and hash
+        for filename, file_hash in zip(t_catalog.get_filenames(selection), t_catalog.get_hashes(selection)):
+            # If the file has not been downloaded successfully yet
+            if not download_dict.get(filename):
+                # Add tuple of URL and hash to the list of work
+                list_of_work.append((self.get_url_from_filename(filename), file_hash))
+        # If there is nothing to download
+        if not list_of_work:
+            # Log information
+            logging.info(f'No files to download for LAADSDataSet {self.name}.')
+            # Return
+            return
         # Log information about the list of work
-        logging.info(f'Sending {file_count} files in {len(list_of_work)} chunks to multithreaded download.')
+        logging.info(f'Sending {len(list_of_work)} files to download with {max_workers} workers.')
         # Mark start time
         stime = time()
-        # Get datetime string
-        now_str = datetime.datetime.now().strftime("%m%d%Y_%H%M%S")
-
-        # Open a download log in write mode
-        of = open(Path(environ['support_dir'],
-                           f'{self.name}_download_{now_str}.txt'),
-                  mode='w')
-
-        # Get the file suffix for the first file
-        file_suffix = list(self.by_filename.keys())[0].split('.')[-1]
-        # Set multithread function to h5
-        mt_func = t_laads.get_laads_hdf5
-        # If this is a hdf4 catalog
-        if file_suffix == 'hdf':
-            # Swap the multithread function for HDF4 retrieval
-            mt_func = t_laads.get_laads_hdf4
-        # While there are chunks to process
-        while list_of_work:
-            # Pop a chunk to process
-            current_chunk = list_of_work.pop()
-            # Multithread
-            futures = t_misc.multithread(mt_func, current_chunk, as_completed_yield=True)
-            # For each future as it is completed
-            for future in as_completed(futures):
-                # Split out the file and filename
-                file = future.result()[1]
-                filename = future.result()[0].split('/')[-1]
-                # If we did not get the file
-                if not file:
-                    # Write a line to the download log
-                    of.write(f'{filename} False\n')
-                # Otherwise, if we did not get content
-                elif not file.content:
-                    # Write a line to the download log
-                    of.write(f'{filename} False\n')
+        # Get the granule backend
+        backend = c_backend.get_backend(backend)
+        # If there is no backend
+        if backend is None:
+            # Return
+            return
+        # Expected file sizes by filename (for validation)
+        sizes = dict(zip(t_catalog.get_filenames(selection), selection['size'].tolist()))
+        # Reference the download ledger
+        ledger = self.get_ledger()
+        # Pool validating the written files, off the download threads
+        validation_pool = ThreadPoolExecutor(max_workers=validation_workers)
+        # Validation futures by filename
+        validation_futures = {}
+        # Scheduler feeding one persistent set of workers (adapts concurrency to 429/503 responses)
+        scheduler = c_scheduler.DownloadScheduler(max_workers=max_workers, per_host_limit=per_host_limit)
+        # Download each file, recording the outcome in the ledger from the worker
+        mt_func = partial(self.download_file,
+                          download_dir=download_dir,
+                          ledger=ledger,
+                          backend=backend,
+                          status_hook=scheduler.observe_status)
+        # Successful downloads
+        successes = 0
+        # For each download as it is completed
+        for work, result in scheduler.run(mt_func, list_of_work):
+            # If the file was written
+            if result:
+                # Get the filename
+                filename = work[0].split('/')[-1]
+                # Validate it in the pool
+                validation_futures[filename] = validation_pool.submit(self.validate_file,
+                                                                      result,
+                                                                      expected_size=sizes.get(filename))
+        # Close the download threads' LAADS sessions
+        t_laads.get_session_provider().close()
+        # For each validation
+        for filename, future in validation_futures.items():
+            # If the file is valid
+            if future.result():
+                # Count it
+                successes += 1
+            # Otherwise
+            else:
+                # Move the file aside (its hash may have matched, so it is kept for inspection)
+                t_validation.quarantine_file(Path(download_dir, filename))
+                # Record the failure
+                ledger.record(filename, False, attempts=0, error=f'Failed {self.validation} validation')
+        # Shut down the validation pool
+        validation_pool.shutdown()
+        # Write any held ledger records
+        ledger.flush()
+        # Report on the overall time taken
+        logging.info(f"All downloads finished in {around(time() - stime, decimals=2)} seconds"
+                     f" ({successes} of {len(list_of_work)} succeeded).")
+
+    # Download a file into the download directory, recording the attempt in the ledger
+    def download_file(self, work, download_dir, ledger, backend=None, status_hook=None):
+        # If no backend was given
+        if backend is None:
+            # Use the HTTPS archive
+            backend = c_backend.HTTPSBackend()
+        # Start time
+        stime = time()
+        # Status codes of the requests made
+        status_codes = []
+
+        # Record each status code before passing it on
+        def record_status(status_code):
+            status_codes.append(status_code)
+            if status_hook:
+                status_hook(status_code)
+
+        # Download the file straight into the download directory
+        file_url, write_path = backend.download(work, download_dir, status_hook=record_status)
+        # Get the filename
+        filename = file_url.split('/')[-1]
+        # If the file was written
+        if write_path:
+            # Record the success
+            ledger.record(filename,
+                          True,
+                          size=getsize(write_path),
+                          md5=work[1],
+                          attempts=max(len(status_codes), 1),
+                          duration=time() - stime,
+                          mtime=getmtime(write_path))
+        # Otherwise
+        else:
+            # Describe the error
+            error = 'No response'
+            if status_codes:
+                error = f'Failed after status code {status_codes[-1]}'
+            # Record the failure
+            ledger.record(filename,
+                          False,
+                          attempts=max(len(status_codes), 1),
+                          error=error,
+                          duration=time() - stime)
+        # Return the write path (None if unsuccessful)
+        return write_path
+
+    # Validate a downloaded file to the data set's validation level
+    def validate_file(self, file_path, expected_size=None):
+        # If it is not a HDF5 file
+        if Path(file_path).suffix != '.h5':
+            # Return True (only HDF5 files are validated)
+            return True
+        # Datasets expected in the product's granules (deep validation only opens the file if there are none)
+        dataset_names = t_vnp46a.get_expected_datasets(self.product)
+        group_path = None
+        if dataset_names:
+            group_path = t_vnp46a.get_data_fields_path()
+        # Validate the file
+        valid = t_validation.validate_file_hdf5(file_path,
+                                                level=self.validation,
+                                                expected_size=expected_size,
+                                                group_path=group_path,
+                                                dataset_names=dataset_names)
+        # If it was not valid
+        if not valid:
+            # Log the error
+            logging.error(f'{file_path} failed {self.validation} validation.')
+        # Return the result
+        return valid
+
+    # Verify the files on disk against the catalog MD5 hashes, reconciling the download ledger with what is there
+    # (files unchanged in size and modification time since they were last verified are not hashed again)
+    def verify_local(self, max_workers=None, force=False):
+        # Directory the files are downloaded to
+        download_dir = Path(environ['inputs_dir'], self.name)
+        # Reference the download ledger
+        ledger = self.get_ledger()
+        # Catalog hashes and sizes by filename
+        catalog_dict = t_catalog.get_catalog_records(self.catalog)
+        # Sizes, modification times and hashes of the files verified before
+        success_stats = ledger.get_success_stats()
+        # Files to hash, with their sizes and modification times
+        to_hash = {}
+        # Files on disk
+        on_disk = set()
+        # Verification results by filename
+        verify_dict = {}
+        # Mark start time
+        stime = time()
+        # If there is a download directory
+        if exists(download_dir):
+            # For each entry in it
+            for entry in scandir(download_dir):
+                # If it is not a catalog file (e.g. a partial download)
+                if not entry.is_file() or entry.name not in catalog_dict.keys():
+                    continue
+                # Note it is on disk
+                on_disk.add(entry.name)
+                # Get the size and modification time
+                stat = entry.stat()
+                # Reference the catalog record
+                record = catalog_dict[entry.name]
+                # If the size does not match the catalog (when the catalog has it)
+                if record['size'] >= 0 and stat.st_size != record['size']:
+                    # Record the failure without hashing
+                    ledger.record(entry.name, False, attempts=0, error='Local file size does not match the catalog')
+                    verify_dict[entry.name] = False
+                # Otherwise, if the file is unchanged since it was verified against the same hash
+                elif not force and success_stats.get(entry.name) == (stat.st_size, stat.st_mtime, record['md5sum']):
+                    # Skip it
+                    verify_dict[entry.name] = True
                 # Otherwise
                 else:
-                    # Get the write path for the file
-                    write_path = Path(environ['inputs_dir'], self.name, filename)
-                    # Write the file locally
-                    write_result = t_misc.write_bytes(file.content, write_path)
-                    # If the result was successful
-                    if write_result:
-                        # Write a line to the download log
-                        of.write(f'{filename} True\n')
+                    # Hash it
+                    to_hash[entry.name] = (stat.st_size, stat.st_mtime)
+        # If there are files to hash
+        if to_hash:
+            # Log information
+            logging.info(f'Hashing {len(to_hash)} local files for LAADSDataSet {self.name}.')
+            # Hash the files in parallel processes
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                # For each file and its hash
+                for filename, md5 in zip(to_hash.keys(),
+                                         executor.map(t_requests.get_file_md5,
+                                                      [Path(download_dir, filename) for filename in to_hash.keys()],
+                                                      chunksize=4)):
+                    # Reference the size and modification time
+                    size, mtime = to_hash[filename]
+                    # If the hash matches the catalog
+                    if md5 == catalog_dict[filename]['md5sum']:
+                        # Record the success
+                        ledger.record(filename, True, size=size, md5=md5, attempts=0, mtime=mtime)
+                        verify_dict[filename] = True
                     # Otherwise
                     else:
-                        # Write a line to the download log
-                        of.write(f'{filename} False\n')
-        # Close the log file
-        of.close()
-        # Report on the overall time taken
-        logging.info(f"All downloads finished in {around(time() - stime, decimals=2)} seconds.")
+                        # Record the failure
+                        ledger.record(filename, False, attempts=0, error='Local file hash does not match the catalog')
+                        verify_dict[filename] = False
+        # For each file marked downloaded but missing from disk
+        for filename in success_stats.keys():
+            if filename in catalog_dict.keys() and filename not in on_disk:
+                # Record it as failed so it is downloaded again
+                ledger.record(filename, False, attempts=0, error='Local file is missing')
+                verify_dict[filename] = False
+        # Write the ledger records
+        ledger.flush()
+        # Log information
+        logging.info(f'Verified {len(verify_dict)} local files for LAADSDataSet {self.name} '
+                     f'({sum(verify_dict.values())} good, {len(to_hash)} hashed) '
+                     f'in {around(time() - stime, decimals=2)} seconds.')
+        # Return the verification results
+        return verify_dict
+
+    # Get the download ledger (opened on first use; old text download logs are imported when it is created)
+    def get_ledger(self):
+        # If the ledger is not open yet
+        if self._ledger is None:
+            # Open it
+            self._ledger = c_ledger.DownloadLedger(Path(environ['support_dir'], f'{self.name}_ledger.sqlite'))
+            # If it was just created
+            if self._ledger.created:
+                # Import the old text download logs
+                self._ledger.import_status_dict(self.read_download_logs())
+        # Return the ledger
+        return self._ledger
 
+    # Get the download status of every attempted file (True if downloaded)
     def get_download_record(self):
+        # Return the status dictionary from the ledger
+        return self.get_ledger().get_status_dict()
+
+    # Get the files with a download status ('success' or 'failed'), optionally in a year and/or DOY
+    def get_download_status(self, status='failed', year=None, doy=None):
+        # Return the files from the ledger
+        return self.get_ledger().get_files(status, year=year, doy=doy)
+
+    # Read the (old) text download logs into a dictionary of download status by filename
+    def read_download_logs(self):
         # Download dictionary
         download_dict = {}
         # Walk the support file directory
@@ -493,6 +960,9 @@ class LAADSDataSet:
 
     def print_download_report(self, print_failed=False, print_not_tried=False):
 
+        # If there is no catalog to report on
+        if not self.has_catalog():
+            return
         # Get the download dictionary from all the download files so far
         download_dict = self.get_download_record()
         # Counters
@@ -504,7 +974,7 @@ class LAADSDataSet:
         # Not tried files list
         not_tried_files = []
         # For each file in the dataset
-        for file in self.by_filename.keys():
+        for file in t_catalog.get_filenames(self.catalog):
             # If the file is not in the download dictionary keys
             if file not in download_dict.keys():
                 # Add to counter
@@ -541,23 +1011,32 @@ class LAADSDataSet:
 
     # Get a list of all the tiles in the dataset
     def get_tile_list(self):
-        # List for tile names
-        tile_list = []
-        # For each filename
-        for filename in self.by_filename.keys():
-            # Get the tile name
-            tilename = t_laads.get_tilename_from_filename(filename)
-            # If the tile name is not in the list
-            if tilename not in tile_list:
-                # Add it
-                tile_list.append(tilename)
-        # Return the list
-        return tile_list
+        # If the list has not been made yet
+        if self._tile_list is None:
+            # Tile names in order of first appearance
+            self._tile_list = list(self.by_tile.keys())
+        # Return a copy of the list (so callers cannot change the cached one)
+        return list(self._tile_list)
 
     # Get an ordered list of dates
     def get_ordered_dates_list(self):
-        # Return ordered list of dates
-        return sorted(list(self.by_date.keys()))
+        # If the list has not been made yet
+        if self._ordered_dates is None:
+            # Order the dates
+            self._ordered_dates = sorted(self.by_date.keys())
+        # Return a copy of the ordered list of dates
+        return list(self._ordered_dates)
+
+    # Check the dataset has a catalog (logging an error if not)
+    def has_catalog(self):
+        # If there is no catalog
+        if self.catalog is None:
+            # Log an error
+            logging.error(f"No catalog has been loaded for LAADSDataSet {self.name}.")
+            # Return False
+            return False
+        # Return True
+        return True
 
 
 class LAADSFile:
@@ -0,0 +1,170 @@
+import sqlite3
+import logging
+import datetime
+import threading
+import t_laads
+
+
+# Class for an indexed SQLite ledger of download attempts (one row per file)
+class DownloadLedger:
+
+    def __init__(self, path, batch_size=50):
+
+        self.path = path
+        # Records held before writing them in one transaction
+        self.batch_size = batch_size
+        self.batch = []
+        # One connection shared by the download workers (writes are serialized by the lock)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(str(self.path), check_same_thread=False)
+        # True if the ledger was created (rather than opened)
+        self.created = False
+
+        # Spin up the object
+        self.spinup()
+
+    # Set up the database
+    def spinup(self):
+        with self.lock:
+            # Write-ahead logging (readers do not block the writer)
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('PRAGMA synchronous=NORMAL')
+            # If there is no files table yet
+            if not self.connection.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='files'"
+                                           ).fetchone():
+                # Mark as created
+                self.created = True
+            # Make the table and indexes (if they do not exist)
+            self.connection.executescript('''
+                CREATE TABLE IF NOT EXISTS files (
+                    filename TEXT PRIMARY KEY,
+                    year INTEGER,
+                    doy INTEGER,
+                    status TEXT,
+                    bytes INTEGER,
+                    md5 TEXT,
+                    attempts INTEGER DEFAULT 0,
+                    last_error TEXT,
+                    duration REAL,
+                    first_attempt TEXT,
+                    last_attempt TEXT,
+                    mtime REAL
+                );
+                CREATE INDEX IF NOT EXISTS files_status_year ON files (status, year, doy);
+            ''')
+            # Add the modification time column to ledgers made before it existed
+            columns = [row[1] for row in self.connection.execute('PRAGMA table_info(files)')]
+            if 'mtime' not in columns:
+                self.connection.execute('ALTER TABLE files ADD COLUMN mtime REAL')
+            self.connection.commit()
+
+    # Record a download attempt (held in the batch until it is full, or flush is called)
+    # (mtime is the modification time of the file on disk, for skipping re-verification of unchanged files)
+    def record(self, filename, success, size=None, md5=None, attempts=1, error=None, duration=None, mtime=None):
+        # Get the year and DOY
+        year, doy = t_laads.get_year_doy_from_filename(filename)
+        # Status string
+        status = 'success' if success else 'failed'
+        # Timestamp
+        now = datetime.datetime.now().isoformat(timespec='seconds')
+        with self.lock:
+            # Add to the batch
+            self.batch.append((filename, int(year), int(doy), status, size, md5, attempts, error, duration, now, now,
+                               mtime))
+            # If the batch is full
+            if len(self.batch) >= self.batch_size:
+                # Write it
+                self.write_batch()
+
+    # Write any held records
+    def flush(self):
+        with self.lock:
+            self.write_batch()
+
+    # Write the batch in one transaction (call with the lock held)
+    def write_batch(self):
+        # If there is nothing to write
+        if not self.batch:
+            return
+        # Insert, or update the existing row (keeping the first attempt time and adding attempts)
+        self.connection.executemany('''
+            INSERT INTO files (filename, year, doy, status, bytes, md5, attempts, last_error, duration,
+                               first_attempt, last_attempt, mtime)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (filename) DO UPDATE SET
+                status = excluded.status,
+                bytes = COALESCE(excluded.bytes, files.bytes),
+                md5 = COALESCE(excluded.md5, files.md5),
+                attempts = files.attempts + excluded.attempts,
+                last_error = excluded.last_error,
+                duration = excluded.duration,
+                last_attempt = excluded.last_attempt,
+                mtime = COALESCE(excluded.mtime, files.mtime)
+        ''', self.batch)
+        self.connection.commit()
+        # Empty the batch
+        self.batch = []
+
+    # Get a dictionary of download status by filename (True if downloaded)
+    def get_status_dict(self):
+        # Write any held records
+        self.flush()
+        with self.lock:
+            return {filename: status == 'success' for filename, status in
+                    self.connection.execute('SELECT filename, status FROM files')}
+
+    # Get a dictionary of (bytes, mtime, md5) tuples by filename for the successful files
+    def get_success_stats(self):
+        # Write any held records
+        self.flush()
+        with self.lock:
+            return {row[0]: row[1:] for row in
+                    self.connection.execute("SELECT filename, bytes, mtime, md5 FROM files WHERE status = 'success'")}
+
+    # Get the filenames with a status (e.g. 'failed'), optionally in a year and/or DOY
+    def get_files(self, status, year=None, doy=None):
+        # Write any held records
+        self.flush()
+        # Query (answered by the status/year/doy index)
+        query = 'SELECT filename FROM files WHERE status = ?'
+        parameters = [status]
+        if year is not None:
+            query += ' AND year = ?'
+            parameters.append(int(year))
+        if doy is not None:
+            query += ' AND doy = ?'
+            parameters.append(int(doy))
+        with self.lock:
+            return [row[0] for row in self.connection.execute(query, parameters)]
+
+    # Get the ledger row for a file as a dictionary (None if it has no row)
+    def get_file(self, filename):
+        # Write any held records
+        self.flush()
+        with self.lock:
+            cursor = self.connection.execute('SELECT * FROM files WHERE filename = ?', (filename,))
+            row = cursor.fetchone()
+            if not row:
+                return None
+            return dict(zip([column[0] for column in cursor.description], row))
+
+    # Import a dictionary of download status by filename (e.g. from the old text download logs)
+    def import_status_dict(self, status_dict):
+        # For each file
+        for filename in status_dict.keys():
+            # Error for failures
+            error = None
+            if not status_dict[filename]:
+                error = 'Failed (imported from a text download log)'
+            # Record it
+            self.record(filename, status_dict[filename], error=error)
+        # Write the records
+        self.flush()
+        # Log the info
+        logging.info(f'Imported {len(status_dict)} download records into {self.path}.')
+
+    # Close the ledger
+    def close(self):
+        self.flush()
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,204 @@
+import io
+import logging
+import c_retry
+from time import sleep
+from collections import OrderedDict
+from urllib.parse import urlsplit
+from requests.exceptions import RequestException
+
+
+# Class for a read-only, seekable file over HTTP range requests, caching fixed-size blocks
+# (h5py can open it directly, so only the metadata and chunks actually read are fetched)
+class RemoteFile(io.RawIOBase):
+
+    def __init__(self,
+                 url,
+                 session,
+                 block_size=262144,
+                 max_blocks=256,
+                 retry_policy=None,
+                 max_attempts=5):
+
+        self.url = url
+        self.session = session
+        # Bytes fetched per block (requests cover whole blocks, adjacent missing blocks are fetched together)
+        self.block_size = block_size
+        # Blocks kept in the cache (least recently used are dropped first)
+        self.max_blocks = max_blocks
+        # Retry policy (back-off and the shared circuit breaker)
+        self.retry_policy = retry_policy
+        if self.retry_policy is None:
+            self.retry_policy = c_retry.get_retry_policy()
+        self.max_attempts = max_attempts
+        self.host = urlsplit(url).netloc
+
+        # Block cache (a remote file is read by one thread)
+        self.blocks = OrderedDict()
+        # Position in the file
+        self.position = 0
+        # File size (found with the first request)
+        self.size = None
+        # Whole file content (only if the server ignores range requests)
+        self.content = None
+        # Bytes fetched and requests made (for reporting)
+        self.bytes_fetched = 0
+        self.requests_made = 0
+
+        # Spin up the object
+        self.spinup()
+
+    # Spinup procedure for the object
+    def spinup(self):
+        # Fetch the first block (HDF5 superblock and root group), which also gives the file size
+        self.fetch_blocks(0, 1)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    # Move the position (whence as for io: 0 from the start, 1 from the position, 2 from the end)
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.position = offset
+        elif whence == io.SEEK_CUR:
+            self.position += offset
+        elif whence == io.SEEK_END:
+            self.position = self.size + offset
+        return self.position
+
+    # Read into a buffer from the position, returning the bytes read
+    def readinto(self, buffer):
+        # Bytes wanted (none past the end of the file)
+        length = min(len(buffer), max(self.size - self.position, 0))
+        # If there is nothing to read
+        if length <= 0:
+            return 0
+        # Get the bytes
+        data = self.read_range(self.position, length)
+        # Fill the buffer and move on
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+    # Read a range of bytes through the block cache
+    def read_range(self, start, length):
+        # If the server sent the whole file
+        if self.content is not None:
+            return self.content[start:start + length]
+        # First and last blocks of the range
+        first = start // self.block_size
+        last = (start + length - 1) // self.block_size
+        # Blocks of the range by index
+        found = {}
+        # Blocks not in the cache
+        missing = []
+        # For each block
+        for block in range(first, last + 1):
+            # If it is cached
+            if block in self.blocks:
+                # Use it, marking it recently used
+                self.blocks.move_to_end(block)
+                found[block] = self.blocks[block]
+            # Otherwise
+            else:
+                missing.append(block)
+        # Fetch each run of adjacent missing blocks in one request
+        run_start = None
+        for i, block in enumerate(missing):
+            if run_start is None:
+                run_start = block
+            if i == len(missing) - 1 or missing[i + 1] != block + 1:
+                found.update(self.fetch_blocks(run_start, block - run_start + 1))
+                run_start = None
+        # Join the blocks
+        data = b''.join(found[block] for block in range(first, last + 1))
+        # Return the range
+        offset = start - first * self.block_size
+        return data[offset:offset + length]
+
+    # Fetch a run of blocks with one range request, caching them (returns the blocks by index)
+    def fetch_blocks(self, first, count):
+        # Byte range
+        start = first * self.block_size
+        end = start + count * self.block_size - 1
+        if self.size is not None:
+            end = min(end, self.size - 1)
+        # Get the bytes
+        data = self.fetch(start, end)
+        # Split them into blocks
+        blocks = {first + i: data[i * self.block_size:(i + 1) * self.block_size] for i in range(count)}
+        # Cache the blocks
+        for block in blocks.keys():
+            self.blocks[block] = blocks[block]
+            self.blocks.move_to_end(block)
+        # Drop the least recently used blocks
+        while len(self.blocks) > self.max_blocks:
+            self.blocks.popitem(last=False)
+        # Return the blocks
+        return blocks
+
+    # Fetch a byte range (inclusive) from the server, retrying politely
+    def fetch(self, start, end):
+        # Retry-After header of the last response
+        retry_after = None
+        # For each attempt
+        for attempt in range(1, self.max_attempts + 1):
+            # If this is not the first attempt
+            if attempt > 1:
+                # Wait quietly and politely
+                sleep(self.retry_policy.get_delay(attempt - 1, retry_after))
+            # If the circuit for the host is open
+            if not self.retry_policy.allow_request(self.host):
+                # Wait until it lets a probe through (at least the back-off base, in case another thread is probing)
+                wait = max(self.retry_policy.circuit_breaker.get_wait(self.host), self.retry_policy.back_off_base)
+                # Log the info
+                logging.info(f'Circuit for {self.host} is open, waiting {round(wait)} seconds to read {self.url}.')
+                sleep(wait)
+                # Move to next attempt
+                continue
+            # Try to get the range
+            try:
+                r = self.session.get(self.url, headers={'Range': f'bytes={start}-{end}'}, allow_redirects=True)
+                # Count the request
+                self.requests_made += 1
+                # Report the status code
+                self.retry_policy.record_status(self.host, r.status_code)
+                # If the range was served
+                if r.status_code == 206:
+                    # If the size is not known yet
+                    if self.size is None:
+                        # Get it from the Content-Range header (bytes start-end/size)
+                        self.size = int(r.headers['Content-Range'].split('/')[-1])
+                    # Count the bytes
+                    self.bytes_fetched += len(r.content)
+                    # Return the bytes
+                    return r.content
+                # If the server ignored the range and sent the whole file
+                if r.status_code == 200:
+                    # Keep the file (so it is only fetched once), count the bytes, and return the range
+                    self.content = r.content
+                    self.size = len(r.content)
+                    self.bytes_fetched += len(r.content)
+                    # Log a warning
+                    logging.warning(f'{self.url} does not support range requests, so the whole file was read.')
+                    return r.content[start:end + 1]
+                # Log the status code
+                logging.info(f'Range request for {self.url} ({start}-{end}) returned code: {r.status_code}.')
+                # If asking again will not help
+                if self.retry_policy.get_action(r.status_code) == 'fail':
+                    break
+                # Keep any Retry-After header for the back-off
+                retry_after = r.headers.get('Retry-After')
+            # If the connection failed
+            except RequestException as e:
+                # Log the info
+                logging.info(f'Range request for {self.url} ({start}-{end}) failed: {e}')
+                # Report the failure
+                self.retry_policy.record_status(self.host, None)
+        # Raise an error (h5py reports it as a failed read)
+        raise OSError(f'Could not read bytes {start}-{end} of {self.url}.')
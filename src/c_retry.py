@@ -0,0 +1,172 @@
+import logging
+import random
+import threading
+import datetime
+from time import monotonic
+from email.utils import parsedate_to_datetime
+
+
+# Class deciding whether and when to retry a request (exponential back-off with jitter, Retry-After, circuit breaker)
+class RetryPolicy:
+
+    def __init__(self,
+                 back_off_base=1,
+                 back_off_cap=60,
+                 retry_after_cap=300,
+                 retry_codes=(408, 425, 429),
+                 refresh_codes=(302, 401, 403),
+                 circuit_breaker=None):
+
+        # First back-off (seconds), doubled with each retry up to the cap
+        self.back_off_base = back_off_base
+        self.back_off_cap = back_off_cap
+        # Longest Retry-After honoured (seconds)
+        self.retry_after_cap = retry_after_cap
+        # Client error codes worth retrying (all server errors are retried)
+        self.retry_codes = retry_codes
+        # Codes meaning the session needs new credentials (e.g. a redirect to a login page)
+        self.refresh_codes = refresh_codes
+        # Circuit breaker (shared by every policy unless one is given)
+        self.circuit_breaker = circuit_breaker
+        if self.circuit_breaker is None:
+            self.circuit_breaker = get_circuit_breaker()
+
+    # Decide what to do after a status code ('retry', 'refresh' the session then retry, or 'fail' now)
+    # (None means no response, e.g. a dropped connection)
+    def get_action(self, status_code):
+        # No response, server errors and throttling are retried
+        if status_code is None or status_code >= 500 or status_code in self.retry_codes:
+            return 'retry'
+        # Credential problems are retried with a new session
+        if status_code in self.refresh_codes:
+            return 'refresh'
+        # Other client errors (e.g. 404) will not change by asking again
+        return 'fail'
+
+    # Get the wait (seconds) before a retry, honouring a Retry-After header if one was sent
+    def get_delay(self, retries, retry_after=None):
+        # Parse the Retry-After header
+        retry_after_seconds = parse_retry_after(retry_after)
+        # If the server said how long to wait
+        if retry_after_seconds is not None:
+            # Wait that long (capped), plus a little jitter so threads do not return in lockstep
+            return min(retry_after_seconds, self.retry_after_cap) + random.uniform(0, self.back_off_base)
+        # Otherwise, exponential back-off with full jitter
+        return random.uniform(0, min(self.back_off_cap, self.back_off_base * 2 ** max(retries - 1, 0)))
+
+    # Check the circuit for a host is closed (requests allowed)
+    def allow_request(self, host):
+
+        return self.circuit_breaker.allow_request(host)
+
+    # Report the outcome of a request to the circuit breaker (None for no response)
+    def record_status(self, host, status_code):
+        # If the host is failing
+        if status_code is None or status_code >= 500 or status_code == 429:
+            self.circuit_breaker.record_failure(host)
+        # Otherwise (the host answered)
+        else:
+            self.circuit_breaker.record_success(host)
+
+
+# Class for a per-host circuit breaker shared by threads (stop asking a host that keeps failing, then probe it)
+class CircuitBreaker:
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+
+        # Consecutive failures that open the circuit
+        self.failure_threshold = failure_threshold
+        # Seconds the circuit stays open before a probe request is allowed
+        self.reset_timeout = reset_timeout
+
+        # Consecutive failures by host
+        self.failures = {}
+        # Time the circuit opened by host (hosts with open circuits only)
+        self.opened = {}
+        # Hosts with a probe request in flight
+        self.probing = set()
+        self.lock = threading.Lock()
+
+    # Check a request to a host is allowed (after the timeout, one probe request is let through)
+    def allow_request(self, host):
+        with self.lock:
+            # If the circuit is closed
+            if host not in self.opened:
+                return True
+            # If the circuit has been open long enough, and nobody is probing yet
+            if monotonic() - self.opened[host] >= self.reset_timeout and host not in self.probing:
+                # Let this request probe the host
+                self.probing.add(host)
+                return True
+            # Otherwise, do not ask
+            return False
+
+    # Record a success (closes the circuit)
+    def record_success(self, host):
+        with self.lock:
+            # If the circuit was open
+            if host in self.opened:
+                # Log the info
+                logging.info(f'Circuit for {host} closed.')
+            # Reset the host
+            self.failures[host] = 0
+            self.opened.pop(host, None)
+            self.probing.discard(host)
+
+    # Record a failure (opens the circuit at the threshold, or re-opens it after a failed probe)
+    def record_failure(self, host):
+        with self.lock:
+            # Count the failure
+            self.failures[host] = self.failures.get(host, 0) + 1
+            # If the probe failed, or the threshold was reached
+            if host in self.probing or (host not in self.opened and self.failures[host] >= self.failure_threshold):
+                # (Re-)open the circuit
+                self.opened[host] = monotonic()
+                self.probing.discard(host)
+                # Log the info
+                logging.warning(f'Circuit for {host} opened after {self.failures[host]} failures. '
+                                f'Requests will be refused for {self.reset_timeout} seconds.')
+
+    # Get the seconds until a host's circuit allows a probe (0 if the circuit is closed)
+    def get_wait(self, host):
+        with self.lock:
+            if host not in self.opened:
+                return 0
+            return max(0, self.reset_timeout - (monotonic() - self.opened[host]))
+
+
+# Parse a Retry-After header (seconds or an HTTP date) into seconds (None if missing or unreadable)
+def parse_retry_after(retry_after):
+    # If there is no header
+    if not retry_after:
+        return None
+    # If it is a number of seconds
+    if str(retry_after).strip().isdigit():
+        return int(retry_after)
+    # Otherwise, try to read it as an HTTP date
+    try:
+        retry_date = parsedate_to_datetime(retry_after)
+    # If it could not be read
+    except (TypeError, ValueError):
+        return None
+    # Dates without a zone are GMT
+    if retry_date.tzinfo is None:
+        retry_date = retry_date.replace(tzinfo=datetime.timezone.utc)
+    # Return the seconds until then
+    return max(0, (retry_date - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+
+
+# Circuit breaker shared by every retry policy in the process
+circuit_breaker = CircuitBreaker()
+
+
+# Get the shared circuit breaker
+def get_circuit_breaker():
+
+    return circuit_breaker
+
+
+# Get a retry policy using the shared circuit breaker
+def get_retry_policy():
+
+    return RetryPolicy()
@@ -0,0 +1,218 @@
+import logging
+import numpy as np
+import t_vnp46a
+
+
+# Class for a region of interest on the VNP46 15 arc second grid, from a lat/lon bounding box or polygon
+# (converted once to a pixel window, and a mask of pixels inside a polygon, for each tile it touches)
+class ROI:
+
+    def __init__(self, name, bbox=None, polygon=None):
+
+        self.name = name
+        # Bounding box (min lon, min lat, max lon, max lat)
+        self.bbox = bbox
+        # Polygon as a list of (lon, lat) vertices (None for a bounding box)
+        self.polygon = polygon
+
+        # Window on the global grid (row min, row max, col min, col max)
+        self.global_window = None
+        # Window of each tile by tile name (row min, row max, col min, col max, in tile pixels)
+        self.windows = {}
+        # Mask of the pixels of each tile window inside the ROI by tile name (None if every pixel is)
+        self.masks = {}
+
+        # Spin up the object
+        self.spinup()
+
+    # Work out the windows and masks
+    def spinup(self):
+        # If there is a polygon
+        if self.polygon is not None:
+            # Its bounding box
+            polygon = np.asarray(self.polygon, dtype='float64')
+            self.polygon = [tuple(vertex) for vertex in polygon.tolist()]
+            self.bbox = (polygon[:, 0].min(), polygon[:, 1].min(), polygon[:, 0].max(), polygon[:, 1].max())
+        # If there is no bounding box
+        if self.bbox is None:
+            # Log an error
+            logging.error(f'ROI {self.name} needs a bounding box or a polygon.')
+            # Return
+            return
+        # Get the global window of the bounding box
+        self.global_window = get_global_window(self.bbox)
+        # Pixels of a tile
+        tile_pixels = t_vnp46a.get_tile_pixels()
+        # For each tile intersecting the bounding box
+        for tile_h, tile_v in t_vnp46a.get_tiles_from_bbox(*self.bbox):
+            # Global row and col of the tile's top left pixel
+            tile_row = tile_v * tile_pixels
+            tile_col = tile_h * tile_pixels
+            # Intersection of the window and the tile (in tile pixels)
+            window = (max(self.global_window[0] - tile_row, 0),
+                      min(self.global_window[1] - tile_row, tile_pixels),
+                      max(self.global_window[2] - tile_col, 0),
+                      min(self.global_window[3] - tile_col, tile_pixels))
+            # If the tile only touches the edge of the box
+            if window[0] >= window[1] or window[2] >= window[3]:
+                continue
+            # Tile name
+            tilename = f'h{tile_h:02d}v{tile_v:02d}'
+            # Mask of the pixels inside the polygon (None for a bounding box)
+            mask = None
+            if self.polygon is not None:
+                mask = get_polygon_mask(self.polygon, tile_row + window[0], tile_row + window[1],
+                                        tile_col + window[2], tile_col + window[3])
+                # If no pixel centre of the tile is inside
+                if not mask.any():
+                    continue
+            # Keep the window and mask
+            self.windows[tilename] = window
+            self.masks[tilename] = mask
+
+    # Get the names of the tiles of the ROI
+    def get_tilenames(self):
+
+        return sorted(self.windows.keys())
+
+    # Get the window of a tile (row min, row max, col min, col max, in tile pixels; None if not in the ROI)
+    def get_window(self, tilename):
+
+        return self.windows.get(tilename)
+
+    # Get the shape of a tile's window
+    def get_window_shape(self, tilename):
+
+        window = self.windows[tilename]
+
+        return (window[1] - window[0], window[3] - window[2])
+
+    # Get the mask of a tile's window (all True for a bounding box)
+    def get_mask(self, tilename):
+
+        if self.masks[tilename] is None:
+            return np.ones(self.get_window_shape(tilename), dtype=bool)
+
+        return self.masks[tilename]
+
+    # Get the shape of the stitched ROI (rows, cols)
+    def get_shape(self):
+
+        return (self.global_window[1] - self.global_window[0], self.global_window[3] - self.global_window[2])
+
+    # Get the (row, col) of a tile's window within the stitched ROI
+    def get_tile_offset(self, tilename):
+        # Break up the tile name
+        tile_h, tile_v = int(tilename[1:3]), int(tilename[4:6])
+        # Global position of the window, less the global position of the ROI
+        return (tile_v * t_vnp46a.get_tile_pixels() + self.windows[tilename][0] - self.global_window[0],
+                tile_h * t_vnp46a.get_tile_pixels() + self.windows[tilename][2] - self.global_window[2])
+
+    # Read a tile's window from a 2-D dataset (an h5py or zarr dataset reads only the window)
+    def read_window(self, dataset, tilename):
+
+        window = self.windows[tilename]
+
+        return dataset[window[0]:window[1], window[2]:window[3]]
+
+    # Get the (tile name, row, col) of a lon/lat within the tile windows (None if it is outside the ROI)
+    def get_tile_pixel(self, lon, lat):
+        # Global row and col
+        row = int(np.floor((90 - lat) * t_vnp46a.get_pixels_per_degree()))
+        col = int(np.floor((lon + 180) * t_vnp46a.get_pixels_per_degree()))
+        # Tile and the pixel within it
+        tile_pixels = t_vnp46a.get_tile_pixels()
+        tilename = f'h{col // tile_pixels:02d}v{row // tile_pixels:02d}'
+        # If the tile is not in the ROI
+        if tilename not in self.windows:
+            return None
+        # Row and col within the window
+        window = self.windows[tilename]
+        local_row = row % tile_pixels - window[0]
+        local_col = col % tile_pixels - window[2]
+        # If it is outside the window or the mask
+        if not (0 <= local_row < window[1] - window[0] and 0 <= local_col < window[3] - window[2]) \
+                or not self.get_mask(tilename)[local_row, local_col]:
+            return None
+        # Return the tile name, row and col
+        return tilename, local_row, local_col
+
+    # Stitch arrays of tile windows (by tile name, with the window in the last two dimensions) into one array
+    # (pixels outside the tiles given, or outside the mask, are the fill value)
+    def stitch(self, arrays, fill_value):
+        # Leading shape and data type (from the first array)
+        first = next(iter(arrays.values()))
+        # Make the stitched array
+        stitched = np.full(first.shape[:-2] + self.get_shape(), fill_value, dtype=first.dtype)
+        # For each tile
+        for tilename in arrays.keys():
+            # Get the offset and shape of the window
+            row, col = self.get_tile_offset(tilename)
+            rows, cols = self.get_window_shape(tilename)
+            # Put the pixels inside the mask in place
+            stitched[..., row:row + rows, col:col + cols] = np.where(self.get_mask(tilename),
+                                                                    arrays[tilename],
+                                                                    fill_value)
+        # Return the stitched array
+        return stitched
+
+    # Get the ROI as attributes for a Zarr store (see get_roi_from_attrs)
+    def get_attrs(self):
+
+        return {'Name': self.name,
+                'BBox': [float(value) for value in self.bbox],
+                'Polygon': [list(vertex) for vertex in self.polygon] if self.polygon is not None else None}
+
+
+# Get the window of a bounding box on the global grid (row min, row max, col min, col max)
+# (every pixel the box overlaps; box edges within a millionth of a pixel of a pixel edge count as on it)
+def get_global_window(bbox):
+    # Break up the box
+    min_lon, min_lat, max_lon, max_lat = bbox
+    # Pixels per degree
+    ppd = t_vnp46a.get_pixels_per_degree()
+    # Rows count south from 90N, cols count east from 180W
+    return (int(np.floor((90 - max_lat) * ppd + 1e-6)),
+            int(np.ceil((90 - min_lat) * ppd - 1e-6)),
+            int(np.floor((min_lon + 180) * ppd + 1e-6)),
+            int(np.ceil((max_lon + 180) * ppd - 1e-6)))
+
+
+# Get a mask of the pixels of a global window whose centres are inside a polygon (even-odd rule, one pass per edge)
+def get_polygon_mask(polygon, row_min, row_max, col_min, col_max):
+    # Pixels per degree
+    ppd = t_vnp46a.get_pixels_per_degree()
+    # Pixel centre lats (a column) and lons (a row)
+    lats = (90 - (np.arange(row_min, row_max) + 0.5) / ppd)[:, np.newaxis]
+    lons = (-180 + (np.arange(col_min, col_max) + 0.5) / ppd)[np.newaxis, :]
+    # Mask
+    mask = np.zeros((row_max - row_min, col_max - col_min), dtype=bool)
+    # For each edge
+    for (lon_1, lat_1), (lon_2, lat_2) in zip(polygon, polygon[1:] + polygon[:1]):
+        # Rows the edge crosses (horizontal edges cross none)
+        crosses = (lat_1 > lats) != (lat_2 > lats)
+        # If it crosses none
+        if not crosses.any():
+            continue
+        # Lon where the edge crosses each row
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cross_lons = lon_1 + (lats - lat_1) * (lon_2 - lon_1) / (lat_2 - lat_1)
+        # Flip the pixels west of the crossing
+        mask ^= crosses & (lons < cross_lons)
+    # Return the mask
+    return mask
+
+
+# Get an ROI from Zarr store attributes (see ROI.get_attrs; None if there are none)
+def get_roi_from_attrs(attrs):
+    # If there is no ROI
+    if not attrs:
+        return None
+    # Make the ROI
+    return ROI(attrs['Name'], bbox=attrs['BBox'], polygon=attrs['Polygon'])
+
+
+# Get the default ROI (Puerto Rico, which is tile h11v07 rows 300:520 and cols 480:1160)
+def get_puerto_rico_roi():
+
+    return ROI('Puerto Rico', bbox=(-68, 17 + 5 / 6, -65 - 1 / 6, 18.75))
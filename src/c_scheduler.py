@@ -0,0 +1,161 @@
+import logging
+import threading
+from queue import Queue
+from collections import deque
+from time import monotonic
+from urllib.parse import urlsplit
+
+
+# Class for running downloads from per-host work queues on a persistent set of worker threads
+# (concurrency adapts to throttling, and a busy host never holds up work for other hosts)
+class DownloadScheduler:
+
+    def __init__(self,
+                 max_workers=5,
+                 min_workers=1,
+                 per_host_limit=None,
+                 throttle_codes=(429, 503),
+                 cooldown=10):
+
+        # Worker threads (the ceiling for concurrency)
+        self.max_workers = max_workers
+        # Concurrency never drops below this
+        self.min_workers = min_workers
+        # Maximum downloads in flight to any one host (None for no limit)
+        self.per_host_limit = per_host_limit
+        # Status codes meaning the server wants us to slow down
+        self.throttle_codes = throttle_codes
+        # Seconds between successive cuts to concurrency
+        self.cooldown = cooldown
+
+        # Current concurrency limit (adapted as the run goes)
+        self.limit = max_workers
+        # Downloads in flight
+        self.active = 0
+        # Successes since the last change to the limit
+        self.successes = 0
+        # Time of the last cut to the limit
+        self.last_cut = None
+        # Condition guarding the limits, the counts in flight and the waiting work
+        self.condition = threading.Condition()
+
+        # Work waiting to start, in a queue for each host (hosts are taken in turn)
+        self.pending = {}
+        # Downloads in flight to each host
+        self.host_active = {}
+
+    # Run a function over a list of work, yielding (work, result) tuples as they complete
+    # (result is None if the function raised an exception)
+    def run(self, func, list_of_work):
+        # Queue for the results
+        result_queue = Queue()
+        # Queue the work by host
+        with self.condition:
+            for work in list_of_work:
+                self.pending.setdefault(self.get_host(work), deque()).append(work)
+        # Number of pieces of work
+        work_count = len(list_of_work)
+        # Start the workers
+        workers = []
+        for _ in range(min(self.max_workers, work_count)):
+            worker = threading.Thread(target=self.worker, args=(func, result_queue), daemon=True)
+            worker.start()
+            workers.append(worker)
+        # Yield each result as it arrives
+        for _ in range(work_count):
+            yield result_queue.get()
+        # Wait for the workers to finish
+        for worker in workers:
+            worker.join()
+
+    # Worker doing work until there is none left to start
+    def worker(self, func, result_queue):
+        # While there is work
+        while True:
+            # Wait for a piece of work allowed under the limits
+            work = self.acquire()
+            # If there is none left
+            if work is None:
+                # Stop
+                return
+            # Try to do the work
+            try:
+                result = func(work)
+            # If something went wrong
+            except Exception as e:
+                # Log the error
+                logging.error(f'Download work {work} raised {e}.')
+                result = None
+            # Release the slots
+            finally:
+                self.release(work)
+            # Pass on the result
+            result_queue.put((work, result))
+
+    # Wait until a piece of work is allowed under the current limit and its host's limit, and take it
+    # (work for a busy host waits in its queue without holding a slot; None when there is no work left)
+    def acquire(self):
+        with self.condition:
+            while True:
+                # If there is no work left to start
+                if not self.pending:
+                    return None
+                # If there is a slot under the limit
+                if self.active < self.limit:
+                    # For each host with work, in turn
+                    for host in list(self.pending.keys()):
+                        # If the host has a slot
+                        if not self.per_host_limit or self.host_active.get(host, 0) < self.per_host_limit:
+                            # Take its next piece of work (moving the host to the back of the turn)
+                            host_queue = self.pending.pop(host)
+                            work = host_queue.popleft()
+                            if host_queue:
+                                self.pending[host] = host_queue
+                            # Count it in flight
+                            self.active += 1
+                            self.host_active[host] = self.host_active.get(host, 0) + 1
+                            return work
+                # Wait for a slot to free up
+                self.condition.wait()
+
+    # Finish a piece of work
+    def release(self, work):
+        with self.condition:
+            self.active -= 1
+            self.host_active[self.get_host(work)] -= 1
+            self.condition.notify_all()
+
+    # Get the host of a piece of work (a URL, or a tuple starting with one)
+    def get_host(self, work):
+        # Get the URL
+        url = work
+        if isinstance(work, tuple):
+            url = work[0]
+        # Return the host
+        return urlsplit(url).netloc
+
+    # Adapt concurrency to a response status code (halve on throttling, creep back up on success)
+    def observe_status(self, status_code):
+        with self.condition:
+            # If the server is throttling us
+            if status_code in self.throttle_codes:
+                # Only cut once per cooldown (responses in flight report the same congestion)
+                now = monotonic()
+                if self.last_cut is None or now - self.last_cut > self.cooldown:
+                    # Halve the limit
+                    self.limit = max(self.min_workers, self.limit // 2)
+                    self.last_cut = now
+                    self.successes = 0
+                    # Log the info
+                    logging.info(f'Received {status_code}. Download concurrency reduced to {self.limit}.')
+            # Otherwise, if the request succeeded
+            elif status_code in (200, 206):
+                # Count the success
+                self.successes += 1
+                # After a limit's worth of successes, allow one more
+                if self.limit < self.max_workers and self.successes >= self.limit:
+                    self.limit += 1
+                    self.successes = 0
+                    self.condition.notify_all()
+                    # Log the info
+                    logging.info(f'Download concurrency increased to {self.limit}.')
@@ -0,0 +1,113 @@
+import logging
+import threading
+from requests.adapters import HTTPAdapter
+
+
+# Class handing each thread its own pooled requests session (sessions are not shared between threads)
+class SessionProvider:
+
+    def __init__(self,
+                 session_func,
+                 refresh_func=None,
+                 pool_connections=4,
+                 pool_maxsize=2,
+                 credential_codes=(401, 403)):
+
+        # Function returning a new (authorized) requests session
+        self.session_func = session_func
+        # Function called to refresh credentials before sessions are rebuilt (e.g. reload a token)
+        self.refresh_func = refresh_func
+        # Hosts kept in each session's pool, and kept-alive connections per host
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        # Status codes meaning the credentials were refused (every thread's session is rebuilt after a refresh)
+        self.credential_codes = credential_codes
+
+        # Per-thread session storage
+        self.local = threading.local()
+        # Sessions are rebuilt when the generation moves on (after a refresh)
+        self.generation = 0
+        # Sessions in use (so they can be closed)
+        self.sessions = []
+        self.lock = threading.Lock()
+
+    # Get the calling thread's session (made on first use, reused for keep-alive afterwards)
+    def get_session(self):
+        # If this thread has no session, or it predates a refresh
+        if getattr(self.local, 'generation', None) != self.generation:
+            # Replace it
+            return self.replace_session()
+        # Return the session
+        return self.local.session
+
+    # Replace the calling thread's session with a new one (closing the old one)
+    def replace_session(self):
+        # If the thread has a session
+        if getattr(self.local, 'session', None):
+            # Close it and stop tracking it
+            self.drop_session(self.local.session)
+        # Make a new session
+        self.local.generation = self.generation
+        self.local.status_code = None
+        self.local.session = self.make_session()
+        # Return the session
+        return self.local.session
+
+    # Close a session and stop tracking it
+    def drop_session(self, session):
+        session.close()
+        with self.lock:
+            if session in self.sessions:
+                self.sessions.remove(session)
+
+    # Make a new session with pools sized for one thread
+    def make_session(self):
+        # Get a session
+        session = self.session_func()
+        # Mount adapters with the pool sizes
+        adapter = HTTPAdapter(pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        # Record the status code of each response (so refresh_session can tell refused credentials)
+        session.hooks['response'].append(self.record_response)
+        # Keep track of it
+        with self.lock:
+            self.sessions.append(session)
+        # Return the session
+        return session
+
+    # Record the status code of a response in the calling thread (a requests response hook)
+    def record_response(self, r, *args, **kwargs):
+        self.local.status_code = r.status_code
+
+    # Return a new session for the calling thread (for ask_nicely's session_func)
+    # (if the thread's last response refused the credentials, they are refreshed and every thread's session is rebuilt;
+    # otherwise, e.g. after timeouts or a 404, only the calling thread's session is replaced)
+    def refresh_session(self):
+        # If the credentials were not refused
+        if getattr(self.local, 'status_code', None) not in self.credential_codes:
+            # Log the info
+            logging.info(f'Replaced session from {self.session_func} for {threading.current_thread().name}.')
+            # Return a new session for this thread
+            return self.replace_session()
+        with self.lock:
+            # If no other thread has refreshed since this thread's session was made
+            if getattr(self.local, 'generation', None) == self.generation:
+                # If there is a refresh function
+                if self.refresh_func:
+                    # Refresh the credentials
+                    self.refresh_func()
+                # Move on a generation, so every thread gets a new session on its next request
+                self.generation += 1
+                # Log the info
+                logging.info(f'Refreshed credentials and sessions from {self.session_func}.')
+        # Return a new session for this thread
+        return self.get_session()
+
+    # Close every session handed out
+    def close(self):
+        with self.lock:
+            for session in self.sessions:
+                session.close()
+            self.sessions = []
+            self.generation += 1
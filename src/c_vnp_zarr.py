@@ -4,6 +4,9 @@ import datetime
 import numpy as np
 import re
 import t_vnp_zarr
+import t_zarr
+import t_zarr_layout
+import c_roi
 
 
 class VNPZarr:
@@ -12,21 +15,63 @@ class VNPZarr:
 
         self.path = path
         self.root = zarr.group(store=zarr.DirectoryStore(str(self.path)), overwrite=False)
-        self.dates = np.empty(self.root[f'Date'].shape, dtype=object)
+        # Time axis (start date, step in days, length) and the dates as datetime64[D]
+        self.time_axis = None
+        self.dates = None
+        # Region of interest of the store (None for stores made before ROIs were kept)
+        self.roi = None
         self.tiles = {}
 
         self.spinup()
 
     def spinup(self):
 
+        # Time axis and dates (from the integer 'Time' array, or a legacy 'Date' array)
+        self.time_axis = t_zarr.get_time_axis(self.root)
+        self.dates = t_zarr.get_datetime64_dates(self.root)
+        # Region of interest
+        self.roi = c_roi.get_roi_from_attrs(self.root.attrs.get('ROI'))
+
         for root_key in self.root.keys():
-            if root_key == 'Date':
-                for date_ind, datestr in enumerate(self.root[f'Date']):
-                    self.dates[date_ind] = datetime.datetime.strptime(datestr, '%Y%m%d')
-            else:
+            if root_key not in ('Time', 'Date'):
                 new_tile = VNPTile(self, root_key)
                 self.tiles[new_tile.name] = new_tile
 
+    # Get the time index of a date (None if it is not in the store)
+    def get_date_index(self, date_obj):
+
+        return t_zarr.get_date_index(self.time_axis, date_obj)
+
+    # Get the date of a time index
+    def get_index_date(self, index):
+
+        return t_zarr.get_index_date(self.time_axis, index)
+
+    # Get a variable's map of the whole ROI for a date, stitched from its tiles (None if it cannot be)
+    def get_stitched_map(self, var_name, date_obj):
+
+        if self.roi is None:
+            return None
+
+        maps = {tilename: self.tiles[tilename].get_date_map(var_name, date_obj)
+                for tilename in self.roi.get_tilenames() if tilename in self.tiles}
+        if not maps or any(tile_map is None for tile_map in maps.values()):
+            return None
+
+        return self.roi.stitch(maps, t_zarr_layout.get_fill_values()[var_name][1])
+
+    # Get a variable's time series at a lon/lat (None if it is outside the ROI)
+    def get_lonlat_series(self, var_name, lon, lat):
+
+        if self.roi is None:
+            return None
+
+        tile_pixel = self.roi.get_tile_pixel(lon, lat)
+        if tile_pixel is None or tile_pixel[0] not in self.tiles:
+            return None
+
+        return self.tiles[tile_pixel[0]].get_pixel_series(var_name, tile_pixel[1], tile_pixel[2])
+
 
 class VNPTile:
 
@@ -41,6 +86,11 @@ class VNPTile:
 
     def spinup(self):
 
+        # Window of the tile from the ROI, or the attrs of stores made before ROIs were kept
+        if self.zarr.roi is not None and self.name in self.zarr.roi.get_tilenames():
+            self.min_row = self.zarr.roi.get_window(self.name)[0]
+            self.min_col = self.zarr.roi.get_window(self.name)[2]
+            return
         if 'Min Row' in self.zarr.root[self.name].attrs.keys():
             self.min_row = self.zarr.root[self.name].attrs['Min Row']
         if 'Min Col' in self.zarr.root[self.name].attrs.keys():
@@ -60,25 +110,43 @@ class VNPTile:
         if not local_row_col:
             row, col = self.get_local_row_col(row, col)
 
-        return self.zarr.root[f'{self.name}/{row}/Sensor_Azimuth'][:, col]
+        return self.get_pixel_series('Sensor_Azimuth', row, col)
 
     def get_pixel_zenith_angles(self, row, col, local_row_col=True):
 
         if not local_row_col:
             row, col = self.get_local_row_col(row, col)
 
-        return self.zarr.root[f'{self.name}/{row}/Sensor_Zenith'][:, col]
+        return self.get_pixel_series('Sensor_Zenith', row, col)
 
     def get_pixel_ntls(self, row, col, local_row_col=True):
 
         if not local_row_col:
             row, col = self.get_local_row_col(row, col)
 
-        return self.zarr.root[f'{self.name}/{row}/DNB_BRDF-Corrected_NTL'][:, col]
+        return self.get_pixel_series('DNB_BRDF-Corrected_NTL', row, col)
+
+    # Get a pixel's time series of a variable (from the (time, row, col) layout, or legacy per-row arrays)
+    def get_pixel_series(self, var_name, row, col, local_row_col=True):
+
+        if not local_row_col:
+            row, col = self.get_local_row_col(row, col)
+
+        return t_zarr_layout.read_pixel_series(self.zarr.root[self.name], var_name, row, col)
+
+    # Get a variable's map of the window for a date (None if the date is not in the store)
+    def get_date_map(self, var_name, date_obj):
+
+        date_index = self.zarr.get_date_index(date_obj)
+        if date_index is None:
+            return None
+
+        return t_zarr_layout.read_date_map(self.zarr.root[self.name], var_name, date_index)
 
     def get_timeseries_dates(self):
 
-        return self.zarr.dates
+        # Dates as datetime objects (for plotting)
+        return self.zarr.dates.astype('datetime64[s]').astype(object)
 
     def plot_pixel_timeseries(self, row, col, local_row_col=True):
 
@@ -1,4 +1,5 @@
 import tifffile
+import t_landsat
 import numpy as np
 import matplotlib as mpl
 from time import time
@@ -8,7 +9,7 @@ from matplotlib import pyplot as plt
 
 class LandsatImage:
 
-    def __init__(self, ls_path):
+    def __init__(self, ls_path, load_array=True):
 
         stime = time()
         print(f'Instantiating LandsatImage object for {ls_path}.')
@@ -29,11 +30,11 @@ class LandsatImage:
         self.cols_to_left = None
         self.cols_to_right = None
 
-        self.spin_up()
+        self.spin_up(load_array)
 
         print(f'LandsatImage object for {self.path} instantiated in {np.around(time() - stime, decimals=2)} seconds.')
 
-    def spin_up(self):
+    def spin_up(self, load_array=True):
 
         stime = time()
         print(f'Loading Quality Flag array...')
@@ -43,58 +44,55 @@ class LandsatImage:
         ctime = time()
         self.make_masks()
         print(f'Mask made in {np.around(time() - ctime, decimals=2)} seconds.')
+        # If the band is to be scaled later (straight into a comparison canvas, see pad_arrays)
+        if not load_array:
+            return
+        self.load_filtered_array()
+
+    # Scale the band and filter it with the mask (into out, a float32 array of the band's shape, if given)
+    def load_filtered_array(self, out=None):
+
         print(f'Applying Scale Factor and Additive Offset...')
         ctime = time()
-        self.apply_factors_offsets_sr()
+        self.apply_factors_offsets_sr(out)
         print(f'Scale factors and additive offsets applied in {np.around(time() - ctime, decimals=2)} seconds.')
         print(f'Filtering array using mask...')
         ctime = time()
-        #self.filtered_array = np.empty((self.tif.asarray().shape[0], self.tif.asarray().shape[1]))
         self.get_filtered_array()
         print(f'Array filtered using mask in {np.around(time() - ctime, decimals=2)} seconds.')
 
     def get_filtered_array(self):
 
-        self.filtered_array = np.where(np.isnan(self.mask_array),
-                                       self.scaled_array,
-                                       np.nan)
+        # Filter the scaled array in place (it becomes the filtered array, so there is one copy of the data)
+        if self.mask_array is not None:
+            self.scaled_array[self.mask_array] = np.nan
+        self.filtered_array = self.scaled_array
+        self.scaled_array = None
 
         print(f"Filtered Array shape: {self.filtered_array.shape}")
 
-    def apply_factors_offsets_sr(self):
-
-        scale_factor = 2.75e-5
-        additive_offset = -0.2
-
-        self.scaled_array = np.multiply(self.tif.asarray(), scale_factor)
-
-        return np.add(self.scaled_array, additive_offset)
-
-    def make_masks(self):
-
-        gf_rows, gf_cols = self.qf_array.shape
-
-        self.mask_array = np.full((gf_rows, gf_cols), np.nan)
-
-        it = np.nditer(self.qf_array, flags=['multi_index'])
+    def apply_factors_offsets_sr(self, out=None):
 
-        for qf_value in it:
+        scale_factor = np.float32(2.75e-5)
+        additive_offset = np.float32(-0.2)
 
-            fill, cloud, shadow, water = unpack_qf(qf_value)
+        # Read the band once
+        band = self.tif.asarray()
 
-            pixel_index = it.multi_index
+        # Scale it straight into out as float32 (a new array if none was given), then offset it in place
+        if out is None:
+            out = np.empty(band.shape, dtype='float32')
+        np.multiply(band, scale_factor, out=out)
+        np.add(out, additive_offset, out=out)
 
-            if fill:
-                self.mask_array[pixel_index] = True
+        self.scaled_array = out
 
-            if cloud:
-                self.mask_array[pixel_index] = True
+        return self.scaled_array
 
-            if shadow:
-                self.mask_array[pixel_index] = True
+    def make_masks(self, mask_dict=None):
 
-            if water:
-                self.mask_array[pixel_index] = True
+        # Boolean mask (True to mask) of fill, not clear, cloud shadow and water, unless another rule is given
+        self.mask_array = t_landsat.get_qa_pixel_mask(self.qf_array, mask_dict)
 
     def get_qf_array(self):
 
@@ -104,66 +102,37 @@ class LandsatImage:
 
         self.qf_array = tifffile.imread(str(quality_flag_path))
 
-    def pad_array(self):
+    # Put the filtered array in its place in a padded (rows, padded cols) canvas, which becomes the filtered array
+    # (the band is scaled straight into the canvas unless it was already loaded)
+    def pad_array(self, canvas):
 
-        print(f"Filtered Array shape before padding: {self.filtered_array.shape}")
+        window = canvas[:, self.cols_to_left:self.cols_to_left + self.columns]
 
-        if self.cols_to_left > 0:
-            left_cols = np.full((self.rows, self.cols_to_left), np.nan)
-            print(f"Left cols shape: {left_cols.shape}")
+        if self.filtered_array is None:
+            self.load_filtered_array(out=window)
+        else:
+            window[...] = self.filtered_array
 
-            self.filtered_array = np.hstack((left_cols, self.filtered_array))
-
-        if self.cols_to_right > 0:
-            right_cols = np.full((self.rows, self.cols_to_right), np.nan)
-            print(f"Right cols shape: {right_cols.shape}")
-            self.filtered_array = np.hstack((self.filtered_array, right_cols))
+        self.filtered_array = canvas
 
         print(f"Filtered Array shape after padding: {self.filtered_array.shape}")
 
 
 def unpack_qf(qf):
 
-    unpacked = bin(qf)[2:]
-
-    while len(unpacked) < 16:
-        unpacked = '0' + unpacked
-
-    reversed = ''
-
-    unpacked_list = list(unpacked)
-    while unpacked_list:
-        reversed += unpacked_list.pop()
-
-    fill = False
-    if reversed[0] == '1':
-        fill = True
+    flags = t_landsat.decode_qa_pixel(int(qf), ['Fill', 'Clear', 'Cloud Shadow', 'Water'])
 
-    cloud = False
-    if reversed[6] == '0':
-        cloud = True
-
-    shadow = False
-    if reversed[4] == '1':
-        shadow = True
-
-    water = False
-    if reversed[7] == '1':
-        water = True
-
-    return fill, cloud, shadow, water
+    return flags['Fill'], not flags['Clear'], flags['Cloud Shadow'], flags['Water']
 
 
 def get_diff_array(ls_one, ls_two):
 
     pad_arrays(ls_one, ls_two)
 
-    return np.subtract(ls_one.filtered_array,
-                       ls_two.filtered_array,
-                       where=~np.isnan(ls_one.filtered_array) & ~np.isnan(ls_two.filtered_array),
-                       out=np.full((ls_one.filtered_array.shape[0],
-                                    ls_one.filtered_array.shape[1]),
-                                   np.nan))
+    # Difference in one output canvas (NaN wherever either image is NaN)
+    diff_array = np.empty(ls_one.filtered_array.shape, dtype=ls_one.filtered_array.dtype)
+
+    return np.subtract(ls_one.filtered_array, ls_two.filtered_array, out=diff_array)
 
 
 def pad_arrays(ls_one, ls_two):
@@ -187,15 +156,20 @@ def pad_arrays(ls_one, ls_two):
     print(f"LS image one left cols: {ls_one.cols_to_left}, right cols: {ls_one.cols_to_right}")
     print(f"LS image two left cols: {ls_two.cols_to_left}, right cols: {ls_two.cols_to_right}")
 
-    ls_one.pad_array()
-    ls_two.pad_array()
+    # One canvas shared by both images, at the padded width (NaN outside each image)
+    canvas = np.full((2, ls_one.rows, ls_one.cols_to_left + ls_one.columns + ls_one.cols_to_right),
+                     np.nan,
+                     dtype='float32')
+
+    ls_one.pad_array(canvas[0])
+    ls_two.pad_array(canvas[1])
 
 
 def main(path_one, path_two):
 
-    # Create LandsatImage objects
-    ls_one = LandsatImage(path_one)
-    ls_two = LandsatImage(path_two)
+    # Create LandsatImage objects (the bands are scaled straight into the comparison canvas)
+    ls_one = LandsatImage(path_one, load_array=False)
+    ls_two = LandsatImage(path_two, load_array=False)
 
     # Get the difference between the arrays
     diff_arr = get_diff_array(ls_one, ls_two)
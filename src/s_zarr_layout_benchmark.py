@@ -0,0 +1,209 @@
+import logging
+import zarr
+import shutil
+import numpy as np
+import t_spinup
+import t_zarr_layout
+from pathlib import Path
+from os import environ, walk
+from os.path import getsize
+from time import time
+from datetime import datetime
+
+
+# Make a synthetic stack of NTL and sensor zenith values (time, row, col) like a VNP46A window
+# (lit areas fixed in space with day-to-day noise, cloudy days and scattered fills)
+def make_synthetic_stack(days=365, rows=220, cols=680, fill_fraction=0.3, seed=0):
+    # Random generator
+    rng = np.random.default_rng(seed)
+    # Lit areas (radiance * 10, mostly dark)
+    base = (rng.gamma(0.5, 200, size=(rows, cols))).astype('float32')
+    # Daily values with noise
+    ntl = np.clip(base[np.newaxis] * rng.normal(1, 0.1, size=(days, 1, 1))
+                  + rng.normal(0, 5, size=(days, rows, cols)), 0, 65534).astype('uint16')
+    # Fill cloudy or bad pixels
+    ntl[rng.random((days, rows, cols)) < fill_fraction] = 65535
+    # Sensor zenith (hundredths of a degree), changing with the orbit each day and across the swath
+    zenith = (np.linspace(-6000, 6000, cols)[np.newaxis, np.newaxis, :]
+              * np.cos(np.arange(days) * 0.7)[:, np.newaxis, np.newaxis]
+              + np.zeros((1, rows, 1))).astype('int16')
+    # Return the variables
+    return {'DNB_BRDF-Corrected_NTL': ntl, 'Sensor_Zenith': zenith}
+
+
+# Get the bytes a store takes on disk
+def get_store_bytes(store_path):
+
+    return sum(getsize(Path(root, name)) for root, dirs, files in walk(store_path) for name in files)
+
+
+# Create the arrays of a layout ('rows' for the legacy per-row arrays, or a chunk profile of t_zarr_layout)
+def create_layout(zarr_root, layout, stacks):
+    # Arrays by variable (one array, or a list of row arrays)
+    arrays = {}
+    # For each variable
+    for var_name in stacks.keys():
+        # Shape of the stack
+        shape = stacks[var_name].shape
+        # If it is the legacy layout
+        if layout == 'rows':
+            # Get the data type and fill value
+            dtype, fill_value = t_zarr_layout.get_fill_values()[var_name]
+            # One (time, col) array per row, as the converters made them
+            arrays[var_name] = [zarr_root.require_group(row).require_dataset(var_name,
+                                                                             shape=(shape[0], shape[2]),
+                                                                             chunks=(shape[0], 10),
+                                                                             dtype=dtype,
+                                                                             fill_value=fill_value,
+                                                                             write_empty_chunks=False)
+                                for row in range(shape[1])]
+        # Otherwise
+        else:
+            arrays[var_name] = t_zarr_layout.require_tile_array(zarr_root, var_name, shape, profile=layout)
+    # Return the arrays
+    return arrays
+
+
+# Write one date of a layout's arrays
+def write_date(arrays, stacks, date_index):
+    # For each variable
+    for var_name in stacks.keys():
+        # If it is the legacy layout
+        if isinstance(arrays[var_name], list):
+            for row, row_arr in enumerate(arrays[var_name]):
+                row_arr[date_index] = stacks[var_name][date_index, row]
+        # Otherwise
+        else:
+            arrays[var_name][date_index] = stacks[var_name][date_index]
+
+
+# Write dates from a start index to the end of a layout's arrays in one write per array
+def write_bulk(arrays, stacks, start_index):
+    # For each variable
+    for var_name in stacks.keys():
+        # If it is the legacy layout
+        if isinstance(arrays[var_name], list):
+            for row, row_arr in enumerate(arrays[var_name]):
+                row_arr[start_index:] = stacks[var_name][start_index:, row]
+        # Otherwise
+        else:
+            arrays[var_name][start_index:] = stacks[var_name][start_index:]
+
+
+# Read a pixel's time series from a layout's arrays
+def read_pixel(arrays, var_name, row, col):
+    # If it is the legacy layout
+    if isinstance(arrays[var_name], list):
+        return arrays[var_name][row][:, col]
+    # Otherwise
+    return arrays[var_name][:, row, col]
+
+
+# Read a date's map from a layout's arrays
+def read_map(arrays, var_name, date_index):
+    # If it is the legacy layout
+    if isinstance(arrays[var_name], list):
+        return np.stack([row_arr[date_index] for row_arr in arrays[var_name]])
+    # Otherwise
+    return arrays[var_name][date_index]
+
+
+# Benchmark a layout: daily writes (as the converters write), bulk writes, pixel time series reads,
+# daily map reads, and storage (returns a dictionary of results)
+def benchmark_layout(output_path, layout, stacks, daily_dates=5, pixel_reads=50, map_reads=20, seed=0):
+    # Random generator (the same reads for every layout)
+    rng = np.random.default_rng(seed)
+    # Store path (made fresh)
+    store_path = Path(output_path, f'layout_benchmark_{layout}')
+    shutil.rmtree(store_path, ignore_errors=True)
+    # Reference the root group
+    zarr_root = zarr.group(store=zarr.DirectoryStore(str(store_path)), overwrite=True)
+    # Shape of the stacks, and their bytes
+    days, rows, cols = stacks['DNB_BRDF-Corrected_NTL'].shape
+    stack_bytes = sum(stack.nbytes for stack in stacks.values())
+    # Create the arrays
+    stime = time()
+    arrays = create_layout(zarr_root, layout, stacks)
+    create_seconds = time() - stime
+    # Write the first dates one at a time
+    stime = time()
+    for date_index in range(daily_dates):
+        write_date(arrays, stacks, date_index)
+    daily_seconds = (time() - stime) / daily_dates
+    # Write the rest in bulk
+    stime = time()
+    write_bulk(arrays, stacks, daily_dates)
+    bulk_seconds = time() - stime
+    # Read pixel time series
+    stime = time()
+    for row, col in zip(rng.integers(0, rows, pixel_reads), rng.integers(0, cols, pixel_reads)):
+        read_pixel(arrays, 'DNB_BRDF-Corrected_NTL', row, col)
+    pixel_seconds = (time() - stime) / pixel_reads
+    # Read daily maps
+    stime = time()
+    for date_index in rng.integers(0, days, map_reads):
+        read_map(arrays, 'DNB_BRDF-Corrected_NTL', date_index)
+    map_seconds = (time() - stime) / map_reads
+    # Count the stored bytes and files
+    store_bytes = get_store_bytes(store_path)
+    file_count = sum(len(files) for root, dirs, files in walk(store_path))
+    # Remove the store
+    shutil.rmtree(store_path, ignore_errors=True)
+    # Return the results
+    return {'Layout': layout,
+            'Create (s)': create_seconds,
+            'Daily Write (s/date)': daily_seconds,
+            'Bulk Write (MB/s)': stack_bytes * (days - daily_dates) / days / 1e6 / bulk_seconds,
+            'Pixel Read (ms)': pixel_seconds * 1000,
+            'Map Read (ms)': map_seconds * 1000,
+            'Stored (MB)': store_bytes / 1e6,
+            'Ratio': stack_bytes / store_bytes,
+            'Files': file_count}
+
+
+# Benchmark the legacy per-row layout and each chunk profile on the same synthetic stack
+def benchmark_layouts(output_path, layouts=None, days=365, rows=220, cols=680, **kwargs):
+    # Layouts to compare
+    if layouts is None:
+        layouts = ['rows'] + t_zarr_layout.get_chunk_profiles()
+    # Make the stack
+    stacks = make_synthetic_stack(days, rows, cols)
+    # List of results
+    results = []
+    # For each layout
+    for layout in layouts:
+        # Benchmark it
+        results.append(benchmark_layout(output_path, layout, stacks, **kwargs))
+        # Log the results
+        logging.info(f'Layout benchmark: {results[-1]}')
+    # Return the results
+    return results
+
+
+# Format benchmark results as a table
+def format_results(results):
+    # Column names
+    columns = list(results[0].keys())
+    # Header
+    lines = [' | '.join(f'{column:>20}' for column in columns)]
+    # Rows
+    for result in results:
+        lines.append(' | '.join(f'{value:>20.2f}' if isinstance(value, float) else f'{value:>20}'
+                                for value in result.values()))
+    # Return the table
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+
+    # Set up the logging config
+    logging.basicConfig(
+        filename=Path(environ['logs_dir'], f'zarr_layout_benchmark_{datetime.now():%Y%m%d%H%M%S}.log'),
+        filemode='w',
+        format=' %(levelname)s - %(asctime)s - %(message)s',
+        level=logging.DEBUG)
+
+    # Benchmark the layouts on a year of the Puerto Rico window
+    layout_results = benchmark_layouts(Path(environ['outputs_dir']))
+
+    print(format_results(layout_results))
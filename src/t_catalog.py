@@ -0,0 +1,149 @@
+import json
+import logging
+import datetime
+import numpy as np
+from pathlib import Path
+
+
+# Epoch for integer day columns
+def get_catalog_epoch():
+
+    return datetime.date(year=1970, month=1, day=1)
+
+
+# Structured dtype for a columnar LAADS catalog (one row per file)
+# (string fields are at least the given widths; make_catalog_array widens them to the longest value)
+def get_catalog_dtype(filename_width=80, product_width=16):
+
+    return np.dtype([
+        ('filename', f'S{filename_width}'),
+        ('product', f'S{product_width}'),
+        ('year', 'u2'),
+        ('doy', 'u2'),
+        # Days since the catalog epoch
+        ('date', 'i4'),
+        # Tile h/v (-1 if the product is not tiled)
+        ('tile_h', 'i1'),
+        ('tile_v', 'i1'),
+        ('collection', 'u2'),
+        # Processing timestamp as written in the filename (YYYYDDDHHMMSS)
+        ('processed', 'i8'),
+        ('md5', 'S32'),
+        # File size in bytes (-1 if unknown)
+        ('size', 'i8')
+    ])
+
+
+# Get days since the catalog epoch from a datetime date object
+def get_days_from_date(date):
+
+    return (date - get_catalog_epoch()).days
+
+
+# Get a datetime date object from days since the catalog epoch
+def get_date_from_days(days):
+
+    return get_catalog_epoch() + datetime.timedelta(days=int(days))
+
+
+# Parse a LAADS filename (e.g. VNP46A2.A2018118.h11v07.001.2020337102243.h5) into a catalog row
+def parse_catalog_row(filename, md5, size=-1):
+    # Split the filename
+    split_name = filename.split('.')
+    # Year and DOY
+    year = int(split_name[1][1:5])
+    doy = int(split_name[1][5:8])
+    # Days since epoch
+    days = get_days_from_date(datetime.date(year=year, month=1, day=1)) + doy - 1
+    # Tile h/v (only for tiled products)
+    tile_h = -1
+    tile_v = -1
+    if len(split_name[2]) == 6 and split_name[2][0] == 'h' and split_name[2][3] == 'v':
+        tile_h = int(split_name[2][1:3])
+        tile_v = int(split_name[2][4:6])
+    # Collection and processing timestamp (0 if they are not where expected)
+    collection = 0
+    processed = 0
+    if len(split_name) > 4 and split_name[3].isdigit():
+        collection = int(split_name[3])
+    if len(split_name) > 5 and split_name[4].isdigit():
+        processed = int(split_name[4])
+    # Return the row
+    return (filename, split_name[0], year, doy, days, tile_h, tile_v, collection, processed, md5, size)
+
+
+# Make a catalog array from a dictionary of filenames and LAADS file records (or plain md5 strings)
+def make_catalog_array(file_dict):
+    # List of rows
+    rows = []
+    # For each filename
+    for filename in file_dict.keys():
+        # Reference the record
+        record = file_dict[filename]
+        # If the record is a plain hash (legacy JSON catalogs)
+        if isinstance(record, str):
+            rows.append(parse_catalog_row(filename, record))
+        # Otherwise (LAADS file record)
+        else:
+            rows.append(parse_catalog_row(filename, record['md5sum'], record.get('size', -1)))
+    # Widths of the string fields (wide enough for the longest filename and product, so none are truncated)
+    filename_width = max([len(row[0].encode('ascii')) for row in rows] + [80])
+    product_width = max([len(row[1].encode('ascii')) for row in rows] + [16])
+    # Make the array
+    catalog = np.array(rows, dtype=get_catalog_dtype(filename_width, product_width))
+    # Return it sorted by date, then filename
+    return catalog[np.lexsort((catalog['filename'], catalog['date']))]
+
+
+# Get a dictionary of LAADS-style file records from a catalog array
+def get_catalog_records(catalog):
+    # Return the records by filename
+    return {filename: {'md5sum': md5, 'size': size}
+            for filename, md5, size in zip(get_filenames(catalog), get_hashes(catalog), catalog['size'].tolist())}
+
+
+# Save a catalog array
+def save_catalog_array(catalog, output_path):
+    # Save as .npy (loadable with memory mapping)
+    with open(output_path, 'wb') as of:
+        np.save(of, catalog, allow_pickle=False)
+    # Return the output path
+    return output_path
+
+
+# Load a catalog array (memory-mapped unless mmap is False)
+def load_catalog_array(catalog_path, mmap=True):
+    # Memory map mode
+    mmap_mode = None
+    if mmap:
+        mmap_mode = 'r'
+    # Load the array
+    return np.load(catalog_path, mmap_mode=mmap_mode, allow_pickle=False)
+
+
+# Convert a legacy {filename: md5} JSON catalog to a catalog array saved alongside it
+def convert_json_catalog(json_path):
+    # Open the file
+    with open(json_path, mode='r') as f:
+        # Make a catalog array
+        catalog = make_catalog_array(json.load(f))
+    # Path for the converted catalog
+    output_path = Path(json_path).with_suffix('.npy')
+    # Save it
+    save_catalog_array(catalog, output_path)
+    # Log information
+    logging.info(f'Converted JSON catalog {json_path} to {output_path}.')
+    # Return the output path
+    return output_path
+
+
+# Get the filenames of a catalog array as a list of strings
+def get_filenames(catalog):
+
+    return np.char.decode(catalog['filename'], 'ascii').tolist()
+
+
+# Get the md5 hashes of a catalog array as a list of strings
+def get_hashes(catalog):
+
+    return np.char.decode(catalog['md5'], 'ascii').tolist()
@@ -3,7 +3,12 @@ import logging
 import t_spinup
 import t_requests
 import t_misc
+import c_session
+import c_remote
+import h5py
 from os import environ
+from dotenv import load_dotenv
+from pathlib import Path
 
 
 # Get a request session object from LAADS via token-based authorization
@@ -18,19 +23,41 @@ def get_laads_session():
     return s
 
 
+# Reload the LAADS token from .env.secrets (in case it has been replaced)
+def refresh_laads_token():
+    load_dotenv('.env.secrets', override=True)
+
+
+# Provider of per-thread, pooled LAADS sessions (sessions are made on first use in each thread)
+session_provider = c_session.SessionProvider(get_laads_session, refresh_func=refresh_laads_token)
+
+
+# Get the LAADS session provider
+def get_session_provider():
+    return session_provider
+
+
 # Get a json from LAADS
-def get_laads_json(json_url, session=get_laads_session()):
+def get_laads_json(json_url, session=None):
+    # If no session was supplied
+    if session is None:
+        # Use this thread's pooled session
+        session = session_provider.get_session()
     # Ensure the json_url ends in .json
     if json_url.split('.')[-1] != 'json':
         json_url += '.json'
     # Ask nicely for the json, validating with a conversion to json
-    r = t_requests.ask_nicely(session, json_url, validation_func=t_requests.validate_request_json)
+    r = t_requests.ask_nicely(session,
+                              json_url,
+                              session_func=session_provider.refresh_session,
+                              validation_func=t_requests.validate_request_json,
+                              allow_redirects=True)
     # Return the parse of the get attempt
     return parse_laads_get(r, json_url)
 
 
 # Get a HDF5 file from LAADS
-def get_laads_hdf5(h5_request, session=get_laads_session(), hash_to_check=None):
+def get_laads_hdf5(h5_request, session=None, hash_to_check=None):
     # If a tuple of h5 url and a hash was supplied
     if isinstance(h5_request, tuple):
         # Break up the components
@@ -38,6 +65,10 @@ def get_laads_hdf5(h5_request, session=get_laads_session(), hash_to_check=None):
         hash_to_check = h5_request[1]
     else:
         h5_url = h5_request
+    # If no session was supplied
+    if session is None:
+        # Use this thread's pooled session
+        session = session_provider.get_session()
     # Ensure the h5_url ends in .h5
     if h5_url.split('.')[-1] != 'h5':
         h5_url += '.h5'
@@ -50,15 +81,17 @@ def get_laads_hdf5(h5_request, session=get_laads_session(), hash_to_check=None):
     # Ask nicely for the HDF5 file, checking the hash
     r = t_requests.ask_nicely(session,
                               h5_url,
+                              session_func=session_provider.refresh_session,
                               hash_func=hash_func,
                               hash_to_check=hash_to_check,
-                              validation_func=t_requests.validate_request_hdf5)
+                              validation_func=t_requests.validate_request_hdf5,
+                              allow_redirects=True)
     # Return a tuple of the URL and a parse of the get attempt
     return (h5_url, parse_laads_get(r, h5_url))
 
 
 # Get a HDF4 file from LAADS
-def get_laads_hdf4(h4_request, session=get_laads_session(), hash_to_check=None):
+def get_laads_hdf4(h4_request, session=None, hash_to_check=None):
     # If a tuple of h5 url and a hash was supplied
     if isinstance(h4_request, tuple):
         # Break up the components
@@ -66,6 +99,10 @@ def get_laads_hdf4(h4_request, session=get_laads_session(), hash_to_check=None):
         hash_to_check = h4_request[1]
     else:
         h4_url = h4_request
+    # If no session was supplied
+    if session is None:
+        # Use this thread's pooled session
+        session = session_provider.get_session()
     # Ensure the h4_url ends in .hdf
     if h4_url.split('.')[-1] != 'hdf':
         h4_url += '.hdf'
@@ -78,12 +115,90 @@ def get_laads_hdf4(h4_request, session=get_laads_session(), hash_to_check=None):
     # Ask nicely for the HDF5 file, checking the hash
     r = t_requests.ask_nicely(session,
                               h4_url,
+                              session_func=session_provider.refresh_session,
                               hash_func=hash_func,
-                              hash_to_check=hash_to_check)
+                              hash_to_check=hash_to_check,
+                              allow_redirects=True)
     # Return a tuple of the URL and a parse of the get attempt
     return (h4_url, parse_laads_get(r, h4_url))
 
 
+# Download a file from LAADS straight to a directory (streamed, so only one buffer is held in memory)
+# (structural validation is left to the caller, off the download thread, unless a validation_func is given)
+def get_laads_file(file_request, download_dir, session=None, hash_to_check=None, status_hook=None,
+                   validation_func=None):
+    # If a tuple of file url and a hash was supplied
+    if isinstance(file_request, tuple):
+        # Break up the components
+        file_url = file_request[0]
+        hash_to_check = file_request[1]
+    else:
+        file_url = file_request
+    # If no session was supplied
+    if session is None:
+        # Use this thread's pooled session
+        session = session_provider.get_session()
+    # Get the write path for the file
+    write_path = Path(download_dir, file_url.split('/')[-1])
+    # Download nicely, checking the hash as the file streams
+    write_path = t_requests.download_nicely(session,
+                                            file_url,
+                                            write_path,
+                                            session_func=session_provider.refresh_session,
+                                            hash_to_check=hash_to_check,
+                                            validation_func=validation_func,
+                                            status_hook=status_hook,
+                                            allow_redirects=True)
+    # Return a tuple of the URL and the write path (None if unsuccessful)
+    return (file_url, parse_laads_get(write_path, file_url))
+
+
+# Read a window of datasets from a HDF5 file on LAADS with range requests (without downloading the whole file)
+# Returns a tuple of the URL and a dictionary of arrays by dataset name (None if unsuccessful)
+# rows and cols are (min, max) tuples (None for all); datasets are read from the group at group_path
+def get_laads_subset(subset_request, dataset_names, group_path, rows=None, cols=None, session=None,
+                     block_size=262144):
+    # If a tuple of file url and a hash was supplied (the hash is not used, only part of the file is read)
+    if isinstance(subset_request, tuple):
+        file_url = subset_request[0]
+    else:
+        file_url = subset_request
+    # If no session was supplied
+    if session is None:
+        # Use this thread's pooled session
+        session = session_provider.get_session()
+    # Slices for the window
+    row_slice = slice(None)
+    col_slice = slice(None)
+    if rows:
+        row_slice = slice(rows[0], rows[1])
+    if cols:
+        col_slice = slice(cols[0], cols[1])
+    # Arrays by dataset name
+    subset = {}
+    # Try to read the window
+    try:
+        # Open the file over range requests
+        remote_file = c_remote.RemoteFile(file_url, session, block_size=block_size)
+        # Open it as HDF5
+        with h5py.File(remote_file, 'r') as h5file:
+            # For each dataset
+            for dataset_name in t_misc.listify(dataset_names):
+                # Read the window
+                subset[dataset_name] = h5file[group_path][dataset_name][row_slice, col_slice]
+    # If not successful
+    except (OSError, KeyError) as e:
+        # Log the error
+        logging.error(f'Reading a subset of {file_url} failed: {e}')
+        # Return the URL and None
+        return (file_url, None)
+    # Log the info
+    logging.info(f'Read {list(subset.keys())} from {file_url} with {remote_file.requests_made} range requests '
+                 f'({remote_file.bytes_fetched} of {remote_file.size} bytes).')
+    # Return a tuple of the URL and the arrays
+    return (file_url, subset)
+
+
 # Parse the result of getting a file from LAADS
 def parse_laads_get(r, url):
     # If we got a response
@@ -0,0 +1,78 @@
+import logging
+import numpy as np
+
+
+# Bits of the single-bit flags of the Landsat Collection 2 QA_PIXEL band
+def get_qa_pixel_bits():
+
+    return {'Fill': 0,
+            'Dilated Cloud': 1,
+            'Cirrus': 2,
+            'Cloud': 3,
+            'Cloud Shadow': 4,
+            'Snow': 5,
+            'Clear': 6,
+            'Water': 7}
+
+
+# First bits of the two-bit confidence fields of the QA_PIXEL band (0 none, 1 low, 2 medium, 3 high)
+def get_qa_pixel_confidence_bits():
+
+    return {'Cloud Confidence': 8,
+            'Cloud Shadow Confidence': 10,
+            'Snow Confidence': 12,
+            'Cirrus Confidence': 14}
+
+
+# Default mask rule: flag names to the flag value that masks a pixel
+# (fill, anything not clear, cloud shadow and water)
+def get_default_mask_dict():
+
+    return {'Fill': True,
+            'Clear': False,
+            'Cloud Shadow': True,
+            'Water': True}
+
+
+# Decode QA_PIXEL flags (any shape) into boolean arrays by flag name (all flags if none are named)
+def decode_qa_pixel(qa_array, flags=None):
+    # Flag bits
+    bits = get_qa_pixel_bits()
+    # If no flags were named
+    if flags is None:
+        flags = bits.keys()
+    # Decode each flag
+    return {flag: (qa_array & (1 << bits[flag])) != 0 for flag in flags}
+
+
+# Decode QA_PIXEL confidence fields (any shape) into uint8 arrays by field name (all fields if none are named)
+def decode_qa_pixel_confidence(qa_array, fields=None):
+    # Field bits
+    bits = get_qa_pixel_confidence_bits()
+    # If no fields were named
+    if fields is None:
+        fields = bits.keys()
+    # Decode each field
+    return {field: ((qa_array >> bits[field]) & 3).astype('uint8') for field in fields}
+
+
+# Get a boolean mask (True to mask) of a QA_PIXEL array from a mask rule (see get_default_mask_dict) in one pass
+# (flags that mask when unset are flipped, so a pixel is masked if any bit of the rule is set)
+def get_qa_pixel_mask(qa_array, mask_dict=None):
+    # If there is no rule
+    if mask_dict is None:
+        mask_dict = get_default_mask_dict()
+    # Flag bits
+    bits = get_qa_pixel_bits()
+    # If a flag is unknown
+    unknown = [flag for flag in mask_dict.keys() if flag not in bits]
+    if unknown:
+        # Log an error
+        logging.error(f'Unknown QA_PIXEL flags {unknown}. Use any of {list(bits.keys())}.')
+        # Return None
+        return None
+    # Bits of the rule, and the bits that mask when unset
+    rule_bits = sum(1 << bits[flag] for flag in mask_dict.keys())
+    flip_bits = sum(1 << bits[flag] for flag in mask_dict.keys() if not mask_dict[flag])
+    # Mask the pixels with any rule bit set (after flipping)
+    return ((qa_array ^ np.uint16(flip_bits)) & np.uint16(rule_bits)) != 0
@@ -1,23 +1,39 @@
 import logging
 import h5py
 import t_misc
+import c_retry
+import json
 import hashlib
+import mmap
 from io import BytesIO
+from os import remove, replace
+from os.path import exists, getsize
+from pathlib import Path
+from urllib.parse import urlsplit
 from time import sleep
-from requests.exceptions import JSONDecodeError
+from requests.exceptions import JSONDecodeError, RequestException
 
 
 # Ask nicely for a particular URL from a requests module session object
+# (retry_policy decides the back-off and which status codes are retried, see c_retry.RetryPolicy)
 def ask_nicely(session,
                url,
                session_func=None,
                validation_func=None,
                hash_func=None,
                hash_to_check=None,
-               back_off_base=0,
-               back_off_inc=1,
+               retry_policy=None,
+               allow_redirects=False,
                attempts_per_session=3,
                max_attempts=10):
+    # If no retry policy was supplied
+    if retry_policy is None:
+        # Use the default (sharing the circuit breaker)
+        retry_policy = c_retry.get_retry_policy()
+    # Host of the URL (for the circuit breaker)
+    host = urlsplit(url).netloc
+    # Retry-After header of the last response
+    retry_after = None
     # Attempts count
     attempts = 0
     # Attempts left in session
@@ -28,10 +44,9 @@ def ask_nicely(session,
         attempts += 1
         # If this is not the first attempt
         if attempts > 1:
-            # Add to the back-off timer
-            back_off_base += back_off_inc
             # Wait quietly and politely
-            sleep(back_off_base)
+            sleep(retry_policy.get_delay(attempts - 1, retry_after))
+            retry_after = None
         # If attempt max has been reached
         if attempts == max_attempts + 1:
             # Log max attempts
@@ -60,12 +75,46 @@ def ask_nicely(session,
                     f'No function to get new session (session_func) was supplied.')
                 # Break the loop
                 break
-        # Make a request
-        r = session.get(url, allow_redirects=False)
+        # If the circuit for the host is open
+        if not retry_policy.allow_request(host):
+            # Wait until it lets a probe through (at least the back-off base, in case another thread is probing)
+            wait = max(retry_policy.circuit_breaker.get_wait(host), retry_policy.back_off_base)
+            # Log the info
+            logging.info(f'Circuit for {host} is open, waiting {round(wait)} seconds before requesting {url}.')
+            sleep(wait)
+            # The wait uses an attempt, but not the session's
+            session_attempts += 1
+            # Move to next attempt
+            continue
+        # Try to make a request
+        try:
+            r = session.get(url, allow_redirects=allow_redirects)
+        # If the connection failed
+        except RequestException as e:
+            # Log the error
+            logging.info(f'Request for {url}, attempt {attempts} failed: {e}')
+            # Report the failure to the circuit breaker
+            retry_policy.record_status(host, None)
+            # Move to next attempt
+            continue
+        # Report the status code to the circuit breaker
+        retry_policy.record_status(host, r.status_code)
         # If the request does not have a success code (code 200)
         if r.status_code != 200:
             # Log a non-200 status code
             logging.info(f'Request for {url}, attempt {attempts} returned code: {r.status_code}.')
+            # Decide what to do about it
+            action = retry_policy.get_action(r.status_code)
+            # If asking again will not help
+            if action == 'fail':
+                # Break the loop
+                break
+            # If the session needs new credentials
+            if action == 'refresh':
+                # Use up the session's attempts (it is refreshed on the next attempt)
+                session_attempts = 1
+            # Keep any Retry-After header for the back-off
+            retry_after = r.headers.get('Retry-After')
             # Move to next attempt
             continue
         # If there is a hash function
@@ -112,6 +161,339 @@ def ask_nicely(session,
     return None
 
 
+# Ask nicely for a particular URL, streaming the content to a file (returns the write path, or None)
+# Interrupted downloads are kept as {file}.part (with a {file}.part.json record) and resumed with Range requests
+def download_nicely(session,
+                    url,
+                    write_path,
+                    session_func=None,
+                    validation_func=None,
+                    hash_to_check=None,
+                    chunk_size=1048576,
+                    status_hook=None,
+                    retry_policy=None,
+                    allow_redirects=False,
+                    attempts_per_session=3,
+                    max_attempts=10):
+    # Make sure the write path is a Path
+    write_path = Path(write_path)
+    # Ensure the path, but if it returns False (failed)
+    if not t_misc.ensure_file_path_dirs_exist(write_path):
+        # Log an error
+        logging.error(f'Could not ensure write path for {write_path}.')
+        # Return None
+        return None
+    # Temporary path in the same directory (so the final rename is atomic)
+    part_path = get_part_path(write_path)
+    # Keep a matching partial download to resume from (a stale one is removed)
+    check_part_record(part_path, url, hash_to_check)
+    # Record the download, so it can be resumed if interrupted
+    write_part_record(part_path, url, hash_to_check)
+    # If no retry policy was supplied
+    if retry_policy is None:
+        # Use the default (sharing the circuit breaker)
+        retry_policy = c_retry.get_retry_policy()
+    # Host of the URL (for the circuit breaker)
+    host = urlsplit(url).netloc
+    # Status code and Retry-After header of each response
+    response_info = {}
+    # Attempts count
+    attempts = 0
+    # Attempts left in session
+    session_attempts = attempts_per_session
+    # While attempts continue
+    while True:
+        # Increment attempts
+        attempts += 1
+        # If this is not the first attempt
+        if attempts > 1:
+            # Wait quietly and politely
+            sleep(retry_policy.get_delay(attempts - 1, response_info.get('Retry-After')))
+        # If attempt max has been reached
+        if attempts == max_attempts + 1:
+            # Log max attempts
+            logging.error(f'Download of {url} reached maximum attempts ({max_attempts}).')
+            # Break the loop
+            break
+        # Decrement remaining attempts for session
+        session_attempts -= 1
+        # If session attempts has reached 0
+        if session_attempts == 0:
+            # If a session generation function has been supplied
+            if session_func:
+                # Refresh the session
+                session = session_func()
+                # Reset the attempts
+                session_attempts = attempts_per_session
+            # Otherwise (no session function supplied)
+            else:
+                # Log information
+                logging.info(
+                    f'Download of {url} reached maximum attempts for session ({attempts_per_session}). '
+                    f'No function to get new session (session_func) was supplied.')
+                # Break the loop
+                break
+        # If the circuit for the host is open
+        if not retry_policy.allow_request(host):
+            # Wait until it lets a probe through (at least the back-off base, in case another thread is probing)
+            wait = max(retry_policy.circuit_breaker.get_wait(host), retry_policy.back_off_base)
+            # Log the info
+            logging.info(f'Circuit for {host} is open, waiting {round(wait)} seconds before downloading {url}.')
+            sleep(wait)
+            # The wait uses an attempt, but not the session's
+            session_attempts += 1
+            # Move to next attempt
+            continue
+        # Stream the content to the temporary file (resuming any partial download)
+        response_info = {}
+        file_hash = stream_to_file(session, url, part_path, chunk_size, status_hook=status_hook,
+                                   response_info=response_info, allow_redirects=allow_redirects)
+        # Status code (None if there was no response)
+        status_code = response_info.get('Status Code')
+        # Report the outcome to the circuit breaker (a stream that broke off counts as no response)
+        if not file_hash and status_code in (200, 206):
+            retry_policy.record_status(host, None)
+        else:
+            retry_policy.record_status(host, status_code)
+        # If the stream failed
+        if not file_hash:
+            # Record how far the partial download got
+            write_part_record(part_path, url, hash_to_check)
+            # Decide what to do about it (a range the server could not serve has been restarted)
+            action = 'retry'
+            if status_code not in (200, 206, 416):
+                action = retry_policy.get_action(status_code)
+            # If asking again will not help
+            if action == 'fail':
+                # Break the loop
+                break
+            # If the session needs new credentials
+            if action == 'refresh':
+                # Use up the session's attempts (it is refreshed on the next attempt)
+                session_attempts = 1
+            # Move to next attempt
+            continue
+        # If a hash was provided to check against, and it does not match
+        if hash_to_check and file_hash != hash_to_check:
+            # Log a hash match failure
+            logging.info(f'Download of {url} did not match hash.')
+            # Remove the partial download
+            remove_part(part_path)
+            # Go to the next attempt
+            continue
+        # If there is a validation function, and the file fails it
+        if validation_func and not all(v_func(part_path) for v_func in t_misc.listify(validation_func)):
+            # Log a validation failure
+            logging.info(f'Download of {url} failed validation.')
+            # Remove the partial download
+            remove_part(part_path)
+            # Go to the next attempt
+            continue
+        # Move the finished file into place
+        replace(part_path, write_path)
+        # Remove the partial download record
+        remove_quietly(get_part_record_path(part_path))
+        # Log the info
+        logging.info(f'Successfully downloaded {url} to {write_path}.')
+        # Return the write path
+        return write_path
+    # Log failure (any partial download is kept to resume from next time)
+    logging.error(f'Download of {url} failed completely.')
+    # Return None
+    return None
+
+
+# Stream a URL to a file, resuming from the end of an existing partial file with a Range request
+# (returns the MD5 of the whole file, or None if the request failed)
+# status_hook, if given, is called with each response status code (e.g. to adapt concurrency)
+# response_info, if given, is filled with the response's 'Status Code' and 'Retry-After' header
+def stream_to_file(session, url, part_path, chunk_size=1048576, status_hook=None, response_info=None,
+                   allow_redirects=False):
+    # Bytes already on disk
+    offset = 0
+    if exists(part_path):
+        offset = getsize(part_path)
+    # Try to stream the content
+    try:
+        # If resuming
+        if offset:
+            # Hash the bytes already on disk
+            md5 = hash_file(part_path, chunk_size)
+            # Ask for the rest of the file
+            headers = {'Range': f'bytes={offset}-'}
+        # Otherwise
+        else:
+            # Fresh hash and no range
+            md5 = hashlib.md5()
+            headers = {}
+        # Make a streaming request
+        with session.get(url, headers=headers, allow_redirects=allow_redirects, stream=True) as r:
+            # If there is a status hook
+            if status_hook:
+                # Report the status code
+                status_hook(r.status_code)
+            # If there is a response dictionary
+            if response_info is not None:
+                # Fill it
+                response_info['Status Code'] = r.status_code
+                response_info['Retry-After'] = r.headers.get('Retry-After')
+            # If resuming, and the partial file already holds the whole file
+            if offset and r.status_code == 416:
+                # Return the hash
+                return md5.hexdigest()
+            # If resuming, and the server sent the rest of the file
+            if offset and r.status_code == 206 and r.headers.get('Content-Range', '').startswith(f'bytes {offset}-'):
+                # Append to the partial file
+                mode = 'ab'
+                # Log the info
+                logging.info(f'Resuming {url} from byte {offset}.')
+            # Otherwise, if the server sent the whole file
+            elif r.status_code == 200:
+                # Start the partial file (and hash) again
+                mode = 'wb'
+                md5 = hashlib.md5()
+            # Otherwise
+            else:
+                # Log the status code
+                logging.info(f'Request for {url} (from byte {offset}) returned code: {r.status_code}.')
+                # If the server could not resume from the offset
+                if offset and r.status_code in (206, 416):
+                    # Remove the partial file, so the next attempt starts again
+                    remove_quietly(part_path)
+                # Return None
+                return None
+            # Open the file
+            with open(part_path, mode) as f:
+                # For each chunk of content
+                for chunk in r.iter_content(chunk_size=chunk_size):
+                    # Update the hash and write the chunk
+                    md5.update(chunk)
+                    f.write(chunk)
+    # If the connection failed or the file could not be written
+    except (RequestException, OSError) as e:
+        # Log the error
+        logging.info(f'Streaming {url} to {part_path} failed: {e}')
+        # Return None
+        return None
+    # Return the hash
+    return md5.hexdigest()
+
+
+# Hash a file on disk in chunks
+def hash_file(file_path, chunk_size=1048576):
+    # Incremental hash
+    md5 = hashlib.md5()
+    # Open the file
+    with open(file_path, 'rb') as f:
+        # For each chunk
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            # Update the hash
+            md5.update(chunk)
+    # Return the hash object
+    return md5
+
+
+# Get the MD5 hex digest of a file on disk, reading it through a memory map (top level, so process pools can use it)
+def get_file_md5(file_path):
+    # Open the file
+    with open(file_path, 'rb') as f:
+        # If the file is empty (empty files cannot be memory-mapped)
+        if not getsize(file_path):
+            # Return the hash of nothing
+            return hashlib.md5().hexdigest()
+        # Map the file and hash it in one call (hashlib releases the GIL on large buffers)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return hashlib.md5(mapped).hexdigest()
+
+
+# Get the temporary (partial download) path for a write path
+def get_part_path(write_path):
+
+    return Path(write_path).with_name(Path(write_path).name + '.part')
+
+
+# Get the path of the record kept alongside a partial download
+def get_part_record_path(part_path):
+
+    return Path(part_path).with_name(Path(part_path).name + '.json')
+
+
+# Record the URL, reference hash and offset of a partial download
+def write_part_record(part_path, url, hash_to_check):
+    # Bytes on disk
+    offset = 0
+    if exists(part_path):
+        offset = getsize(part_path)
+    # Try to write the record
+    try:
+        with open(get_part_record_path(part_path), 'w') as of:
+            json.dump({'URL': url, 'Hash': hash_to_check, 'Offset': offset}, of)
+    # If not successful
+    except OSError:
+        # Log the occurrence
+        logging.warning(f'Could not write partial download record for {part_path}.')
+
+
+# Check a partial download belongs to the URL and hash being downloaded, and holds at least the bytes recorded
+# (if not, remove it; it can hold more, as the record is only updated when a stream breaks off)
+def check_part_record(part_path, url, hash_to_check):
+    # If there is no partial download
+    if not exists(part_path):
+        # Return False (nothing to resume)
+        return False
+    # Try to read the record
+    try:
+        with open(get_part_record_path(part_path), 'r') as f:
+            record = json.load(f)
+    # If there is no (readable) record
+    except (OSError, ValueError):
+        record = None
+    # If the record matches, and the partial file has not been cut short
+    if record and record['URL'] == url and record['Hash'] == hash_to_check \
+            and getsize(part_path) >= record.get('Offset', 0):
+        # Log the info
+        logging.info(f'Found partial download of {url} ({getsize(part_path)} bytes).')
+        # Return True (resumable)
+        return True
+    # Otherwise, remove the stale partial download
+    logging.info(f'Removing stale partial download {part_path}.')
+    remove_part(part_path)
+    # Return False
+    return False
+
+
+# Remove a partial download and its record
+def remove_part(part_path):
+    remove_quietly(part_path)
+    remove_quietly(get_part_record_path(part_path))
+
+
+# Remove a file if it exists
+def remove_quietly(file_path):
+    # Try to remove the file
+    try:
+        remove(file_path)
+    # If it was not there
+    except FileNotFoundError:
+        pass
+
+
+# Validate a file on disk as hdf5
+def validate_file_hdf5(file_path):
+    # Try to open the file as HDF5
+    try:
+        with h5py.File(file_path, 'r'):
+            pass
+    # If not successful
+    except OSError:
+        # Log the occurrence
+        logging.debug(f'{file_path} was not a valid HDF5.')
+        # Return False
+        return False
+    # Return True (valid)
+    return True
+
+
 # Validate a request contents as json
 def validate_request_json(r):
     # Try to parse the response into json
@@ -131,9 +513,10 @@ def validate_request_json(r):
 
 # Validate a request contents as hdf5
 def validate_request_hdf5(r):
-    # Try to parse the response into HDF5
+    # Try to parse the response into HDF5 (closing the file again)
     try:
-        test_convert = h5py.File(BytesIO(r.content), 'r')
+        with h5py.File(BytesIO(r.content), 'r'):
+            pass
     # If not successful
     except OSError:
         # Log the occurrence
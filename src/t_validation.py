@@ -0,0 +1,144 @@
+import logging
+import h5py
+import t_misc
+from os import replace
+from os.path import getsize
+from pathlib import Path
+
+
+# Validation levels, cheapest first (each level includes the checks of the levels before it)
+def get_validation_levels():
+
+    return ['none', 'signature', 'size', 'deep']
+
+
+# Signature at the start of an HDF5 superblock
+def get_hdf5_signature():
+
+    return b'\x89HDF\r\n\x1a\n'
+
+
+# Check a file has an HDF5 superblock signature and a known superblock version
+# (the superblock is at 0, or after a user block at 512 bytes or a power of two beyond)
+def check_hdf5_signature(file_path):
+    # Get the file size
+    size = getsize(file_path)
+    # Open the file
+    with open(file_path, 'rb') as f:
+        # Offset to look for the superblock at
+        offset = 0
+        # While there is room for a signature and a version byte
+        while offset + 9 <= size:
+            # Read the signature and version
+            f.seek(offset)
+            head = f.read(9)
+            # If the signature is there
+            if head[:8] == get_hdf5_signature():
+                # If the superblock version is known
+                if head[8] <= 3:
+                    # Return True (valid)
+                    return True
+                # Log the occurrence
+                logging.debug(f'{file_path} has an unknown HDF5 superblock version {head[8]}.')
+                # Return False
+                return False
+            # Move on to the next possible offset
+            offset = 512 if offset == 0 else offset * 2
+    # Log the occurrence
+    logging.debug(f'{file_path} has no HDF5 signature.')
+    # Return False
+    return False
+
+
+# Check a file is the expected size (True if the expected size is unknown)
+def check_file_size(file_path, expected_size=None):
+    # If the expected size is unknown
+    if expected_size is None or expected_size < 0:
+        return True
+    # Get the size
+    size = getsize(file_path)
+    # If the size differs
+    if size != expected_size:
+        # Log the occurrence
+        logging.debug(f'{file_path} is {size} bytes, expected {expected_size}.')
+        # Return False
+        return False
+    # Return True (valid)
+    return True
+
+
+# Check an HDF5 file opens, and that a group holds the expected datasets (if given)
+def check_hdf5_datasets(file_path, group_path=None, dataset_names=None):
+    # Try to open the file
+    try:
+        with h5py.File(file_path, 'r') as h5file:
+            # If there is no group to check
+            if not group_path:
+                return True
+            # If the group is missing
+            if group_path not in h5file:
+                # Log the occurrence
+                logging.debug(f'{file_path} has no group {group_path}.')
+                # Return False
+                return False
+            # Reference the group
+            group = h5file[group_path]
+            # Find any missing datasets
+            missing = [name for name in t_misc.listify(dataset_names)
+                       if name not in group or not isinstance(group[name], h5py.Dataset)]
+            # If there are missing datasets
+            if missing:
+                # Log the occurrence
+                logging.debug(f'{file_path} is missing datasets {missing} in {group_path}.')
+                # Return False
+                return False
+    # If not successful
+    except OSError:
+        # Log the occurrence
+        logging.debug(f'{file_path} was not a valid HDF5.')
+        # Return False
+        return False
+    # Return True (valid)
+    return True
+
+
+# Validate an HDF5 file on disk to a level (see get_validation_levels)
+def validate_file_hdf5(file_path, level='size', expected_size=None, group_path=None, dataset_names=None):
+    # Get the levels
+    levels = get_validation_levels()
+    # If the level is unknown
+    if level not in levels:
+        # Log an error
+        logging.error(f'Unknown validation level {level}. Use one of {levels}.')
+        # Return False
+        return False
+    # Position of the level
+    position = levels.index(level)
+    # Signature and superblock
+    if position >= levels.index('signature') and not check_hdf5_signature(file_path):
+        return False
+    # Size
+    if position >= levels.index('size') and not check_file_size(file_path, expected_size):
+        return False
+    # Groups and datasets
+    if position >= levels.index('deep') and not check_hdf5_datasets(file_path, group_path, dataset_names):
+        return False
+    # Return True (valid)
+    return True
+
+
+# Move a file that failed validation aside as {name}.invalid (kept for inspection), returning the new path
+def quarantine_file(file_path):
+    # Path to move the file to
+    invalid_path = Path(file_path).with_name(Path(file_path).name + '.invalid')
+    # Try to move the file
+    try:
+        replace(file_path, invalid_path)
+    # If it was not there
+    except FileNotFoundError:
+        # Return None
+        return None
+    # Log the occurrence
+    logging.warning(f'Moved {file_path} to {invalid_path}.')
+    # Return the new path
+    return invalid_path
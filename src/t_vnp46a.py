@@ -1,5 +1,6 @@
 import t_spinup
 import t_misc
+import numpy as np
 from time import time
 from datetime import datetime
 
@@ -39,6 +40,66 @@ def get_components_from_filename(filename,
         return output
 
 
+# Integer code (h * 100 + v) for a tile name like 'h11v07' or an (h, v) tuple
+def get_tile_code(tile):
+
+    if isinstance(tile, str):
+        return int(tile[1:3]) * 100 + int(tile[4:6])
+
+    return int(tile[0]) * 100 + int(tile[1])
+
+
+# Pixels along each side of a tile of the 15 arc second grid (10 degrees)
+def get_tile_pixels():
+
+    return 2400
+
+
+# Pixels per degree of the 15 arc second grid
+def get_pixels_per_degree():
+
+    return 240
+
+
+# Get the (h, v) tiles of the 10 degree linear lat/lon grid (36 x 18 tiles) intersecting a bounding box
+def get_tiles_from_bbox(min_lon, min_lat, max_lon, max_lat):
+
+    # Columns (h) count east from 180W, rows (v) count south from 90N
+    h_min = int(np.floor((min_lon + 180) / 10))
+    h_max = int(np.ceil((max_lon + 180) / 10)) - 1
+    v_min = int(np.floor((90 - max_lat) / 10))
+    v_max = int(np.ceil((90 - min_lat) / 10)) - 1
+
+    # Keep to the grid (and a zero-area box still gets its tile)
+    h_min, h_max = np.clip([h_min, max(h_min, h_max)], 0, 35)
+    v_min, v_max = np.clip([v_min, max(v_min, v_max)], 0, 17)
+
+    return [(h, v) for h in range(h_min, h_max + 1) for v in range(v_min, v_max + 1)]
+
+
+# Get the integer tile codes intersecting a bounding box
+def get_tile_codes_from_bbox(min_lon, min_lat, max_lon, max_lat):
+
+    return [get_tile_code(tile) for tile in get_tiles_from_bbox(min_lon, min_lat, max_lon, max_lat)]
+
+
+# Path of the data fields group in VNP46 HDF5 granules
+def get_data_fields_path():
+
+    return 'HDFEOS/GRIDS/VNP_Grid_DNB/Data Fields'
+
+
+# Datasets expected in the data fields group of a VNP46 product's granules
+def get_expected_datasets(product):
+
+    if product == 'VNP46A1':
+        return ['Sensor_Zenith', 'Sensor_Azimuth']
+    if product == 'VNP46A2':
+        return ['DNB_BRDF-Corrected_NTL', 'Mandatory_Quality_Flag', 'QF_Cloud_Mask']
+
+    return []
+
+
 def get_components_from_filename_benchmark(filename):
 
     splitname = filename.split('.')
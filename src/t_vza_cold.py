@@ -14,6 +14,12 @@ cloud/snow-influenced pixels.
 
 from pathlib import Path
 from time import time
+from os import environ, replace
+from os.path import exists
+import t_spinup
+import logging
+import hashlib
+import json
 import numpy as np
 import h5py
 
@@ -95,47 +101,149 @@ def get_vza_cold_qf_dict():
     }
 
 
-def get_mask_hash_table(qf_dict, mask_dict):
+# Get the integer of a QF code string (code strings in the specs are written lowest bit first)
+def get_code_int(code):
+
+    return sum(int(bit) << position for position, bit in enumerate(code))
+
+
+# Compile a QF spec (like get_vnp_qf_dict) into shift/mask operations, without changing the spec
+# Returns {'Fill Value': fill value or None, 'Fields': {field: (shift, mask, {code integer: label})}}
+def compile_qf_spec(qf_dict):
+
+    compiled = {'Fill Value': qf_dict.get('Fill Value'), 'Fields': {}}
+
+    for qf_key in qf_dict.keys():
+        if qf_key == 'Fill Value':
+            continue
+        qf_slice, codes = qf_dict[qf_key]
+        compiled['Fields'][qf_key] = (qf_slice.start,
+                                      (1 << (qf_slice.stop - qf_slice.start)) - 1,
+                                      {get_code_int(code): codes[code] for code in codes.keys()})
+
+    return compiled
+
+
+# Decode a QF array (any shape) into an integer array of each field's code (all fields if none are named)
+def decode_qf_array(qf_array, qf_dict, fields=None):
+
+    compiled = compile_qf_spec(qf_dict)
+
+    if fields is None:
+        fields = compiled['Fields'].keys()
+
+    qf_array = np.asarray(qf_array, dtype='uint16')
+
+    decoded = {}
+
+    for qf_key in fields:
+        shift, mask, codes = compiled['Fields'][qf_key]
+        decoded[qf_key] = ((qf_array >> shift) & mask).astype('uint8')
+
+    return decoded
+
+
+# Get the codes of a field whose labels match a mask value (a list of labels, or a single label)
+def get_matching_codes(codes, mask_value):
+
+    if isinstance(mask_value, list):
+        return [code for code in codes.keys() if codes[code] in mask_value]
+
+    return [code for code in codes.keys() if codes[code] == mask_value]
+
+
+# Get a boolean array of the QF values (any shape) whose every field has a code in the spec,
+# and whose fields named in mask_dict have matching labels (fills never match)
+def match_qf_array(qf_array, qf_dict, mask_dict):
+
+    compiled = compile_qf_spec(qf_dict)
+
+    qf_array = np.asarray(qf_array, dtype='uint16')
+
+    decoded = decode_qf_array(qf_array, qf_dict)
+
+    match = np.ones(qf_array.shape, dtype=bool)
+
+    if compiled['Fill Value'] is not None:
+        match &= qf_array != compiled['Fill Value']
+
+    for qf_key in compiled['Fields'].keys():
+        shift, mask, codes = compiled['Fields'][qf_key]
+        # Codes allowed for the field, as a lookup indexed by code
+        allowed = np.zeros(mask + 1, dtype=bool)
+        if qf_key in mask_dict.keys():
+            allowed[get_matching_codes(codes, mask_dict[qf_key])] = True
+        else:
+            allowed[list(codes.keys())] = True
+        match &= allowed[decoded[qf_key]]
+
+    return match
+
 
-    fill_value = None
-    if 'Fill Value' in qf_dict:
-        fill_value = qf_dict['Fill Value']
-        qf_dict.pop('Fill Value')
+# Get a hash of a mask rule (a QF spec and a mask dictionary), for naming its lookup table
+def get_mask_rule_hash(qf_dict, mask_dict):
 
-    mask_list = []
+    compiled = compile_qf_spec(qf_dict)
 
-    for value in np.arange(0, 2100):
+    rule = {'Fill Value': compiled['Fill Value'],
+            'Fields': {qf_key: [compiled['Fields'][qf_key][0],
+                                compiled['Fields'][qf_key][1],
+                                sorted([code, repr(label)] for code, label in compiled['Fields'][qf_key][2].items())]
+                       for qf_key in compiled['Fields'].keys()},
+            'Mask': {qf_key: repr(mask_dict[qf_key]) for qf_key in mask_dict.keys()}}
 
-        unpacked = bin(value)[2:]
+    return hashlib.sha256(json.dumps(rule, sort_keys=True).encode()).hexdigest()[:16]
 
-        while len(unpacked) < 16:
-            unpacked = '0' + unpacked
 
-        reversed = ''
+# Get the 65536-entry boolean lookup table of a mask rule (True for QF values to mask, indexed by value)
+# Kept in memory, and cached in the support directory (or cache_dir) by the rule hash
+def get_mask_lut(qf_dict, mask_dict, cache_dir=None):
 
-        unpacked_list = list(unpacked)
-        while unpacked_list:
-            reversed += unpacked_list.pop()
+    rule_hash = get_mask_rule_hash(qf_dict, mask_dict)
 
-        match = True
+    if rule_hash in mask_luts.keys():
+        return mask_luts[rule_hash]
 
-        for qf_key in qf_dict.keys():
-            if reversed[qf_dict[qf_key][0]] not in qf_dict[qf_key][1].keys():
-                match = False
-                break
-            if qf_key in mask_dict.keys():
-                if isinstance(mask_dict[qf_key], list):
-                    if qf_dict[qf_key][1][reversed[qf_dict[qf_key][0]]] not in mask_dict[qf_key]:
-                        match = False
-                        break
-                elif qf_dict[qf_key][1][reversed[qf_dict[qf_key][0]]] != mask_dict[qf_key]:
-                        match = False
-                        break
+    if cache_dir is None:
+        cache_dir = environ['support_dir']
+    lut_path = Path(cache_dir, f'qf_mask_lut_{rule_hash}.npy')
 
-        if match:
-            mask_list.append(value)
+    lut = None
+    if exists(lut_path):
+        try:
+            lut = np.load(lut_path)
+        except (OSError, ValueError) as e:
+            logging.warning(f'Could not read QF mask lookup table {lut_path}: {e}')
+        if lut is not None and (lut.shape != (65536,) or lut.dtype != bool):
+            logging.warning(f'QF mask lookup table {lut_path} is malformed, rebuilding it.')
+            lut = None
 
-    return mask_list
+    if lut is None:
+        # Every uint16 value
+        lut = match_qf_array(np.arange(65536, dtype='uint16'), qf_dict, mask_dict)
+        # Write it (to a temporary file first, so readers never see a partial table)
+        try:
+            with open(lut_path.with_name(lut_path.name + '.part'), 'wb') as f:
+                np.save(f, lut)
+            replace(lut_path.with_name(lut_path.name + '.part'), lut_path)
+        except OSError as e:
+            logging.warning(f'Could not cache QF mask lookup table {lut_path}: {e}')
+
+    lut.flags.writeable = False
+    mask_luts[rule_hash] = lut
+
+    return lut
+
+
+# Get a boolean mask of a QF array (any shape) with one gather from the mask rule's lookup table
+def get_qf_mask(qf_array, qf_dict, mask_dict):
+
+    return get_mask_lut(qf_dict, mask_dict)[np.asarray(qf_array, dtype='uint16')]
+
+
+def get_mask_hash_table(qf_dict, mask_dict):
+
+    return np.flatnonzero(get_mask_lut(qf_dict, mask_dict)).tolist()
 
 
 def get_uint16_bits():
@@ -148,68 +256,84 @@ def unpack_qf(qf, qf_dict, fill_value=None):
     if qf == fill_value:
         return None
 
-    unpacked = bin(qf)[2:]
-
-    while len(unpacked) < 16:
-        unpacked = '0' + unpacked
-
-    reversed = ''
-
-    unpacked_list = list(unpacked)
-    while unpacked_list:
-        reversed += unpacked_list.pop()
+    compiled = compile_qf_spec(qf_dict)
 
     results_dict = {}
 
-    for qf_key in qf_dict.keys():
-        qf_slice = qf_dict[qf_key][0]
-        # <> 100 is an invalid code in the place it appeared.
-        if reversed[qf_slice] == '100':
+    for qf_key in compiled['Fields'].keys():
+        shift, mask, codes = compiled['Fields'][qf_key]
+        code = (int(qf) >> shift) & mask
+        # Codes not in the spec (e.g. background 100) are invalid in the place they appear
+        if code not in codes.keys():
             continue
-            #print(reversed, qf_key, qf_slice, qf_dict[qf_key])
 
-        qf_value = qf_dict[qf_key][1][reversed[qf_slice]]
-        results_dict[qf_key] = qf_value
+        results_dict[qf_key] = codes[code]
 
     return results_dict
 
 
-def qf_mask_by_list(qf_array, qf_spec_dict, mask_dict, buffer=None, mask_fills=False):
+# Dilate a boolean mask along one axis by a radius (a running window count from a cumulative sum,
+# so the cost does not grow with the radius)
+def dilate_axis(mask, radius, axis):
 
-    fill_value = None
-    if 'Fill Value' in qf_spec_dict:
-        fill_value = qf_spec_dict['Fill Value']
-        qf_spec_dict.pop('Fill Value')
+    length = mask.shape[axis]
 
-    mask_pixels = {}
+    counts = np.cumsum(mask, axis=axis, dtype='int32')
+    counts = np.concatenate([np.zeros_like(np.take(counts, [0], axis=axis)), counts], axis=axis)
 
-    mask_list = get_mask_hash_table(qf_spec_dict, mask_dict)
+    window_ends = np.minimum(np.arange(length) + radius + 1, length)
+    window_starts = np.maximum(np.arange(length) - radius, 0)
 
-    mark_arr = np.zeros(qf_array.shape)
+    return np.take(counts, window_ends, axis=axis) > np.take(counts, window_starts, axis=axis)
 
-    for row_ind, row in enumerate(qf_array):
-        for col_ind, value in enumerate(row):
 
-            if value == fill_value:
-                if mask_fills:
-                    if row_ind not in mask_pixels.keys():
-                        mask_pixels[row_ind] = {}
-                    mask_pixels[row_ind][col_ind] = None
-            else:
-                if value in mask_list:
-                    if row_ind not in mask_pixels.keys():
-                        mask_pixels[row_ind] = {}
-                    mask_pixels[row_ind][col_ind] = None
-                    if buffer:
-                        for buff_row in np.arange(row_ind - buffer, row_ind + buffer):
-                            for buff_col in np.arange(col_ind - buffer, row_ind + buffer):
-                                if 0 <= buff_row < qf_array.shape[0]:
-                                    if 0 <= buff_col < qf_array.shape[1]:
-                                        if buff_row not in mask_pixels.keys():
-                                            mask_pixels[buff_row] = {}
-                                        mask_pixels[buff_row][buff_col] = None
-
-    return mask_pixels
+# Dilate a boolean mask over its last two (row, col) axes by a buffer of pixels
+# (8-connectivity grows a (2 * buffer + 1) square around each pixel, 4-connectivity a diamond)
+# Works on single images and on (time, row, col) stacks
+def dilate_mask(mask, buffer, connectivity=8):
+
+    mask = np.asarray(mask, dtype=bool)
+
+    if not buffer:
+        return mask.copy()
+
+    if connectivity == 8:
+        # A square is separable: dilate the rows, then the cols
+        return dilate_axis(dilate_axis(mask, buffer, -2), buffer, -1)
+
+    if connectivity != 4:
+        logging.error(f'Unknown connectivity {connectivity}. Use 4 or 8.')
+        return None
+
+    # A diamond is a cross dilation repeated buffer times
+    dilated = mask.copy()
+    for _ in range(buffer):
+        grown = dilated.copy()
+        grown[..., 1:, :] |= dilated[..., :-1, :]
+        grown[..., :-1, :] |= dilated[..., 1:, :]
+        grown[..., :, 1:] |= dilated[..., :, :-1]
+        grown[..., :, :-1] |= dilated[..., :, 1:]
+        dilated = grown
+
+    return dilated
+
+
+# Get a boolean mask (the shape of qf_array, a tile or a (time, row, col) stack) of the pixels matching a mask rule,
+# dilated by a buffer of pixels (see dilate_mask), and fills if mask_fills
+def qf_mask_by_list(qf_array, qf_spec_dict, mask_dict, buffer=None, mask_fills=False, connectivity=8):
+
+    qf_array = np.asarray(qf_array, dtype='uint16')
+
+    mask = get_qf_mask(qf_array, qf_spec_dict, mask_dict)
+
+    if buffer:
+        mask = dilate_mask(mask, buffer, connectivity)
+
+    fill_value = qf_spec_dict.get('Fill Value')
+    if mask_fills and fill_value is not None:
+        mask |= qf_array == fill_value
+
+    return mask
 
 
 def compare_dicts(ref_dict, subject_dict, any_match=False):
@@ -245,3 +369,7 @@ def compare_dicts(ref_dict, subject_dict, any_match=False):
                                 matches += 1
 
     return matches
+
+
+# Lookup tables of mask rules by rule hash (see get_mask_lut)
+mask_luts = {}
@@ -1,10 +1,12 @@
 import zarr
+import logging
 import h5py
 import numpy as np
 from concurrent.futures import ProcessPoolExecutor, as_completed
 from itertools import islice
 from dotenv import load_dotenv
 from pathlib import Path
+from datetime import date, datetime, timedelta
 from os import environ, walk
 
 # Load environmental variables
@@ -157,4 +159,117 @@ def specify_datasets(zarr_obj, timeseries_days, pixel_hs, pixel_vs):
     zarr_obj.create_dataset("Pixel V",
                             data=pixel_vs,
                             shape=(1, len(pixel_vs)),
-                            dtype="float64")
\ No newline at end of file
+                            dtype="float64")
+
+# Epoch of the integer time axis (days since)
+def get_time_epoch():
+
+    return date(1970, 1, 1)
+
+
+# Create a store's 'Time' array of integer days since the epoch, with the start date and step in its attrs
+# (so date to index and index to date are arithmetic)
+def write_time_axis(zarr_root, start_date, day_count, step_days=1):
+    # If it is a datetime, use its date
+    if isinstance(start_date, datetime):
+        start_date = start_date.date()
+    # Days since the epoch of the start date
+    start_days = (start_date - get_time_epoch()).days
+    # Create the array (one chunk)
+    time_arr = zarr_root.require_dataset('Time',
+                                         shape=day_count,
+                                         chunks=day_count,
+                                         dtype='int32')
+    # Write the days in one write
+    time_arr[:] = np.arange(start_days, start_days + day_count * step_days, step_days, dtype='int32')
+    # Describe the axis
+    time_arr.attrs.update({'Units': f'days since {get_time_epoch().isoformat()}',
+                           'Start Date': start_date.isoformat(),
+                           'Step Days': step_days})
+    # Return the array
+    return time_arr
+
+
+# Get the start date, step (days) and length of a store's time axis
+# (from the 'Time' attrs, or the first two entries of a legacy 'Date' array of YYYYMMDD strings; None if neither)
+def get_time_axis(zarr_root):
+    # If the store has an integer time axis
+    if 'Time' in zarr_root:
+        # Reference the attrs
+        attrs = zarr_root['Time'].attrs
+        # Return the start date, step and length
+        return date.fromisoformat(attrs['Start Date']), attrs['Step Days'], zarr_root['Time'].shape[0]
+    # If the store has a legacy date array
+    if 'Date' in zarr_root:
+        # Read the first two dates
+        first_dates = [datetime.strptime(datestr, '%Y%m%d').date() for datestr in zarr_root['Date'][:2]]
+        # Step between them (daily if there is only one)
+        step_days = 1
+        if len(first_dates) > 1:
+            step_days = (first_dates[1] - first_dates[0]).days
+        # Return the start date, step and length
+        return first_dates[0], step_days, zarr_root['Date'].shape[0]
+    # Log an error
+    logging.error('The store has no Time or Date array.')
+    # Return None
+    return None
+
+
+# Get the index of a date on a time axis from get_time_axis (None if it is not on the axis)
+def get_date_index(time_axis, date_obj):
+    # If there is no axis
+    if time_axis is None:
+        return None
+    # Break up the axis
+    start_date, step_days, length = time_axis
+    # If it is a datetime, use its date
+    if isinstance(date_obj, datetime):
+        date_obj = date_obj.date()
+    # Days from the start
+    days = (date_obj - start_date).days
+    # Index of the date
+    index, remainder = divmod(days, step_days)
+    # If it is not on the axis
+    if remainder or not 0 <= index < length:
+        return None
+    # Return the index
+    return index
+
+
+# Get the date of an index on a time axis from get_time_axis
+def get_index_date(time_axis, index):
+
+    return time_axis[0] + timedelta(days=int(index) * time_axis[1])
+
+
+# Get a store's dates as a numpy datetime64[D] array (vectorized, from the 'Time' array or a legacy 'Date' array)
+def get_datetime64_dates(zarr_root):
+    # If the store has an integer time axis
+    if 'Time' in zarr_root:
+        # Offset the epoch by the days
+        return np.datetime64(get_time_epoch(), 'D') + zarr_root['Time'][:].astype('timedelta64[D]')
+    # Otherwise, get the axis from the legacy date array
+    time_axis = get_time_axis(zarr_root)
+    # If there is none
+    if time_axis is None:
+        return None
+    # Offset the start date by the steps
+    return (np.datetime64(time_axis[0], 'D')
+            + (np.arange(time_axis[2]) * time_axis[1]).astype('timedelta64[D]'))
+
+
+# Write the valid values of a row or map into one date of a date-first array ((date, col) or (date, row, col))
+# in a single slab write
+# (values outside the mask keep what was there, so fills never overwrite data)
+def write_masked_date(zarr_arr, date_index, values, mask):
+    # If nothing is valid
+    if not mask.any():
+        return
+    # If everything is valid
+    if mask.all():
+        # Write the whole slab (row or (row, col) window) of the date as it is
+        zarr_arr[date_index] = values
+    # Otherwise
+    else:
+        # Merge the valid values with what is stored, then write the slab back in one write
+        zarr_arr[date_index] = np.where(mask, values, zarr_arr[date_index])
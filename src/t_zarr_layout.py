@@ -0,0 +1,136 @@
+import logging
+import numpy as np
+from numcodecs import Blosc
+
+
+# Name of the layout storing each tile variable as one (time, row, col) array
+def get_layout_name():
+
+    return 'time-row-col'
+
+
+# Data type and fill value of each VNP46A variable stored
+def get_fill_values():
+
+    return {'DNB_BRDF-Corrected_NTL': ('uint16', 65535),
+            'QF_Cloud_Mask': ('uint16', 65535),
+            'Mandatory_Quality_Flag': ('uint8', 255),
+            'Sensor_Zenith': ('int16', -32768),
+            'Sensor_Azimuth': ('int16', -32768)}
+
+
+# Chunk profiles (timeseries: a pixel's whole series in one chunk of a small window,
+# maps: one date's whole window per chunk, balanced: a middle ground for mixed reads)
+def get_chunk_profiles():
+
+    return ['timeseries', 'maps', 'balanced']
+
+
+# Get the chunk shape of a (time, row, col) array for a chunk profile (None if the profile is unknown)
+def get_layout_chunks(shape, profile='timeseries'):
+    # Break up the shape
+    time_len, rows, cols = shape
+    # Chunk shape of the profile
+    if profile == 'timeseries':
+        chunks = (time_len, 16, 16)
+    elif profile == 'maps':
+        chunks = (1, rows, cols)
+    elif profile == 'balanced':
+        chunks = (32, 128, 128)
+    # If the profile is unknown
+    else:
+        # Log an error
+        logging.error(f'Unknown chunk profile {profile}. Use one of {get_chunk_profiles()}.')
+        # Return None
+        return None
+    # Return the chunks (no bigger than the array, and at least 1)
+    return tuple(max(1, min(chunk, size)) for chunk, size in zip(chunks, shape))
+
+
+# Get the compressor for the layout (Blosc zstd with bit-shuffle, which suits 16-bit values
+# whose high bits rarely change, like NTL radiances and angles, and sparse 8-bit flags)
+def get_compressor(clevel=5):
+
+    return Blosc(cname='zstd', clevel=clevel, shuffle=Blosc.BITSHUFFLE)
+
+
+# Create (or open) a tile variable's (time, row, col) array
+def require_tile_array(tile_group, var_name, shape, profile='timeseries', clevel=5):
+    # Get the data type and fill value
+    dtype, fill_value = get_fill_values()[var_name]
+    # Get the chunks
+    chunks = get_layout_chunks(shape, profile)
+    # If the profile is unknown
+    if chunks is None:
+        return None
+    # Create (or open) the array
+    zarr_arr = tile_group.require_dataset(var_name,
+                                          overwrite=False,
+                                          shape=shape,
+                                          chunks=chunks,
+                                          dtype=dtype,
+                                          fill_value=fill_value,
+                                          compressor=get_compressor(clevel),
+                                          write_empty_chunks=False)
+    # If it is new, describe the layout
+    if 'Layout' not in zarr_arr.attrs:
+        zarr_arr.attrs.update({'Layout': get_layout_name(),
+                               'Dimensions': ['Time', 'Row', 'Col'],
+                               'Chunk Profile': profile})
+    # Return the array
+    return zarr_arr
+
+
+# Check a tile group stores a variable in the (time, row, col) layout
+def has_tile_array(tile_group, var_name):
+
+    return var_name in tile_group and getattr(tile_group[var_name], 'ndim', None) == 3
+
+
+# Get the legacy per-row array of a variable ('{row}/{variable}', or '{row}' for NTL-only stores; None if missing)
+def get_legacy_row_array(tile_group, var_name, row):
+    # If the row is a group of variables
+    if f'{row}/{var_name}' in tile_group:
+        return tile_group[f'{row}/{var_name}']
+    # If the row is an NTL array
+    if var_name == 'DNB_BRDF-Corrected_NTL' and str(row) in tile_group \
+            and getattr(tile_group[str(row)], 'ndim', None) == 2:
+        return tile_group[str(row)]
+    # Return None
+    return None
+
+
+# Read a pixel's time series of a variable (from the layout, or the legacy per-row arrays)
+def read_pixel_series(tile_group, var_name, row, col):
+    # If the tile uses the layout
+    if has_tile_array(tile_group, var_name):
+        return tile_group[var_name][:, row, col]
+    # Otherwise, read the legacy row array
+    row_arr = get_legacy_row_array(tile_group, var_name, row)
+    # If it is missing
+    if row_arr is None:
+        # Log an error
+        logging.error(f'{var_name} is not stored for row {row} of {tile_group.name}.')
+        # Return None
+        return None
+    # Return the column
+    return row_arr[:, col]
+
+
+# Read a date's map of a variable (from the layout, or by stacking the legacy per-row arrays)
+def read_date_map(tile_group, var_name, date_index):
+    # If the tile uses the layout
+    if has_tile_array(tile_group, var_name):
+        return tile_group[var_name][date_index]
+    # Rows of the legacy arrays (row groups or arrays are named by their index)
+    rows = sorted(int(key) for key in tile_group.keys() if key.isdigit())
+    # Legacy row arrays
+    row_arrs = [get_legacy_row_array(tile_group, var_name, row) for row in rows]
+    # If any are missing
+    if not rows or any(row_arr is None for row_arr in row_arrs):
+        # Log an error
+        logging.error(f'{var_name} is not stored for every row of {tile_group.name}.')
+        # Return None
+        return None
+    # Stack the rows of the date
+    return np.stack([row_arr[date_index] for row_arr in row_arrs])
@@ -0,0 +1,31 @@
+import sys
+import threading
+import pytest
+from os import environ
+from pathlib import Path
+from http.server import ThreadingHTTPServer
+
+# Modules are imported from src, without spinning up the repo's directories
+sys.path.insert(0, str(Path(__file__).parents[1] / 'src'))
+environ.setdefault('SPINUP', 'True')
+environ.setdefault('laads_token', 'test-token')
+
+
+# Start a local HTTP server with a handler class, returning its base URL (stopped after the test)
+@pytest.fixture
+def local_server():
+    # Servers started by the test
+    servers = []
+
+    def start(handler_class):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), handler_class)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f'http://127.0.0.1:{server.server_address[1]}/'
+
+    yield start
+    # Stop the servers
+    for server in servers:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,96 @@
+import hashlib
+import pytest
+import c_retry
+import c_backend
+
+moto = pytest.importorskip('moto')
+boto3 = pytest.importorskip('boto3')
+
+
+# Content of the stored granule (several parts)
+CONTENT = bytes(range(256)) * 20
+FILENAME = 'VNP46A2.A2019152.h11v07.001.2020337102243.h5'
+
+
+# Start a moto S3 stand-in holding the granule, returning an S3 backend reading it with boto3's own credentials
+@pytest.fixture
+def s3_backend(monkeypatch):
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    with moto.mock_aws():
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket='test-lads')
+        client.put_object(Bucket='test-lads', Key=f'VNP46A2/{FILENAME}', Body=CONTENT)
+        yield c_backend.S3Backend(bucket='test-lads',
+                                  region_name='us-east-1',
+                                  credentials_url=None,
+                                  part_size=1000,
+                                  retry_policy=c_retry.RetryPolicy(back_off_base=0.01,
+                                                                   circuit_breaker=c_retry.CircuitBreaker()))
+
+
+def test_s3_download_in_parts_reuses_client(s3_backend, tmp_path, monkeypatch):
+    # Count the clients made
+    clients = []
+    make_client = boto3.client
+    monkeypatch.setattr(boto3, 'client', lambda *args, **kwargs: clients.append(1) or make_client(*args, **kwargs))
+    url = f'https://example.com/5000/VNP46A2/2019/152/{FILENAME}'
+
+    for download_dir in [tmp_path / 'one', tmp_path / 'two']:
+        download_dir.mkdir()
+        status_codes = []
+        assert s3_backend.download((url, hashlib.md5(CONTENT).hexdigest()), download_dir,
+                                   status_hook=status_codes.append) == (url, download_dir / FILENAME)
+        assert (download_dir / FILENAME).read_bytes() == CONTENT
+        assert status_codes == [200]
+
+    assert len(clients) == 1
+
+
+def test_s3_download_fails_for_missing_key_and_bad_hash(s3_backend, tmp_path):
+    missing_url = f'https://example.com/{FILENAME.replace("h11v07", "h12v07")}'
+    url = f'https://example.com/{FILENAME}'
+
+    assert s3_backend.download(missing_url, tmp_path) == (missing_url, None)
+    assert s3_backend.download((url, '0' * 32), tmp_path) == (url, None)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_credentials_are_none_without_a_token(tmp_path, monkeypatch):
+    monkeypatch.delenv('earthdata_token', raising=False)
+    backend = c_backend.S3Backend(credentials_url='https://example.com/s3credentials')
+
+    assert backend.get_credentials() is None
+    assert backend.get_client() is None
+    assert backend.download(f'https://example.com/{FILENAME}', tmp_path) == (f'https://example.com/{FILENAME}', None)
+
+
+# Backend that raises, or writes the granule, counting its downloads
+class StubBackend:
+
+    def __init__(self, name, fail):
+
+        self.name = name
+        self.fail = fail
+        self.downloads = 0
+
+    def download(self, work, download_dir, status_hook=None):
+
+        self.downloads += 1
+        if self.fail:
+            raise RuntimeError('no backend here')
+        (download_dir / FILENAME).write_bytes(CONTENT)
+        return (work, download_dir / FILENAME)
+
+
+def test_fastest_backend_moves_past_a_raising_backend(tmp_path):
+    broken, working = StubBackend('broken', fail=True), StubBackend('working', fail=False)
+    backend = c_backend.FastestBackend([broken, working])
+
+    for i in range(2):
+        assert backend.download(FILENAME, tmp_path) == (FILENAME, tmp_path / FILENAME)
+
+    # The raising backend was scored as a failure, so the working one is tried first afterwards
+    assert backend.throughput['broken'] == 0
+    assert backend.throughput['working'] > 0
+    assert (broken.downloads, working.downloads) == (1, 2)
@@ -0,0 +1,13 @@
+import t_catalog
+
+
+def test_catalog_keeps_long_names_whole():
+    long_name = 'CLDMSK_L2_VIIRS_SNPP.A2019152.0600.001.2019152130652.nc'
+    padded_name = 'VNP46A2.A2019152.h11v07.001.2020337102243' + '.x' * 30 + '.h5'
+    file_dict = {long_name: 'a' * 32, padded_name: {'md5sum': 'b' * 32, 'size': 10}}
+
+    catalog = t_catalog.make_catalog_array(file_dict)
+
+    assert set(t_catalog.get_filenames(catalog)) == {long_name, padded_name}
+    assert sorted(catalog['product'].tolist()) == [b'CLDMSK_L2_VIIRS_SNPP', b'VNP46A2']
+    assert t_catalog.get_catalog_records(catalog)[padded_name] == {'md5sum': 'b' * 32, 'size': 10}
@@ -0,0 +1,112 @@
+import json
+import datetime
+import c_crawler
+import c_laads
+from time import monotonic
+from http.server import BaseHTTPRequestHandler
+
+
+# Product tree of the local server (year -> DOY -> tiles)
+TREE = {'2019': {'152': ['h11v07', 'h12v07'], '153': ['h11v07', 'h12v07'], '200': ['h11v07']},
+        '2020': {'001': ['h11v07', 'h12v07']}}
+
+
+# Get a file name of the tree
+def get_filename(year, doy, tile):
+
+    return f'VNP46A2.A{year}{doy}.{tile}.001.2020337102243.h5'
+
+
+# Handler serving LAADS style .json listings of the tree (recording the time of each request)
+class ListingHandler(BaseHTTPRequestHandler):
+
+    request_times = []
+    # Listing paths answered with a 404
+    broken_paths = set()
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        ListingHandler.request_times.append(monotonic())
+        base = f"http://{self.headers['Host']}/5000/VNP46A2"
+        parts = self.path.strip('/').removesuffix('.json').split('/')[2:]
+        # Product, year or DOY listing
+        if self.path in ListingHandler.broken_paths:
+            content = None
+        elif not parts:
+            content = [{'name': year, 'downloadsLink': f'{base}/{year}'} for year in TREE]
+        elif len(parts) == 1 and parts[0] in TREE:
+            content = [{'name': doy, 'downloadsLink': f'{base}/{parts[0]}/{doy}'} for doy in TREE[parts[0]]]
+        elif len(parts) == 2 and parts[1] in TREE.get(parts[0], {}):
+            content = [{'name': get_filename(*parts, tile), 'md5sum': '0' * 32, 'size': 100,
+                        'downloadsLink': f'{base}/{parts[0]}/{parts[1]}/{get_filename(*parts, tile)}'}
+                       for tile in TREE[parts[0]][parts[1]]]
+        else:
+            content = None
+        # If there is no listing
+        if content is None:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = json.dumps({'content': content}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def test_crawl_finds_files_in_date_range(local_server):
+    base_url = local_server(ListingHandler)
+    crawler = c_crawler.LAADSCrawler(f'{base_url}5000/VNP46A2',
+                                     start_date=datetime.date(2019, 6, 2),
+                                     end_date=datetime.date(2019, 12, 31),
+                                     include='h11v07',
+                                     max_concurrency=4)
+
+    files = crawler.crawl()
+
+    assert set(files) == {get_filename('2019', doy, 'h11v07') for doy in ['153', '200']}
+    assert crawler.failed_urls == []
+    assert crawler.listing_counts == {'product': 1, 'year': 1, 'doy': 2}
+
+
+def test_crawl_respects_host_rate_limit(local_server):
+    base_url = local_server(ListingHandler)
+    ListingHandler.request_times = []
+    rate_limit = 10
+    crawler = c_crawler.LAADSCrawler(f'{base_url}5000/VNP46A2',
+                                     max_concurrency=8,
+                                     rate_limit=rate_limit)
+
+    files = crawler.crawl()
+
+    assert set(files) == {get_filename(year, doy, tile)
+                          for year in TREE for doy in TREE[year] for tile in TREE[year][doy]}
+    # Product, years and DOYs, no closer together than the limit allows (less scheduling slack)
+    request_times = sorted(ListingHandler.request_times)
+    assert len(request_times) == 1 + len(TREE) + sum(len(doys) for doys in TREE.values())
+    gaps = [later - earlier for earlier, later in zip(request_times, request_times[1:])]
+    assert min(gaps) > 1 / rate_limit - 0.02
+
+
+def test_catalog_with_failed_listings_is_not_saved_unless_partial(local_server, tmp_path, monkeypatch):
+    base_url = local_server(ListingHandler)
+    monkeypatch.setenv('support_dir', str(tmp_path))
+    monkeypatch.setenv('laads_alldata_url', base_url)
+    monkeypatch.setattr(ListingHandler, 'broken_paths', {'/5000/VNP46A2/2019/153.json'})
+
+    # The catalog made on spinup is missing a day, so it is not saved
+    dataset = c_laads.LAADSDataSet('test', archive_set='5000', product='VNP46A2')
+    assert dataset.catalog is None
+    assert dataset.find_catalog_file() is None
+
+    # Unless a partial catalog is allowed, which is marked with the failed URLs
+    failed_urls = dataset.get_catalog(allow_partial=True)
+    assert failed_urls == [f'{base_url}5000/VNP46A2/2019/153']
+    assert dataset.find_catalog_file() is not None
+    partial_paths = list(tmp_path.glob('test_partial_*.json'))
+    assert len(partial_paths) == 1
+    assert json.loads(partial_paths[0].read_text()) == {'Failed URLs': failed_urls}
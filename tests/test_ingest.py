@@ -0,0 +1,85 @@
+import datetime
+import h5py
+import zarr
+import numpy as np
+import pytest
+import c_roi
+import c_ingest
+import t_vnp46a
+import t_zarr_layout
+
+
+# Region of interest (a triangle, so some of the window is masked out) and the dates of the granules (with gaps)
+ROI = c_roi.ROI('test', polygon=[(-59.5, 17.5), (-57.5, 17.5), (-57.5, 19.0)])
+DATES = [datetime.date(2019, 6, 1) + datetime.timedelta(days=days) for days in [0, 1, 3, 4, 6]]
+VAR_NAMES = ['DNB_BRDF-Corrected_NTL', 'Mandatory_Quality_Flag']
+
+
+# Write synthetic VNP46A2 granules of tile h12v07 (only the rows and columns the ROI window reaches),
+# returning the granules for c_ingest.ZarrIngest and the arrays written by variable and date
+def make_granules(dir_path):
+
+    rng = np.random.default_rng(0)
+    granules = []
+    arrays = {var_name: {} for var_name in VAR_NAMES}
+    for date_obj in DATES:
+        name = f'VNP46A2.A{date_obj:%Y%j}.h12v07.001.2020337102243.h5'
+        ntl = rng.integers(0, 1000, (600, 600), dtype='u2')
+        # Some fills, which are not written for any variable
+        ntl[rng.random((600, 600)) < 0.2] = 65535
+        arrays['DNB_BRDF-Corrected_NTL'][date_obj] = ntl
+        arrays['Mandatory_Quality_Flag'][date_obj] = rng.integers(0, 4, (600, 600), dtype='u1')
+        with h5py.File(dir_path / name, 'w') as h5file:
+            group = h5file.create_group(t_vnp46a.get_data_fields_path())
+            for var_name in VAR_NAMES:
+                group.create_dataset(var_name, data=arrays[var_name][date_obj])
+        granules.append({'Name': name,
+                         'Date': date_obj,
+                         'Tile': 'h12v07',
+                         'Variables': {var_name: (dir_path / name, f'{t_vnp46a.get_data_fields_path()}/{var_name}')
+                                       for var_name in VAR_NAMES}})
+
+    # A granule whose file is missing, and one of a tile outside the ROI
+    missing = dict(granules[1], Name='missing.h5', Date=DATES[2] - datetime.timedelta(days=1))
+    missing['Variables'] = {var_name: (dir_path / 'missing.h5', path)
+                            for var_name, (file_path, path) in granules[1]['Variables'].items()}
+    outside = dict(granules[0], Name='outside.h5', Tile='h11v07')
+
+    return granules + [missing, outside], arrays
+
+
+# Get the arrays the ingest should write (values of valid pixels in the ROI, fills elsewhere and on empty dates)
+def get_expected(arrays):
+
+    row_min, row_max, col_min, col_max = ROI.get_window('h12v07')
+    mask = ROI.get_mask('h12v07')
+    expected = {}
+    for var_name in VAR_NAMES:
+        fill_value = t_zarr_layout.get_fill_values()[var_name][1]
+        expected[var_name] = np.full(((DATES[-1] - DATES[0]).days + 1, row_max - row_min, col_max - col_min),
+                                     fill_value,
+                                     dtype=t_zarr_layout.get_fill_values()[var_name][0])
+        for date_obj in DATES:
+            valid = (arrays['DNB_BRDF-Corrected_NTL'][date_obj][row_min:row_max, col_min:col_max] != 65535) & mask
+            window = arrays[var_name][date_obj][row_min:row_max, col_min:col_max]
+            expected[var_name][(date_obj - DATES[0]).days][valid] = window[valid]
+
+    return expected
+
+
+@pytest.mark.parametrize('profile', t_zarr_layout.get_chunk_profiles())
+def test_worker_count_does_not_change_the_store(tmp_path, profile):
+    granules, arrays = make_granules(tmp_path)
+    expected = get_expected(arrays)
+
+    # (with 8 workers the balanced profile's bands are also split by column chunks)
+    for max_workers in [1, 8]:
+        store_path = tmp_path / f'{profile}_{max_workers}_zarr'
+        failures = c_ingest.ZarrIngest(store_path, granules, roi=ROI, profile=profile,
+                                       max_workers=max_workers).ingest()
+
+        assert sorted(failures.keys()) == ['missing.h5', 'outside.h5']
+        assert failures['missing.h5'].startswith('FileNotFoundError')
+        tile_group = zarr.open_group(str(store_path), mode='r')['h12v07']
+        for var_name in VAR_NAMES:
+            assert np.array_equal(tile_group[var_name][:], expected[var_name])
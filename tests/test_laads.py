@@ -0,0 +1,35 @@
+import c_laads
+import t_catalog
+
+
+# Filenames of a small catalog
+FILENAMES = ['VNP46A2.A2019152.h11v07.001.2020337102243.h5',
+             'VNP46A2.A2019152.h12v07.001.2020337102243.h5',
+             'VNP46A2.A2019153.h11v07.001.2020337102243.h5']
+
+
+def test_cached_lists_are_copies(tmp_path, monkeypatch):
+    monkeypatch.setenv('support_dir', str(tmp_path))
+    catalog = t_catalog.make_catalog_array({filename: '0' * 32 for filename in FILENAMES})
+    t_catalog.save_catalog_array(catalog, tmp_path / 'test_catalog_06012019_000000.npy')
+    dataset = c_laads.LAADSDataSet('test', archive_set='5000', product='VNP46A2')
+
+    dataset.get_tile_list().append('h99v99')
+    dataset.get_ordered_dates_list().clear()
+
+    assert dataset.get_tile_list() == ['h11v07', 'h12v07']
+    assert len(dataset.get_ordered_dates_list()) == 2
+
+
+def test_no_catalog_is_reported(tmp_path, monkeypatch, caplog, capsys):
+    monkeypatch.setenv('support_dir', str(tmp_path))
+    monkeypatch.setenv('inputs_dir', str(tmp_path))
+    # Without a spec or a product there is no catalog
+    dataset = c_laads.LAADSDataSet('test')
+
+    assert dataset.download_catalog() is None
+    assert dataset.print_download_report() is None
+
+    assert capsys.readouterr().out == ''
+    assert caplog.text.count('No catalog has been loaded for LAADSDataSet test.') == 2
+    assert not (tmp_path / 'test').exists()
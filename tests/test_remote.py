@@ -0,0 +1,129 @@
+import io
+import re
+import h5py
+import numpy as np
+import requests
+import c_retry
+import c_remote
+import t_laads
+import t_vnp46a
+from time import monotonic
+from test_resume import make_handler
+
+
+# Datasets of the served granule (chunked, so a window only needs some of the file)
+NTL = np.arange(600 * 600, dtype='u2').reshape((600, 600))
+QF = (NTL % 7).astype('u1')
+
+
+# Make the bytes of a small granule holding the datasets
+def make_granule_bytes():
+
+    buffer = io.BytesIO()
+    with h5py.File(buffer, 'w') as h5file:
+        group = h5file.create_group(t_vnp46a.get_data_fields_path())
+        group.create_dataset('DNB_BRDF-Corrected_NTL', data=NTL, chunks=(100, 100))
+        group.create_dataset('Mandatory_Quality_Flag', data=QF, chunks=(100, 100))
+
+    return buffer.getvalue()
+
+
+# Make a retry policy with its own circuit breaker (optionally tripped open for a host)
+def make_policy(host=None, reset_timeout=60):
+
+    circuit_breaker = c_retry.CircuitBreaker(failure_threshold=1, reset_timeout=reset_timeout)
+    if host:
+        circuit_breaker.record_failure(host)
+
+    return c_retry.RetryPolicy(back_off_base=0.01, circuit_breaker=circuit_breaker)
+
+
+# Get the (start, end) byte ranges asked of a handler
+def get_ranges(handler):
+
+    return [tuple(int(i) for i in re.match(r'bytes=(\d+)-(\d+)', range_header).groups())
+            for range_header in handler.range_headers]
+
+
+def test_subset_is_read_in_whole_blocks(local_server):
+    content = make_granule_bytes()
+    handler = make_handler(content=content)
+    base_url = local_server(handler)
+
+    file_url, subset = t_laads.get_laads_subset(base_url + 'granule.h5',
+                                                ['DNB_BRDF-Corrected_NTL', 'Mandatory_Quality_Flag'],
+                                                t_vnp46a.get_data_fields_path(),
+                                                rows=(120, 260),
+                                                cols=(310, 380),
+                                                session=requests.session(),
+                                                block_size=4096)
+
+    assert file_url == base_url + 'granule.h5'
+    assert np.array_equal(subset['DNB_BRDF-Corrected_NTL'], NTL[120:260, 310:380])
+    assert np.array_equal(subset['Mandatory_Quality_Flag'], QF[120:260, 310:380])
+    # Every request covered whole blocks, none twice, and not the whole file
+    ranges = get_ranges(handler)
+    assert all(start % 4096 == 0 and (end + 1) % 4096 == 0 or end == len(content) - 1 for start, end in ranges)
+    blocks = [block for start, end in ranges for block in range(start // 4096, end // 4096 + 1)]
+    assert len(blocks) == len(set(blocks))
+    assert len(blocks) * 4096 < len(content) / 2
+
+
+def test_server_ignoring_ranges_is_read_whole(local_server):
+    handler = make_handler(content=make_granule_bytes(), ranges=False)
+    base_url = local_server(handler)
+    group_path = t_vnp46a.get_data_fields_path()
+
+    file_url, subset = t_laads.get_laads_subset(base_url + 'granule.h5', 'Mandatory_Quality_Flag', group_path,
+                                                rows=(0, 10), session=requests.session())
+    assert np.array_equal(subset['Mandatory_Quality_Flag'], QF[:10])
+    # The whole file came with the first request
+    assert len(handler.range_headers) == 1
+
+    # A dataset that is not in the file fails cleanly
+    assert t_laads.get_laads_subset(base_url + 'granule.h5', 'Missing', group_path,
+                                    session=requests.session()) == (base_url + 'granule.h5', None)
+
+
+def test_block_cache_drops_least_recently_used(local_server):
+    content = bytes(range(256)) * 64
+    handler = make_handler(content=content)
+    base_url = local_server(handler)
+    remote_file = c_remote.RemoteFile(base_url + 'a.bin', requests.session(), block_size=1024, max_blocks=2,
+                                      retry_policy=make_policy())
+    assert remote_file.size == len(content)
+
+    # Read block 1 (block 0 came with the spinup), then block 0 again
+    for offset in [1024, 0]:
+        remote_file.seek(offset)
+        assert remote_file.read(1024) == content[offset:offset + 1024]
+    assert remote_file.requests_made == 2
+
+    # Reading block 2 drops block 1 (least recently used), not block 0
+    remote_file.seek(2048)
+    assert remote_file.read(100) == content[2048:2148]
+    assert list(remote_file.blocks.keys()) == [0, 2]
+    remote_file.seek(0)
+    remote_file.read(10)
+    assert remote_file.requests_made == 3
+    remote_file.seek(1500)
+    assert remote_file.read(10) == content[1500:1510]
+    assert remote_file.requests_made == 4
+
+    # A read across missing blocks is one request
+    remote_file.seek(5000)
+    assert remote_file.read(3000) == content[5000:8000]
+    assert remote_file.requests_made == 5
+    assert get_ranges(handler)[-1] == (4096, 8191)
+
+
+def test_open_circuit_is_waited_out(local_server):
+    content = bytes(range(256)) * 16
+    base_url = local_server(make_handler(content=content))
+    stime = monotonic()
+
+    remote_file = c_remote.RemoteFile(base_url + 'a.bin', requests.session(), block_size=1024,
+                                      retry_policy=make_policy(base_url.split('/')[2], reset_timeout=0.3))
+
+    assert monotonic() - stime >= 0.3
+    assert remote_file.read() == content
@@ -0,0 +1,152 @@
+import re
+import json
+import hashlib
+import requests
+import c_retry
+import t_requests
+from http.server import BaseHTTPRequestHandler
+
+
+# Content of the served file
+CONTENT = bytes(range(256)) * 400
+
+
+# Make a handler serving content with Range support (drops: connections to drop mid-body; ranges: honour Range)
+def make_handler(drops=0, ranges=True, content=CONTENT):
+
+    class RangeHandler(BaseHTTPRequestHandler):
+
+        protocol_version = 'HTTP/1.1'
+        # Range header of each request (None for no range)
+        range_headers = []
+        drops_left = drops
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            range_header = self.headers.get('Range')
+            RangeHandler.range_headers.append(range_header)
+            start = 0
+            end = len(content) - 1
+            # If a range was asked for, and ranges are served
+            if range_header and ranges:
+                match = re.match(r'bytes=(\d+)-(\d*)', range_header)
+                start = int(match.group(1))
+                # If the range starts past the end
+                if start >= len(content):
+                    self.send_response(416)
+                    self.send_header('Content-Range', f'bytes */{len(content)}')
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                # If the range has an end
+                if match.group(2):
+                    end = min(int(match.group(2)), end)
+                self.send_response(206)
+                self.send_header('Content-Range', f'bytes {start}-{end}/{len(content)}')
+            else:
+                self.send_response(200)
+            body = content[start:end + 1]
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('Accept-Ranges', 'bytes')
+            self.end_headers()
+            # If this connection is to be dropped
+            if RangeHandler.drops_left > 0:
+                RangeHandler.drops_left -= 1
+                # Send a third of the body, then hang up
+                self.wfile.write(body[:len(body) // 3])
+                self.wfile.flush()
+                self.close_connection = True
+                return
+            self.wfile.write(body)
+
+    return RangeHandler
+
+
+# Download from the server with a quick retry policy and a private circuit breaker
+def download(url, write_path):
+
+    retry_policy = c_retry.RetryPolicy(back_off_base=0.01, circuit_breaker=c_retry.CircuitBreaker())
+
+    return t_requests.download_nicely(requests.session(), url, write_path,
+                                      session_func=requests.session,
+                                      hash_to_check=hashlib.md5(CONTENT).hexdigest(),
+                                      retry_policy=retry_policy,
+                                      chunk_size=4096,
+                                      max_attempts=5)
+
+
+def test_resume_after_disconnects(local_server, tmp_path):
+    handler = make_handler(drops=2)
+    url = local_server(handler) + 'file.h5'
+
+    write_path = download(url, tmp_path / 'file.h5')
+
+    assert write_path == tmp_path / 'file.h5'
+    assert write_path.read_bytes() == CONTENT
+    assert not t_requests.get_part_path(write_path).exists()
+    assert not t_requests.get_part_record_path(t_requests.get_part_path(write_path)).exists()
+    # The first request has no range, the retries resume from what was on disk
+    assert handler.range_headers[0] is None
+    assert all(re.fullmatch(r'bytes=[1-9]\d*-', header) for header in handler.range_headers[1:])
+    assert len(handler.range_headers) == 3
+
+
+def test_restart_when_range_is_ignored(local_server, tmp_path):
+    handler = make_handler(drops=1, ranges=False)
+    url = local_server(handler) + 'file.h5'
+
+    write_path = download(url, tmp_path / 'file.h5')
+
+    # The resume got the whole file (200), which was written from the start
+    assert write_path.read_bytes() == CONTENT
+    assert handler.range_headers[1] is not None
+
+
+def test_complete_part_is_finished_on_416(local_server, tmp_path):
+    handler = make_handler()
+    url = local_server(handler) + 'file.h5'
+    write_path = tmp_path / 'file.h5'
+    part_path = t_requests.get_part_path(write_path)
+    # A whole file left as a partial download
+    part_path.write_bytes(CONTENT)
+    t_requests.write_part_record(part_path, url, hashlib.md5(CONTENT).hexdigest())
+
+    assert download(url, write_path) == write_path
+
+    assert write_path.read_bytes() == CONTENT
+    assert handler.range_headers == [f'bytes={len(CONTENT)}-']
+
+
+def test_stale_part_is_discarded(local_server, tmp_path):
+    handler = make_handler()
+    url = local_server(handler) + 'file.h5'
+    write_path = tmp_path / 'file.h5'
+    part_path = t_requests.get_part_path(write_path)
+    # A partial download of another URL
+    part_path.write_bytes(b'x' * 1000)
+    t_requests.get_part_record_path(part_path).write_text(json.dumps({'URL': url + '.old', 'Hash': None,
+                                                                       'Offset': 1000}))
+
+    assert download(url, write_path) == write_path
+
+    assert write_path.read_bytes() == CONTENT
+    assert handler.range_headers == [None]
+
+
+def test_truncated_part_is_discarded(local_server, tmp_path):
+    handler = make_handler()
+    url = local_server(handler) + 'file.h5'
+    write_path = tmp_path / 'file.h5'
+    part_path = t_requests.get_part_path(write_path)
+    # A partial download shorter than its record says
+    part_path.write_bytes(CONTENT[:1000])
+    t_requests.get_part_record_path(part_path).write_text(json.dumps({'URL': url,
+                                                                       'Hash': hashlib.md5(CONTENT).hexdigest(),
+                                                                       'Offset': 5000}))
+
+    assert download(url, write_path) == write_path
+
+    assert write_path.read_bytes() == CONTENT
+    assert handler.range_headers == [None]
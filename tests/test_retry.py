@@ -0,0 +1,155 @@
+import pytest
+import requests
+import c_retry
+import t_requests
+from time import monotonic
+from http.server import BaseHTTPRequestHandler
+
+
+# Handler answering every request with a small JSON (counting the requests)
+class JSONHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    request_count = 0
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        JSONHandler.request_count += 1
+        body = b'{"content": []}'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+# Handler answering /{codes}/{name} with each comma-separated status code in turn, then 200 with a small JSON
+# (a throttling code comes with a Retry-After header if one is set, and the paths requested are recorded)
+class ScriptedHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    paths = []
+    retry_after = None
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        codes = self.path.split('/')[1].split(',')
+        seen = ScriptedHandler.paths.count(self.path)
+        status_code = int(codes[seen]) if seen < len(codes) else 200
+        ScriptedHandler.paths.append(self.path)
+        body = b'{"content": []}' if status_code == 200 else b''
+        self.send_response(status_code)
+        if status_code in (429, 503) and ScriptedHandler.retry_after:
+            self.send_header('Retry-After', ScriptedHandler.retry_after)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+# Start the scripted server, returning its URL and the waits between attempts (sleep is not really called)
+@pytest.fixture
+def scripted_url(local_server, monkeypatch):
+    ScriptedHandler.paths = []
+    ScriptedHandler.retry_after = None
+    waits = []
+    monkeypatch.setattr(t_requests, 'sleep', waits.append)
+    return local_server(ScriptedHandler), waits
+
+
+# Make a retry policy with its own circuit breaker (so failures do not trip the shared one)
+def make_policy():
+
+    return c_retry.RetryPolicy(back_off_base=0.01, circuit_breaker=c_retry.CircuitBreaker())
+
+
+# Make a retry policy whose (private) circuit for a host is open
+def make_open_policy(host, reset_timeout):
+
+    circuit_breaker = c_retry.CircuitBreaker(failure_threshold=1, reset_timeout=reset_timeout)
+    circuit_breaker.record_failure(host)
+
+    return c_retry.RetryPolicy(back_off_base=0.01, circuit_breaker=circuit_breaker)
+
+
+def test_open_circuit_is_waited_out_then_probed(local_server, tmp_path):
+    base_url = local_server(JSONHandler)
+    host = base_url.split('/')[2]
+    retry_policy = make_open_policy(host, reset_timeout=0.3)
+    stime = monotonic()
+
+    r = t_requests.ask_nicely(requests.session(), base_url + 'a.json', retry_policy=retry_policy,
+                              validation_func=t_requests.validate_request_json)
+
+    assert r == {'content': []}
+    assert monotonic() - stime >= 0.3
+    # The probe closed the circuit, so downloads go straight through
+    assert retry_policy.allow_request(host)
+    assert t_requests.download_nicely(requests.session(), base_url + 'a.json', tmp_path / 'a.json',
+                                      retry_policy=retry_policy) == tmp_path / 'a.json'
+
+
+def test_open_circuit_fails_once_attempts_are_used(local_server, tmp_path, monkeypatch):
+    base_url = local_server(JSONHandler)
+    retry_policy = make_open_policy(base_url.split('/')[2], reset_timeout=60)
+    JSONHandler.request_count = 0
+    waits = []
+    monkeypatch.setattr(t_requests, 'sleep', waits.append)
+
+    assert t_requests.ask_nicely(requests.session(), base_url + 'a.json', retry_policy=retry_policy,
+                                 max_attempts=3) is None
+    assert t_requests.download_nicely(requests.session(), base_url + 'a.json', tmp_path / 'a.json',
+                                      retry_policy=retry_policy, max_attempts=3) is None
+
+    # Each attempt waited for the circuit, and the host was never asked
+    assert sum(wait > 50 for wait in waits) == 6
+    assert JSONHandler.request_count == 0
+
+
+def test_not_found_fails_at_once(scripted_url, tmp_path):
+    base_url, waits = scripted_url
+
+    assert t_requests.ask_nicely(requests.session(), base_url + '404/a.json', session_func=requests.session,
+                                 retry_policy=make_policy()) is None
+    assert t_requests.download_nicely(requests.session(), base_url + '404/b.json', tmp_path / 'b.json',
+                                      session_func=requests.session, retry_policy=make_policy()) is None
+
+    assert ScriptedHandler.paths == ['/404/a.json', '/404/b.json']
+    assert waits == []
+    assert not (tmp_path / 'b.json').exists()
+
+
+def test_server_errors_and_throttling_back_off_and_retry(scripted_url, tmp_path):
+    base_url, waits = scripted_url
+
+    assert t_requests.ask_nicely(requests.session(), base_url + '503,500,429/a.json', session_func=requests.session,
+                                 retry_policy=make_policy(),
+                                 validation_func=t_requests.validate_request_json) == {'content': []}
+    # Each retry waited (backing off)
+    assert ScriptedHandler.paths == ['/503,500,429/a.json'] * 4
+    assert len(waits) == 3 and all(wait > 0 for wait in waits)
+
+    assert t_requests.download_nicely(requests.session(), base_url + '502,429/b.json', tmp_path / 'b.json',
+                                      session_func=requests.session,
+                                      retry_policy=make_policy()) == tmp_path / 'b.json'
+    assert ScriptedHandler.paths.count('/502,429/b.json') == 3
+    assert len(waits) == 5
+    assert (tmp_path / 'b.json').read_bytes() == b'{"content": []}'
+
+
+def test_retry_after_is_honoured(scripted_url, tmp_path):
+    base_url, waits = scripted_url
+    ScriptedHandler.retry_after = '7'
+
+    assert t_requests.ask_nicely(requests.session(), base_url + '429/a.json', session_func=requests.session,
+                                 retry_policy=make_policy(),
+                                 validation_func=t_requests.validate_request_json) == {'content': []}
+    assert t_requests.download_nicely(requests.session(), base_url + '503/b.json', tmp_path / 'b.json',
+                                      session_func=requests.session,
+                                      retry_policy=make_policy()) == tmp_path / 'b.json'
+
+    # Both waited the server's 7 seconds (plus a little jitter) instead of the short back-off
+    assert len(waits) == 2
+    assert all(7 <= wait <= 7.01 for wait in waits)
@@ -0,0 +1,112 @@
+import numpy as np
+import c_roi
+import t_vnp46a
+
+
+# Get the lon/lat of the centre of a tile pixel
+def get_pixel_centre(tilename, row, col):
+
+    ppd = t_vnp46a.get_pixels_per_degree()
+    tile_h, tile_v = int(tilename[1:3]), int(tilename[4:6])
+
+    return (-180 + (tile_h * t_vnp46a.get_tile_pixels() + col + 0.5) / ppd,
+            90 - (tile_v * t_vnp46a.get_tile_pixels() + row + 0.5) / ppd)
+
+
+def test_puerto_rico_window():
+    roi = c_roi.get_puerto_rico_roi()
+
+    assert roi.get_tilenames() == ['h11v07']
+    assert roi.get_window('h11v07') == (300, 520, 480, 1160)
+    assert roi.get_shape() == roi.get_window_shape('h11v07') == (220, 680)
+    assert roi.get_mask('h11v07').all()
+    assert roi.get_window('h12v07') is None
+    # It survives a trip through store attributes
+    assert c_roi.get_roi_from_attrs(roi.get_attrs()).get_window('h11v07') == (300, 520, 480, 1160)
+
+
+def test_polygon_mask_holds_pixel_centres_inside():
+    # A triangle (its hypotenuse runs through no pixel centre)
+    vertices = [(-59.5, 17.5), (-57.5, 17.5), (-57.5, 19.0 + 0.1 / 240)]
+    roi = c_roi.ROI('triangle', polygon=vertices)
+
+    assert roi.get_tilenames() == ['h12v07']
+    window = roi.get_window('h12v07')
+    mask = roi.get_mask('h12v07')
+    assert mask.shape == roi.get_window_shape('h12v07')
+    # Each pixel is inside if its centre is north of the base, west of the east edge and south of the hypotenuse
+    lons, lats = get_pixel_centre('h12v07', np.arange(window[0], window[1])[:, np.newaxis],
+                                  np.arange(window[2], window[3])[np.newaxis, :])
+    slope = (vertices[2][1] - vertices[0][1]) / (vertices[2][0] - vertices[0][0])
+    inside = (lats > 17.5) & (lons < -57.5) & (lats < 17.5 + (lons + 59.5) * slope)
+    assert np.array_equal(mask, inside)
+    assert 0 < mask.sum() < mask.size
+
+    # A rectangle masks nothing out of its bounding box's window
+    rectangle = c_roi.ROI('rectangle', polygon=[(-59.5, 17.5), (-57.5, 17.5), (-57.5, 19.0), (-59.5, 19.0)])
+    assert rectangle.get_window('h12v07') == c_roi.ROI('box', bbox=(-59.5, 17.5, -57.5, 19.0)).get_window('h12v07')
+    assert rectangle.get_mask('h12v07').all()
+
+
+def test_box_across_tile_corners_has_a_window_in_each_tile():
+    # One degree either side of the corner of h11v06, h12v06, h11v07 and h12v07 (60W, 20N)
+    roi = c_roi.ROI('corner', bbox=(-61, 19, -59, 21))
+
+    assert roi.get_tilenames() == ['h11v06', 'h11v07', 'h12v06', 'h12v07']
+    assert roi.get_window('h11v06') == (2160, 2400, 2160, 2400)
+    assert roi.get_window('h12v06') == (2160, 2400, 0, 240)
+    assert roi.get_window('h11v07') == (0, 240, 2160, 2400)
+    assert roi.get_window('h12v07') == (0, 240, 0, 240)
+    assert roi.get_shape() == (480, 480)
+    assert [roi.get_tile_offset(tilename) for tilename in roi.get_tilenames()] == [(0, 0), (240, 0), (0, 240),
+                                                                                 (240, 240)]
+    # A box only touching a tile edge does not take the tile
+    assert c_roi.ROI('edge', bbox=(-61, 19, -60, 20)).get_tilenames() == ['h11v07']
+
+
+def test_stitch_puts_each_tile_window_in_place():
+    roi = c_roi.ROI('corner', bbox=(-61, 19, -59, 21))
+    # (time, row, col) windows of three of the four tiles, each holding its own value
+    arrays = {tilename: np.full((2, 240, 240), value, dtype='u2')
+              for value, tilename in enumerate(['h11v06', 'h12v06', 'h11v07'], start=1)}
+
+    stitched = roi.stitch(arrays, 65535)
+
+    assert stitched.shape == (2, 480, 480)
+    assert stitched.dtype == np.dtype('u2')
+    assert (stitched[:, :240, :240] == 1).all()
+    assert (stitched[:, :240, 240:] == 2).all()
+    assert (stitched[:, 240:, :240] == 3).all()
+    # The tile not given is left as fill
+    assert (stitched[:, 240:, 240:] == 65535).all()
+
+
+def test_stitch_fills_pixels_outside_the_polygon():
+    roi = c_roi.ROI('triangle', polygon=[(-61, 19), (-59, 19), (-59, 21)])
+    arrays = {tilename: np.zeros(roi.get_window_shape(tilename), dtype='u2') for tilename in roi.get_tilenames()}
+
+    stitched = roi.stitch(arrays, 65535)
+
+    # Every pixel is either inside the mask of its tile (0) or fill
+    assert stitched.shape == (480, 480)
+    for tilename in roi.get_tilenames():
+        row, col = roi.get_tile_offset(tilename)
+        rows, cols = roi.get_window_shape(tilename)
+        assert np.array_equal(stitched[row:row + rows, col:col + cols] == 0, roi.get_mask(tilename))
+
+
+def test_tile_pixel_of_a_lon_lat():
+    roi = c_roi.get_puerto_rico_roi()
+
+    # The corners of the window, and a pixel inside it
+    for row, col in [(0, 0), (219, 679), (100, 300)]:
+        assert roi.get_tile_pixel(*get_pixel_centre('h11v07', 300 + row, 480 + col)) == ('h11v07', row, col)
+    # Just outside the window, and in another tile
+    assert roi.get_tile_pixel(*get_pixel_centre('h11v07', 299, 480)) is None
+    assert roi.get_tile_pixel(*get_pixel_centre('h11v07', 300, 1160)) is None
+    assert roi.get_tile_pixel(*get_pixel_centre('h12v07', 300, 480)) is None
+
+    # Pixels outside a polygon are outside the ROI
+    triangle = c_roi.ROI('triangle', polygon=[(-61, 19), (-59, 19), (-59, 21)])
+    assert triangle.get_tile_pixel(-59.099, 19.099) == ('h12v07', 216, 216)
+    assert triangle.get_tile_pixel(-60.9, 20.9) is None
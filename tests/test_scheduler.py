@@ -0,0 +1,85 @@
+import threading
+import requests
+import c_scheduler
+from time import sleep, monotonic
+from http.server import BaseHTTPRequestHandler
+
+
+# Make a handler that answers /{status code}/{name} slowly, recording the requests in flight when each starts
+def make_handler(delay=0.1):
+
+    class SlowHandler(BaseHTTPRequestHandler):
+
+        # Requests in flight, and (start time, path, requests already in flight) for each request
+        in_flight = 0
+        starts = []
+        lock = threading.Lock()
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            with SlowHandler.lock:
+                SlowHandler.starts.append((monotonic(), self.path, SlowHandler.in_flight))
+                SlowHandler.in_flight += 1
+            sleep(delay)
+            with SlowHandler.lock:
+                SlowHandler.in_flight -= 1
+            self.send_response(int(self.path.split('/')[1]))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+    return SlowHandler
+
+
+# Make work that gets a URL and reports its status code to the scheduler (recording the time, code and limit after)
+def make_func(scheduler, observations):
+
+    def func(url):
+        status_code = requests.get(url).status_code
+        scheduler.observe_status(status_code)
+        observations.append((monotonic(), status_code, scheduler.limit))
+        return status_code
+
+    return func
+
+
+def test_busy_host_does_not_hold_up_other_hosts(local_server):
+    busy_handler, idle_handler = make_handler(), make_handler()
+    busy_url, idle_url = local_server(busy_handler), local_server(idle_handler)
+    scheduler = c_scheduler.DownloadScheduler(max_workers=4, per_host_limit=2)
+    # The busy host's work is queued first
+    list_of_work = [f'{busy_url}200/{i}' for i in range(8)] + [f'{idle_url}200/{i}' for i in range(4)]
+
+    results = list(scheduler.run(make_func(scheduler, []), list_of_work))
+
+    assert sorted(work for work, result in results) == sorted(list_of_work)
+    assert all(result == 200 for work, result in results)
+    # Neither host had more than its limit in flight
+    assert max(in_flight for start_time, path, in_flight in busy_handler.starts) < 2
+    assert max(in_flight for start_time, path, in_flight in idle_handler.starts) < 2
+    # The idle host started while the busy host still had work waiting (its first two slots were free)
+    assert idle_handler.starts[1][0] < busy_handler.starts[2][0]
+
+
+def test_throttling_halves_concurrency_then_adds_back(local_server):
+    handler = make_handler(delay=0.2)
+    base_url = local_server(handler)
+    scheduler = c_scheduler.DownloadScheduler(max_workers=8, cooldown=60)
+    observations = []
+    list_of_work = [f'{base_url}503/0'] + [f'{base_url}200/{i}' for i in range(23)]
+
+    results = list(scheduler.run(make_func(scheduler, observations), list_of_work))
+
+    assert len(results) == 24
+    limits = sorted(limit for observe_time, status_code, limit in observations)
+    # One cut to half (the cooldown stops the responses in flight cutting again), then back up one at a time
+    assert limits[0] == 4
+    assert all(later - earlier <= 1 for earlier, later in zip(limits, limits[1:]) if later < 8)
+    assert scheduler.limit > 4
+    # Before the cut all 8 workers were in flight, just after it no more than the halved limit (plus one added back)
+    # (requests taken just before the cut are given a moment to reach the server)
+    cut_time = next(observe_time for observe_time, status_code, limit in observations if status_code == 503)
+    assert max(in_flight for start_time, path, in_flight in handler.starts if start_time < cut_time) == 7
+    assert max((in_flight for start_time, path, in_flight in handler.starts
+                if cut_time + 0.02 < start_time < cut_time + 0.1), default=0) <= 4
@@ -0,0 +1,70 @@
+import requests
+import c_session
+from http.server import BaseHTTPRequestHandler
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Handler answering /{status code} with that status code
+class StatusHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.send_response(int(self.path.strip('/')))
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+# Make a provider counting its credential refreshes
+def make_provider():
+
+    refreshes = []
+    provider = c_session.SessionProvider(requests.session, refresh_func=lambda: refreshes.append(1))
+
+    return provider, refreshes
+
+
+def test_other_failures_only_replace_the_thread_session(local_server):
+    base_url = local_server(StatusHandler)
+    provider, refreshes = make_provider()
+    old_session = provider.get_session()
+    old_session.get(base_url + '404')
+
+    new_session = provider.refresh_session()
+
+    assert new_session is not old_session
+    assert refreshes == []
+    assert provider.generation == 0
+    assert provider.sessions == [new_session]
+
+
+def test_refused_credentials_refresh_every_session(local_server):
+    base_url = local_server(StatusHandler)
+    provider, refreshes = make_provider()
+    old_session = provider.get_session()
+    old_session.get(base_url + '401')
+
+    new_session = provider.refresh_session()
+
+    assert new_session is not old_session
+    assert refreshes == [1]
+    assert provider.generation == 1
+    assert provider.sessions == [new_session]
+
+
+def test_close_drops_sessions_of_finished_threads():
+    provider, refreshes = make_provider()
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        thread_sessions = list(executor.map(lambda i: provider.get_session(), range(4)))
+    assert all(session in provider.sessions for session in thread_sessions)
+
+    provider.close()
+
+    assert provider.sessions == []
+    # Threads get a new session on their next request
+    session = provider.get_session()
+    assert session not in thread_sessions
+    assert provider.sessions == [session]
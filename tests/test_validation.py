@@ -0,0 +1,81 @@
+import h5py
+import numpy as np
+import t_validation
+from os.path import getsize
+
+
+# Group holding the datasets of the test granules
+GROUP_PATH = 'HDFEOS/GRIDS/VNP_Grid_DNB/Data Fields'
+DATASET_NAMES = ['DNB_BRDF-Corrected_NTL', 'Mandatory_Quality_Flag']
+
+
+# Write a small HDF5 granule with the named datasets (optionally after a user block)
+def make_granule(file_path, dataset_names=DATASET_NAMES, userblock_size=0):
+    with h5py.File(file_path, 'w', userblock_size=userblock_size) as h5file:
+        group = h5file.create_group(GROUP_PATH)
+        for name in dataset_names:
+            group.create_dataset(name, data=np.zeros((4, 4), dtype='u2'))
+    return file_path
+
+
+# Validate a file to a level against the test group and datasets
+def validate(file_path, level, expected_size=None):
+    return t_validation.validate_file_hdf5(file_path,
+                                           level=level,
+                                           expected_size=expected_size,
+                                           group_path=GROUP_PATH,
+                                           dataset_names=DATASET_NAMES)
+
+
+def test_valid_granule_passes_every_level(tmp_path):
+    file_path = make_granule(tmp_path / 'a.h5')
+
+    for level in t_validation.get_validation_levels():
+        assert validate(file_path, level, expected_size=getsize(file_path))
+
+
+def test_signature_is_found_after_a_user_block(tmp_path):
+    file_path = make_granule(tmp_path / 'a.h5', userblock_size=1024)
+
+    assert t_validation.check_hdf5_signature(file_path)
+    assert validate(file_path, 'deep', expected_size=getsize(file_path))
+
+
+def test_each_level_catches_its_failure(tmp_path):
+    # Not an HDF5 (e.g. an HTML error page) fails from the signature level up
+    html_path = tmp_path / 'html.h5'
+    html_path.write_bytes(b'<html>Service Unavailable</html>' * 100)
+    assert validate(html_path, 'none')
+    assert [validate(html_path, level) for level in ['signature', 'size', 'deep']] == [False] * 3
+
+    # A truncated download fails from the size level up
+    file_path = make_granule(tmp_path / 'a.h5')
+    size = getsize(file_path)
+    assert validate(file_path, 'signature', expected_size=size + 1)
+    assert not validate(file_path, 'size', expected_size=size + 1)
+    assert not validate(file_path, 'deep', expected_size=size + 1)
+    # (unless the catalog does not know the size)
+    assert validate(file_path, 'size', expected_size=-1)
+
+    # A granule missing a dataset only fails deep validation
+    missing_path = make_granule(tmp_path / 'missing.h5', dataset_names=DATASET_NAMES[:1])
+    size = getsize(missing_path)
+    assert validate(missing_path, 'size', expected_size=size)
+    assert not validate(missing_path, 'deep', expected_size=size)
+
+
+def test_unknown_level_fails(tmp_path):
+    file_path = make_granule(tmp_path / 'a.h5')
+
+    assert not validate(file_path, 'thorough')
+
+
+def test_quarantine_keeps_the_file_aside(tmp_path):
+    file_path = make_granule(tmp_path / 'a.h5')
+    content = file_path.read_bytes()
+
+    assert t_validation.quarantine_file(file_path) == tmp_path / 'a.h5.invalid'
+    assert not file_path.exists()
+    assert (tmp_path / 'a.h5.invalid').read_bytes() == content
+    # Nothing to move
+    assert t_validation.quarantine_file(file_path) is None
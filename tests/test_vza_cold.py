@@ -0,0 +1,163 @@
+import pytest
+import numpy as np
+import t_vza_cold
+
+
+# Reverse the 16 bits of a value as a string (lowest bit first), as the original decoding did
+def get_reversed_bits(value):
+
+    return bin(value)[2:].zfill(16)[::-1]
+
+
+# The original get_mask_hash_table (string slicing over the values below 2100), for reference
+def get_original_mask_hash_table(qf_dict, mask_dict):
+
+    qf_dict = {qf_key: qf_dict[qf_key] for qf_key in qf_dict.keys() if qf_key != 'Fill Value'}
+    mask_list = []
+    for value in range(2100):
+        reversed_bits = get_reversed_bits(value)
+        match = True
+        for qf_key in qf_dict.keys():
+            code = reversed_bits[qf_dict[qf_key][0]]
+            if code not in qf_dict[qf_key][1].keys():
+                match = False
+                break
+            if qf_key in mask_dict.keys():
+                if isinstance(mask_dict[qf_key], list):
+                    if qf_dict[qf_key][1][code] not in mask_dict[qf_key]:
+                        match = False
+                        break
+                elif qf_dict[qf_key][1][code] != mask_dict[qf_key]:
+                    match = False
+                    break
+        if match:
+            mask_list.append(value)
+
+    return mask_list
+
+
+# The original unpack_qf, for reference (raises KeyError for codes missing from the spec, other than 100)
+def get_original_unpack_qf(qf, qf_dict, fill_value=None):
+
+    if qf == fill_value:
+        return None
+    reversed_bits = get_reversed_bits(qf)
+    results_dict = {}
+    for qf_key in qf_dict.keys():
+        if qf_key == 'Fill Value':
+            continue
+        if reversed_bits[qf_dict[qf_key][0]] == '100':
+            continue
+        results_dict[qf_key] = qf_dict[qf_key][1][reversed_bits[qf_dict[qf_key][0]]]
+
+    return results_dict
+
+
+# Keep lookup tables in a temporary directory, and out of the in-memory cache
+@pytest.fixture(autouse=True)
+def support_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv('support_dir', str(tmp_path))
+    monkeypatch.setattr(t_vza_cold, 'mask_luts', {})
+    return tmp_path
+
+
+def test_mask_codes_below_2100_match_the_original_decoding():
+    qf_dict = t_vza_cold.get_vnp_qf_dict()
+    mask_dict = t_vza_cold.get_vza_cold_qf_dict()
+
+    original = get_original_mask_hash_table(qf_dict, mask_dict)
+    table = t_vza_cold.get_mask_hash_table(qf_dict, mask_dict)
+
+    assert len(original) == 80
+    assert [value for value in table if value < 2100] == original
+    # The caller's spec is left alone
+    assert qf_dict == t_vza_cold.get_vnp_qf_dict()
+
+
+def test_unpack_matches_the_original_decoding():
+    qf_dict = t_vza_cold.get_vnp_qf_dict()
+
+    for value in range(65536):
+        try:
+            original = get_original_unpack_qf(value, qf_dict, fill_value=65535)
+        # (the original raised for codes missing from the spec, which are now skipped)
+        except KeyError:
+            continue
+        assert t_vza_cold.unpack_qf(value, qf_dict, fill_value=65535) == original
+
+
+def test_decoded_fields_match_the_bits():
+    qf_dict = t_vza_cold.get_vnp_qf_dict()
+    qf_array = np.arange(65536, dtype='uint16').reshape((256, 256))
+
+    decoded = t_vza_cold.decode_qf_array(qf_array, qf_dict)
+
+    assert sorted(decoded.keys()) == sorted(qf_key for qf_key in qf_dict.keys() if qf_key != 'Fill Value')
+    for qf_key in decoded.keys():
+        qf_slice = qf_dict[qf_key][0]
+        expected = [t_vza_cold.get_code_int(get_reversed_bits(value)[qf_slice]) for value in range(65536)]
+        assert decoded[qf_key].ravel().tolist() == expected
+
+
+@pytest.mark.parametrize('buffer', [1, 2, 5])
+@pytest.mark.parametrize('connectivity', [4, 8])
+def test_dilation_matches_scipy(buffer, connectivity):
+    ndimage = pytest.importorskip('scipy.ndimage')
+    rng = np.random.default_rng(buffer)
+    # A (time, row, col) stack with sparse pixels, some on the edges
+    mask = rng.random((3, 40, 50)) < 0.01
+    mask[0, 0, 0] = mask[1, -1, 25] = mask[2, 20, -1] = True
+    # Structure of one date: a cross (4) or a square (8) iterated buffer times, so nothing crosses dates
+    structure = np.zeros((3, 3, 3), dtype=bool)
+    structure[1] = ndimage.generate_binary_structure(2, connectivity // 4)
+
+    expected = ndimage.binary_dilation(mask, structure=structure, iterations=buffer)
+
+    assert np.array_equal(t_vza_cold.dilate_mask(mask, buffer, connectivity), expected)
+    # Each date dilates as it would alone
+    assert np.array_equal(t_vza_cold.dilate_mask(mask[1], buffer, connectivity), expected[1])
+
+
+def test_mask_by_list_buffers_matches_then_adds_fills():
+    qf_dict = t_vza_cold.get_vnp_qf_dict()
+    mask_dict = t_vza_cold.get_vza_cold_qf_dict()
+    table = t_vza_cold.get_mask_hash_table(qf_dict, mask_dict)
+    # Clear (day, land, high quality, confident clear) everywhere, one cloudy pixel and one fill
+    qf_array = np.full((2, 9, 9), t_vza_cold.get_code_int('0000110000'), dtype='uint16')
+    qf_array[1, 4, 4] = table[0]
+    qf_array[0, 0, 8] = 65535
+
+    mask = t_vza_cold.qf_mask_by_list(qf_array, qf_dict, mask_dict, buffer=2, mask_fills=True)
+
+    expected = np.zeros(qf_array.shape, dtype=bool)
+    expected[1, 2:7, 2:7] = True
+    # (fills are masked but not buffered)
+    expected[0, 0, 8] = True
+    assert mask.dtype == bool
+    assert np.array_equal(mask, expected)
+
+
+def test_lookup_table_matches_decoding_and_is_reloaded(support_dir, monkeypatch):
+    qf_dict = t_vza_cold.get_vnp_qf_dict()
+    mask_dict = t_vza_cold.get_vza_cold_qf_dict()
+
+    lut = t_vza_cold.get_mask_lut(qf_dict, mask_dict, cache_dir=support_dir)
+
+    # Every uint16 value is masked as the decoding matches it
+    assert lut.shape == (65536,)
+    assert np.array_equal(lut, t_vza_cold.match_qf_array(np.arange(65536, dtype='uint16'), qf_dict, mask_dict))
+    lut_path = support_dir / f'qf_mask_lut_{t_vza_cold.get_mask_rule_hash(qf_dict, mask_dict)}.npy'
+    assert [path.name for path in support_dir.iterdir()] == [lut_path.name]
+
+    # Without the in-memory table, it is read back from disk rather than rebuilt
+    match_qf_array = t_vza_cold.match_qf_array
+    monkeypatch.setattr(t_vza_cold, 'mask_luts', {})
+    monkeypatch.setattr(t_vza_cold, 'match_qf_array', lambda *args: pytest.fail('Lookup table was rebuilt.'))
+    assert np.array_equal(t_vza_cold.get_mask_lut(qf_dict, mask_dict, cache_dir=support_dir), lut)
+    monkeypatch.setattr(t_vza_cold, 'match_qf_array', match_qf_array)
+
+    # A malformed table on disk is rebuilt
+    monkeypatch.setattr(t_vza_cold, 'mask_luts', {})
+    np.save(lut_path, np.zeros(10, dtype=bool))
+    assert np.array_equal(t_vza_cold.get_mask_lut(qf_dict, mask_dict, cache_dir=support_dir), lut)
+    assert np.load(lut_path).shape == (65536,)